@@ -133,6 +133,14 @@ class Shapes(WebViewMixin):
 
     def __init__(self):
         super().__init__(webview_size=DEFAULT_SIZE, webview_frame_rate=FRAME_RATE)
+        # retained shapes are recorded once and stored by the client
+        self.open_shape, self.closed_shape = (self.webview.createShape() for _ in range(2))
+        for s, close in ((self.open_shape, False), (self.closed_shape, True)):
+            s.beginShape()
+            s.vertex(30, 20)
+            s.vertex(85, 20)
+            s.vertex(85, 75)
+            s.endShape(close)
 
     def draw(self, ctx):
         ctx.background(200)
@@ -156,19 +164,19 @@ class Shapes(WebViewMixin):
 
         with ctx.pushContext():
             ctx.noFill()
-            ctx.translate(ctx.width * 0.2, ctx.height * 0.6)
-            shape()
+            ctx.shape(self.open_shape, ctx.width * 0.2, ctx.height * 0.6)
 
         with ctx.pushContext():
             ctx.noStroke()
-            ctx.translate(ctx.width * 0.5, ctx.height * 0.6)
-            shape(close=True)
+            ctx.shape(self.closed_shape, ctx.width * 0.5, ctx.height * 0.6)
 
 
 class Text(WebViewMixin):
 
     def __init__(self):
-        super().__init__(webview_size=DEFAULT_SIZE, webview_frame_rate=FRAME_RATE)
+        # static content, so send only frame changes
+        super().__init__(webview_size=DEFAULT_SIZE, webview_frame_rate=FRAME_RATE,
+                         webview_diff=True)
 
     def draw(self, ctx):
         ctx.background(0)
@@ -341,7 +349,9 @@ class Follow3(WebViewMixin):
     """Based on Processing "Follow3" example"""
 
     def __init__(self):
-        super().__init__(webview_size=DEFAULT_SIZE, webview_frame_rate=FRAME_RATE)
+        # coordinates are computed floats, so limit their precision
+        super().__init__(webview_size=DEFAULT_SIZE, webview_frame_rate=FRAME_RATE,
+                         webview_precision=1)
         self.segLength = 15
         num_segments = 13
         self.x = [0.0] * num_segments
@@ -372,15 +382,45 @@ class Follow3(WebViewMixin):
             self.dragSegment(ctx, i + 1, x[i], y[i])
 
 
+class Particles(WebViewMixin):
+    """Batch primitives, drawing many elements with a single call each"""
+
+    def __init__(self):
+        # (encode frames in a worker thread, off the event loop)
+        super().__init__(webview_size=DEFAULT_SIZE, webview_frame_rate=FRAME_RATE,
+                         webview_threaded=True)
+        self.n = 500
+        self.colors = [Color(i % 256, 100, 255 - i % 256, 200) for i in range(self.n)]
+
+    def draw(self, ctx):
+        ctx.background(0)
+        t = time.time()
+        cx, cy = ctx.width / 2, ctx.height / 2
+        # (a NumPy array of shape (n, 2) may be passed instead of a flat list)
+        coords = []
+        for i in range(self.n):
+            r = 20 + i * 0.2
+            a = t + i * 0.1
+            coords += (cx + r * math.cos(a), cy + r * math.sin(a) * 0.8)
+        ctx.noStroke()
+        ctx.circles(coords, 4, self.colors)
+        ctx.stroke(255, 80)
+        ctx.polyline(coords[:100])
+
+
 async def async_main():
     async with anyio.create_task_group() as tg:
-        server = WebViewServer()
+        # compress messages to clients, keeping context across frames
+        server = WebViewServer(compression_level=6)
         await tg.start(server.serve, "Web view example", 'localhost', PORT)
         viz_obs = {}
-        for cls in (Hello, Clock, Arcs, Text, StrokeCaps, Shapes, Words):
+        for cls in (Hello, Clock, Arcs, Text, StrokeCaps, Shapes, Words, Particles):
             obj = cls()
             tg.start_soon(obj.webview.serve, server)
             viz_obs[obj.webview.name] = obj
+        # dashboard of what the views cost, and of event loop health
+        tg.start_soon(server.serve_overhead_view)
+        tg.start_soon(server.serve_loop_view)
 
         await server.add_repl(WebRepl(dict(hello_pycon='😊',
                                            clock=viz_obs['Clock'])))
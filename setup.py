@@ -31,8 +31,14 @@ async app while it's running.
         'hypercorn',
         'quart >= 0.14.0',
         'sniffio',
+        'wsproto',  # for the websocket client of the relay and load test
     ],
     extras_require={
+        # for DrawContext.imageArray()
+        'array': [
+            'numpy',
+            'Pillow',
+        ],
         'trio': [
             'anyio[trio] ~= 3.0.0',
             'hypercorn[trio]',
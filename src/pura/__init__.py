@@ -15,9 +15,17 @@ Summary of important webview classes:
   * WebViewServer - provides a networking endpoint for webview clients and
     routes connections to the corresponding views.
 
+  * OverheadView - dashboard view of the cost of a server's views, e.g.
+    served with WebViewServer.serve_overhead_view().
+
+  * LoopView - view of event loop lag, stalls, and tasks, e.g. served with
+    WebViewServer.serve_loop_view().
+
 Be sure to check the documentation of each class.
 """
 
+from ._dashboard import OverheadView
+from ._loop_view import LoopView
 from ._repl import WebRepl
 from ._version import __version__
 from ._web_view import WebView, WebViewMixin, DrawContext, Color, KeyboardKey, TextAlign, StrokeCap
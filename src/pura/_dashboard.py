@@ -0,0 +1,99 @@
+import time
+from collections import deque
+
+from ._web_view import DrawContext, TextAlign, WebViewMixin
+
+_ROW_HEIGHT = 36
+_HEADER_HEIGHT = 60
+_PLOT_WIDTH = 120
+
+
+class OverheadView(WebViewMixin):
+    """Live dashboard of what the views of a WebViewServer cost
+
+    For each registered view it plots the frame rate, and shows draw time,
+    bytes sent per second, and connected peers.  The header plots the share
+    of event loop time used by all views, and loop lag (see FrameScheduler).
+
+    Values are sampled once per frame from the views' cumulative metrics (see
+    ViewMetrics), and the view is drawn with a handful of batched commands,
+    so it's cheap enough to leave running.
+
+    Usage: tg.start_soon(server.serve_overhead_view)
+    """
+
+    HISTORY = 60  # samples plotted
+
+    def __init__(self, server, **kwargs):
+        """
+        :param server: WebViewServer whose views to show
+        :param kwargs: WebViewMixin options, e.g. webview_size
+        """
+        kwargs.setdefault('webview_name', 'pura overhead')
+        kwargs.setdefault('webview_size', (480, 360))
+        kwargs.setdefault('webview_frame_rate', 2)
+        kwargs.setdefault('webview_precision', 1)
+        kwargs.setdefault('webview_priority', 1)
+        super().__init__(**kwargs)
+        self._server = server
+        self._samples = {}  # view name: (time, frames, bytes sent, draw time sum)
+        self._fpsHistory = {}  # view name: deque
+        self._loadHistory = deque(maxlen=self.HISTORY)
+
+    def _plot(self, ctx, history, x, y, h, *, y_max):
+        step = _PLOT_WIDTH / (self.HISTORY - 1)
+        coords = []
+        for i, value in enumerate(history):
+            coords += (x + i * step, y + h - h * min(value / y_max, 1))
+        if len(coords) >= 4:
+            ctx.polyline(coords)
+
+    def draw(self, ctx: DrawContext):
+        server = self._server
+        scheduler = server.scheduler
+        now = time.monotonic()
+        plot_x = ctx.width - _PLOT_WIDTH - 10
+        ctx.background(32)
+        ctx.textSize(12)
+        ctx.textAlign(TextAlign.LEFT, TextAlign.TOP)
+        ctx.noFill()
+
+        self._loadHistory.append(scheduler.load)
+        ctx.stroke(255, 160, 0)
+        self._plot(ctx, self._loadHistory, plot_x, 10, _HEADER_HEIGHT - 25,
+                   y_max=max(scheduler._loadBudget or .05, *self._loadHistory))
+        ctx.fill(255)
+        ctx.text(f'pura loop time: {scheduler.load:.1%}', 10, 10)
+        ctx.text(f'loop lag: {scheduler.lag * 1000:.1f} ms   '
+                 f'missed deadlines: {scheduler.missed_deadlines}', 10, 28)
+
+        views = [(name, view_ctx) for name, view_ctx in server.webviews
+                 if hasattr(view_ctx, 'metrics')]
+        max_rows = (ctx.height - _HEADER_HEIGHT) // _ROW_HEIGHT
+        for row, (name, view_ctx) in enumerate(views[:max_rows]):
+            metrics = view_ctx.metrics
+            sample = (now, metrics.frames, metrics.bytes_sent, metrics.draw_time.sum)
+            prev = self._samples.get(name, sample)
+            self._samples[name] = sample
+            dt = (now - prev[0]) or 1
+            frames = metrics.frames - prev[1]
+            fps = frames / dt
+            bytes_per_sec = (metrics.bytes_sent - prev[2]) / dt
+            draw_ms = (metrics.draw_time.sum - prev[3]) / frames * 1000 if frames else 0
+            history = self._fpsHistory.get(name)
+            if history is None:
+                history = self._fpsHistory[name] = deque(maxlen=self.HISTORY)
+            history.append(fps)
+
+            y = _HEADER_HEIGHT + row * _ROW_HEIGHT
+            ctx.noFill()
+            ctx.stroke(80, 180, 255)
+            self._plot(ctx, history, plot_x, y, _ROW_HEIGHT - 8, y_max=view_ctx._frame_rate)
+            ctx.noStroke()
+            ctx.fill(255)
+            ctx.text(name, 10, y)
+            ctx.fill(180)
+            ctx.text(f'{fps:.1f} fps   {draw_ms:.2f} ms   {bytes_per_sec / 1000:.1f} kB/s   '
+                     f'{len(view_ctx._peers)} peers', 10, y + 15)
+        if len(views) > max_rows:
+            ctx.text(f'(+{len(views) - max_rows} views)', 10, ctx.height - 16)
@@ -0,0 +1,94 @@
+# how far ahead (in commands of either frame) a changed span is searched for
+# a common command before it's replaced positionally
+RESYNC_WINDOW = 8
+
+
+def _resync(prev, cur, i, j):
+    """Return nearest (i, j) beyond a change where the frames match again, or None
+
+    A match must be of two consecutive commands (or one at the end of a
+    frame), so that commands repeated throughout the frame (e.g. SAVE)
+    don't resync spuriously.
+    """
+    n_prev, n_cur = len(prev), len(cur)
+    # (fast path for a single changed command, the most common edit)
+    if i + 2 < n_prev and j + 2 < n_cur and prev[i + 1] == cur[j + 1] \
+            and prev[i + 2] == cur[j + 2]:
+        return i + 1, j + 1
+    for distance in range(1, 2 * RESYNC_WINDOW + 1):
+        for di in range(max(0, distance - RESYNC_WINDOW), min(distance, RESYNC_WINDOW) + 1):
+            i2, j2 = i + di, j + distance - di
+            if i2 >= n_prev or j2 >= n_cur:
+                continue
+            if prev[i2] == cur[j2] and (i2 + 1 == n_prev or j2 + 1 == n_cur
+                                        or prev[i2 + 1] == cur[j2 + 1]):
+                return i2, j2
+    return None
+
+
+def frame_edits(prev, cur):
+    """Return edit script transforming previous frame commands into the current
+
+    Edits are (start, end, commands) tuples in ascending order, each replacing
+    prev[start:end] with the given commands.  The list is empty if the frames
+    are identical.
+
+    Time is linear in the size of the frames: a changed span is resynced
+    within a bounded window (see RESYNC_WINDOW), beyond which commands are
+    replaced positionally.  So the script isn't minimal for large
+    insertions or deletions in the middle of the frame.
+    """
+    if prev == cur:
+        return []
+    # trim common head and tail, which is typically most of the frame
+    n = min(len(prev), len(cur))
+    head = 0
+    while head < n and prev[head] == cur[head]:
+        head += 1
+    tail = 0
+    while tail < n - head and prev[-1 - tail] == cur[-1 - tail]:
+        tail += 1
+    a = prev[head:len(prev) - tail]
+    b = cur[head:len(cur) - tail]
+    edits = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            i += 1
+            j += 1
+            continue
+        start_i, start_j = i, j
+        while True:
+            match = _resync(a, b, i, j)
+            if match is not None:
+                i, j = match
+                break
+            i += RESYNC_WINDOW
+            j += RESYNC_WINDOW
+            if i >= len(a) or j >= len(b):
+                i, j = len(a), len(b)
+                break
+        edits.append((head + start_i, head + i, b[start_j:j]))
+    if i < len(a) or j < len(b):
+        edits.append((head + i, head + len(a), b[j:]))
+    return edits
+
+
+def edits_cost(edits):
+    """Return size of the given edit script, in commands
+
+    The (start, end) header of each edit is counted as a command.
+    """
+    return sum(len(commands) + 1 for _, _, commands in edits)
+
+
+def apply_edits(prev, edits):
+    """Return frame commands given previous frame and edit script (see frame_edits())"""
+    cur = []
+    i = 0
+    for start, end, commands in edits:
+        cur.extend(prev[i:start])
+        cur.extend(commands)
+        i = end
+    cur.extend(prev[i:])
+    return cur
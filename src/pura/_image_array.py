@@ -0,0 +1,187 @@
+"""Encoding of arrays as images, for DrawContext.imageArray()
+
+Requires NumPy (see the "array" extra of the package).  PNG and raw RGBA are
+encoded directly, while JPEG and WebP require Pillow.
+"""
+
+import io
+import struct
+import zlib
+from typing import Dict
+
+import numpy
+
+from ._protocol import ImageFormat, Op
+
+FORMATS = ('auto', 'raw', 'png', 'jpeg', 'webp')
+# arrays up to this many pixels are sent as raw RGBA by the 'auto' format
+RAW_MAX_PIXELS = 64 * 64
+
+# colors of named colormaps at evenly spaced positions, interpolated to 256
+# entries
+_COLORMAP_ANCHORS = {
+    'gray': ((0, 0, 0), (255, 255, 255)),
+    'viridis': ((68, 1, 84), (72, 40, 120), (62, 74, 137), (49, 104, 142), (38, 130, 142),
+                (31, 158, 137), (53, 183, 121), (110, 206, 88), (181, 222, 43), (253, 231, 37)),
+    'inferno': ((0, 0, 4), (40, 11, 84), (101, 21, 110), (159, 42, 99), (212, 72, 66),
+                (245, 125, 21), (250, 193, 39), (252, 255, 164)),
+}
+_luts: Dict[str, numpy.ndarray] = {}  # by colormap name
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}  # by channels
+
+
+def colormap_lut(colormap):
+    """Return (n, 3) or (n, 4) uint8 lookup table of the given colormap
+
+    :param colormap: name (e.g. 'viridis'), or a lookup table as any array
+      of shape (n, 3) or (n, 4)
+    """
+    if isinstance(colormap, str):
+        lut = _luts.get(colormap)
+        if lut is None:
+            try:
+                anchors = numpy.array(_COLORMAP_ANCHORS[colormap], dtype='f8')
+            except KeyError:
+                raise ValueError(f'unknown colormap "{colormap}"') from None
+            positions = numpy.linspace(0, 255, len(anchors))
+            lut = numpy.stack([numpy.interp(numpy.arange(256), positions, anchors[:, i])
+                               for i in range(3)], axis=1).round().astype('u1')
+            _luts[colormap] = lut
+        return lut
+    lut = numpy.asarray(colormap, dtype='u1')
+    if lut.ndim != 2 or lut.shape[1] not in (3, 4) or lut.shape[0] == 0:
+        raise ValueError('expected colormap of shape (n, 3) or (n, 4)')
+    return lut
+
+
+def apply_colormap(values, lut, vmin=None, vmax=None):
+    """Return (h, w, channels) uint8 pixels of scalar array mapped through lut
+
+    vmin..vmax (by default the range of the values) is scaled to the range of
+    the lookup table, and values beyond it are clipped.  NaN values are
+    transparent.
+    """
+    values = numpy.asarray(values, dtype='f4')
+    invalid = numpy.isnan(values)
+    has_invalid = invalid.any()
+    if vmin is None or vmax is None:
+        valid = values[~invalid] if has_invalid else values
+        if vmin is None:
+            vmin = float(valid.min()) if valid.size else 0.
+        if vmax is None:
+            vmax = float(valid.max()) if valid.size else 0.
+    top = len(lut) - 1
+    scale = top / (vmax - vmin) if vmax > vmin else 0.
+    indices = (values - vmin) * scale
+    if has_invalid:
+        indices[invalid] = 0
+    numpy.clip(indices, 0, top, out=indices)
+    pixels = lut[(indices + .5).astype(numpy.intp)]
+    if has_invalid:
+        if pixels.shape[2] == 3:
+            pixels = numpy.concatenate(
+                (pixels, numpy.full(pixels.shape[:2] + (1,), 255, dtype='u1')), axis=2)
+        pixels[invalid, 3] = 0
+    return pixels
+
+
+def encode_png(pixels, level=6):
+    """Return PNG of (h, w, channels) uint8 pixels
+
+    Rows use the "up" filter, which is cheap to compute and suits images
+    with vertical coherence.
+    """
+    height, width, channels = pixels.shape
+    rows = numpy.empty((height, width * channels + 1), dtype='u1')
+    rows[:, 0] = 2  # up filter
+    flat = pixels.reshape(height, -1)
+    rows[0, 1:] = flat[0]
+    numpy.subtract(flat[1:], flat[:-1], out=rows[1:, 1:])
+
+    def chunk(tag, data):
+        return b''.join([struct.pack('>I', len(data)), tag, data,
+                         struct.pack('>I', zlib.crc32(tag + data))])
+    header = struct.pack('>IIBBBBB', width, height, 8, _PNG_COLOR_TYPES[channels], 0, 0, 0)
+    return b''.join([_PNG_SIGNATURE, chunk(b'IHDR', header),
+                     chunk(b'IDAT', zlib.compress(rows.tobytes(), level)), chunk(b'IEND', b'')])
+
+
+def _pillow_image(format_):
+    """Return PIL.Image module, raising ImportError if Pillow isn't installed"""
+    try:
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise ImportError(f'{format_} encoding requires Pillow (pip install pura[array])') \
+            from None
+    return Image
+
+
+def _encode_pillow(pixels, format_, quality):
+    Image = _pillow_image(format_)  # pylint: disable=invalid-name
+    if format_ == 'jpeg' and pixels.shape[2] == 4:
+        pixels = pixels[:, :, :3]  # (no alpha)
+    f = io.BytesIO()
+    Image.fromarray(numpy.ascontiguousarray(pixels)).save(f, format=format_, quality=quality)
+    return f.getvalue()
+
+
+class ArrayImage:
+    """Image drawn by imageArray(), which is encoded when the frame is sent
+
+    encode() may be called from a worker thread, so arguments are validated
+    on construction.
+    """
+
+    __slots__ = ('_array', '_lut', '_vmin', '_vmax', '_format', '_quality', '_position')
+
+    def __init__(self, array, x, y, w, h, *, colormap, vmin, vmax, format_, quality):
+        array = numpy.asarray(array)
+        if array.ndim == 2:
+            if not (numpy.issubdtype(array.dtype, numpy.number)
+                    or array.dtype == numpy.bool_):
+                raise ValueError(f'expected numeric scalar array, not {array.dtype}')
+            self._lut = colormap_lut(colormap)
+            vmin = None if vmin is None else float(vmin)
+            vmax = None if vmax is None else float(vmax)
+        elif array.ndim == 3 and array.shape[2] in (3, 4) and array.dtype == numpy.uint8:
+            self._lut = None
+        else:
+            raise ValueError('expected uint8 array of shape (h, w, 3) or (h, w, 4), '
+                             'or scalar array of shape (h, w)')
+        if format_ not in FORMATS:
+            raise ValueError(f'unknown image format "{format_}"')
+        if format_ in ('jpeg', 'webp'):
+            if not (isinstance(quality, int) and 0 <= quality <= 100):
+                raise ValueError('expected quality of 0-100')
+            _pillow_image(format_)
+        height, width = array.shape[:2]
+        # (copied, since the caller may reuse the array before it's encoded)
+        self._array = array.copy()
+        self._vmin, self._vmax = vmin, vmax
+        self._format = format_
+        self._quality = quality
+        self._position = (x, y, width if w is None else w, height if h is None else h)
+
+    def encode(self):
+        """Return IMAGE_DATA command of the image"""
+        if self._lut is None:
+            pixels = self._array
+        else:
+            pixels = apply_colormap(self._array, self._lut, self._vmin, self._vmax)
+        height, width, channels = pixels.shape
+        format_ = self._format
+        if format_ == 'auto':
+            format_ = 'raw' if width * height <= RAW_MAX_PIXELS else 'png'
+        if format_ == 'raw':
+            if channels == 3:
+                pixels = numpy.concatenate(
+                    (pixels, numpy.full((height, width, 1), 255, dtype='u1')), axis=2)
+            code, data = ImageFormat.RGBA, numpy.ascontiguousarray(pixels).tobytes()
+        elif format_ == 'png':
+            code, data = ImageFormat.PNG, encode_png(pixels)
+        else:
+            code = ImageFormat.JPEG if format_ == 'jpeg' else ImageFormat.WEBP
+            data = _encode_pillow(pixels, format_, self._quality)
+        return (Op.IMAGE_DATA, code, width, height, data, *self._position)
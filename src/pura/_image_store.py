@@ -0,0 +1,103 @@
+"""Content-addressed store of images loaded by views
+
+Rather than being inlined into the draw command stream, images loaded with
+DrawContext.loadImage() are referenced by a hash of their content, and
+fetched by clients from the /img/<key> route of WebViewServer.  Since the
+content of a key never changes, browsers may cache it indefinitely, across
+reconnects and page reloads, and fetch many images in parallel.
+
+Entries are reference counted by the loaded images of views.  Unreferenced
+entries are kept (e.g. for an image loaded again, or fetched by a client
+late) while the store is within its memory bound, evicting the least
+recently used first.
+"""
+
+from collections import OrderedDict
+from hashlib import blake2b
+
+# (prefix, MIME type) of image formats
+_MAGIC = (
+    (b'\x89PNG', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+    (b'BM', 'image/bmp'),
+    (b'\x00\x00\x01\x00', 'image/x-icon'),
+)
+
+
+def image_key(data):
+    """Return content key (hex string) of image data"""
+    return blake2b(data, digest_size=16).hexdigest()
+
+
+def mime_type(data):
+    """Return MIME type of image data, by its signature"""
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    for magic, type_ in _MAGIC:
+        if data.startswith(magic):
+            return type_
+    # (browsers sniff the content of images anyway)
+    return 'image/png'
+
+
+class ImageStore:
+    """Reference counted image data by content key, with LRU eviction"""
+
+    def __init__(self, max_bytes=64 << 20):
+        """
+        :param max_bytes: size beyond which unreferenced entries are evicted.
+          Referenced entries are never evicted, so may exceed it.
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0  # of all entries
+        self.evictions = 0
+        self._entries = {}  # key: [data, references]
+        self._unreferenced = OrderedDict()  # key: None, least recently used first
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def add(self, data):
+        """Add a reference to the given image data, returning its key"""
+        key = image_key(data)
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = entry = [data, 0]
+            self.bytes += len(data)
+        elif entry[1] == 0:
+            del self._unreferenced[key]
+        entry[1] += 1
+        self._evict()
+        return key
+
+    def release(self, key):
+        """Remove a reference added by add()"""
+        entry = self._entries[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            self._unreferenced[key] = None
+            self._evict()
+
+    def get(self, key):
+        """Return data of the given key, or None if not in the store"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] == 0:
+            self._unreferenced.move_to_end(key)
+        return entry[0]
+
+    def _evict(self):
+        unreferenced = self._unreferenced
+        while self.bytes > self.max_bytes and unreferenced:
+            key, _ = unreferenced.popitem(last=False)
+            self.bytes -= len(self._entries.pop(key)[0])
+            self.evictions += 1
+
+
+# store of all views of the process, served by each WebViewServer
+image_store = ImageStore()
@@ -0,0 +1,202 @@
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import List
+
+import anyio
+import sniffio
+
+from ._metrics import Histogram
+from ._web_view import DrawContext, TextAlign, WebViewMixin
+
+# seconds
+LAG_BUCKETS = (.001, .002, .005, .01, .02, .05, .1, .2, .5)
+
+
+def _frame_location(frame):
+    code = frame.f_code
+    return f'{getattr(code, "co_qualname", code.co_name)} ' \
+           f'({os.path.basename(code.co_filename)}:{frame.f_lineno})'
+
+
+def await_point(coro):
+    """Return location of the innermost frame awaited by the given coroutine"""
+    frame = None
+    while coro is not None:
+        frame_ = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame_ is None:
+            break
+        frame = frame_
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return _frame_location(frame) if frame else '?'
+
+
+def _coroutine_names(frame):
+    """Return qualified names of coroutines in the stack, outermost first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        # (CO_* flags are defined dynamically by inspect)
+        if code.co_flags & inspect.CO_COROUTINE:  # pylint: disable=no-member
+            names.append(getattr(code, 'co_qualname', code.co_name))
+        frame = frame.f_back
+    return names[::-1]
+
+
+def current_coroutines(async_lib):
+    """Return the coroutines of all tasks of the current event loop"""
+    if async_lib == 'trio':
+        import trio  # pylint: disable=import-outside-toplevel,import-error
+        coros = []
+        tasks = [trio.lowlevel.current_root_task()]
+        while tasks:
+            task = tasks.pop()
+            coros.append(task.coro)
+            for nursery in task.child_nurseries:
+                tasks.extend(nursery.child_tasks)
+        return coros
+    if async_lib == 'asyncio':
+        import asyncio  # pylint: disable=import-outside-toplevel
+        return [task.get_coro() for task in asyncio.all_tasks()]
+    raise RuntimeError('unsupported async library:', async_lib)
+
+
+class LoopView(WebViewMixin):
+    """Live view of the health of the event loop
+
+    Shows a histogram of loop lag, a log of slow callbacks (loop stalls) with
+    the coroutines which were running, and a table of tasks grouped by
+    coroutine, with their counts and current await point.  Works with asyncio
+    and trio.
+
+    Sampling only happens while a client is viewing: run_sampler() probes loop
+    lag every `probe_interval`, and a watchdog thread samples the loop
+    thread's stack when it stalls beyond `slow_threshold`.
+
+    Usage: tg.start_soon(server.serve_loop_view)
+    """
+
+    MAX_TASK_ROWS = 12
+
+    def __init__(self, *, probe_interval=.01, slow_threshold=.1, **kwargs):
+        """
+        :param probe_interval: seconds between loop lag probes
+        :param slow_threshold: loop stalls longer than this are logged
+        :param kwargs: WebViewMixin options, e.g. webview_size
+        """
+        kwargs.setdefault('webview_name', 'event loop')
+        kwargs.setdefault('webview_size', (640, 480))
+        kwargs.setdefault('webview_frame_rate', 2)
+        super().__init__(**kwargs)
+        self._probeInterval = probe_interval
+        self._slowThreshold = slow_threshold
+        self._asyncLib = None
+        self.lag = Histogram(LAG_BUCKETS)  # since viewing started
+        self.maxLag = 0.
+        # (time, duration, coroutine names, location), newest last
+        self.slowLog = deque(maxlen=8)
+        # guards slowLog and _stallLogged, which the watchdog thread updates
+        self._slowLogLock = threading.Lock()
+        self._heartbeat = time.monotonic()
+        self._stallLogged = False
+
+    def _watch(self, stop, thread_id):
+        """Watchdog thread logging stacks of the loop thread while stalled"""
+        while not stop.wait(self._slowThreshold / 2):
+            stalled = time.monotonic() - self._heartbeat
+            if stalled > self._slowThreshold and not self._stallLogged:
+                frame = sys._current_frames().get(thread_id)  # pylint: disable=protected-access
+                if frame is not None:
+                    entry = [time.time(), stalled, _coroutine_names(frame),
+                             _frame_location(frame)]
+                    with self._slowLogLock:
+                        self._stallLogged = True
+                        self.slowLog.append(entry)
+
+    async def run_sampler(self):
+        """Task sampling loop health while the view has clients"""
+        self._asyncLib = sniffio.current_async_library()
+        ctx = self.webview._ctx
+        interval = self._probeInterval
+        while True:
+            await ctx._hasPeers.wait()
+            self.lag = Histogram(LAG_BUCKETS)
+            self.maxLag = 0.
+            self._heartbeat = time.monotonic()
+            stop = threading.Event()
+            watchdog = threading.Thread(target=self._watch, args=(stop, threading.get_ident()),
+                                        name='pura loop watchdog', daemon=True)
+            watchdog.start()
+            try:
+                while ctx._hasPeers.is_set():
+                    t = time.monotonic()
+                    await anyio.sleep(interval)
+                    now = time.monotonic()
+                    lag = max(0., now - t - interval)
+                    self.lag.observe(lag)
+                    self.maxLag = max(self.maxLag, lag)
+                    with self._slowLogLock:
+                        if self._stallLogged:
+                            # stall is over, so record its full duration
+                            self.slowLog[-1][1] = now - self._heartbeat
+                            self._stallLogged = False
+                    self._heartbeat = now
+            finally:
+                stop.set()
+
+    def draw(self, ctx: DrawContext):
+        ctx.background(32)
+        ctx.textSize(12)
+        ctx.textAlign(TextAlign.LEFT, TextAlign.TOP)
+        ctx.noStroke()
+
+        # lag histogram
+        lag = self.lag
+        n = sum(lag.counts)
+        ctx.fill(255)
+        ctx.text(f'{self._asyncLib or "?"} event loop lag ({n} probes, '
+                 f'max {self.maxLag * 1000:.1f} ms)', 10, 10)
+        bar_width = (ctx.width - 20) / len(lag.counts)
+        bar_height = 60
+        y = 30
+        coords: List[float] = []
+        for i, count in enumerate(lag.counts):
+            h = bar_height * count / n if n else 0
+            coords += (10 + i * bar_width + 1, y + bar_height - h, bar_width - 2, h)
+        ctx.fill(80, 180, 255)
+        ctx.rects(coords)
+        ctx.fill(180)
+        labels = [f'{bound * 1000:g}' for bound in lag.bounds] + ['inf']
+        for i, label in enumerate(labels):
+            ctx.text(f'≤{label} ms' if i == 0 else label, 10 + i * bar_width + 2,
+                     y + bar_height + 4)
+
+        # slow callbacks
+        y += bar_height + 26
+        ctx.fill(255)
+        ctx.text(f'loop stalls > {self._slowThreshold * 1000:g} ms', 10, y)
+        ctx.fill(255, 160, 0)
+        with self._slowLogLock:
+            slow_log = [tuple(entry) for entry in self.slowLog]
+        for t, duration, names, location in reversed(slow_log):
+            y += 15
+            chain = ' > '.join(names[-3:]) or '(no coroutine)'
+            ctx.text(f'{time.strftime("%H:%M:%S", time.localtime(t))}  '
+                     f'{duration * 1000:.0f} ms  {chain}  @ {location}', 10, y)
+
+        # tasks, grouped by coroutine
+        y += 26
+        if self._asyncLib is None:
+            return
+        coros = current_coroutines(self._asyncLib)
+        counts = Counter(getattr(coro, '__qualname__', repr(coro)) for coro in coros)
+        examples = {getattr(coro, '__qualname__', repr(coro)): coro for coro in coros}
+        ctx.fill(255)
+        ctx.text(f'{len(coros)} tasks', 10, y)
+        ctx.fill(180)
+        for name, count in counts.most_common(self.MAX_TASK_ROWS):
+            y += 15
+            ctx.text(f'{count:4d}  {name}  @ {await_point(examples[name])}', 10, y)
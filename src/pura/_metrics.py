@@ -0,0 +1,151 @@
+"""Prometheus-style metrics of webview internals
+
+Counters are kept in preallocated per-view structures (ViewMetrics), updated
+once per frame, and formatted in the Prometheus text exposition format only
+when scraped (see WebViewServer.get_blueprint()).
+"""
+
+import time
+from bisect import bisect_left
+
+from ._image_store import image_store
+
+# seconds
+TIME_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5)
+
+
+class Histogram:
+    """Histogram with fixed bucket upper bounds"""
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds=TIME_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # (last is +Inf)
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class ViewMetrics:
+    """Cumulative counters of a view, updated by the draw loop"""
+
+    __slots__ = ('frames', 'commands', 'bytes_raw', 'bytes_sent', 'dropped',
+                 'last_commands', 'last_bytes_sent', 'draw_time', 'send_time')
+
+    def __init__(self):
+        self.frames = 0
+        self.commands = 0
+        self.bytes_raw = 0
+        self.bytes_sent = 0
+        self.dropped = 0  # peer frame skips
+        self.last_commands = 0
+        self.last_bytes_sent = 0
+        self.draw_time = Histogram()
+        self.send_time = Histogram()
+
+    def record_frame(self, stats, draw_time, send_time):
+        """Record a sent frame, given its FrameStats"""
+        self.frames += 1
+        self.commands += stats.commands
+        self.bytes_raw += stats.bytes_raw
+        self.bytes_sent += stats.bytes_sent
+        self.dropped += stats.dropped
+        self.last_commands = stats.commands
+        self.last_bytes_sent = stats.bytes_sent
+        self.draw_time.observe(draw_time)
+        self.send_time.observe(send_time)
+
+
+def _label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class _Writer:
+
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, type_, help_, samples):
+        """Add metric given sequence of (labels, value)"""
+        lines = self.lines
+        lines.append(f'# HELP {name} {help_}')
+        lines.append(f'# TYPE {name} {type_}')
+        for labels, value in samples:
+            lines.append(f'{name}{labels} {value}')
+
+    def histogram(self, name, help_, samples):
+        """Add histogram metric given sequence of (labels, Histogram)"""
+        lines = self.lines
+        lines.append(f'# HELP {name} {help_}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in samples:
+            prefix = labels[:-1] + ',' if labels else '{'
+            cumulative = 0
+            for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{labels} {histogram.sum}')
+            lines.append(f'{name}_count{labels} {cumulative}')
+
+
+def format_metrics(server):
+    """Return metrics of the given WebViewServer and its views as text"""
+    # (name, draw context) of views, excluding the REPL, etc.
+    views = [(f'{{view="{_label(name)}"}}', ctx) for name, ctx in server.webviews
+             if hasattr(ctx, 'metrics')]
+    scheduler = server.scheduler
+    w = _Writer()
+    w.metric('process_cpu_seconds_total', 'counter', 'CPU time of the process, all threads.',
+             [('', time.process_time())])
+    w.metric('pura_views', 'gauge', 'Registered views.', [('', len(server.webviews))])
+    w.metric('pura_main_peers', 'gauge', 'Clients connected to the main socket.',
+             [('', len(server._peers))])
+    w.metric('pura_scheduler_wakeups_total', 'counter', 'Frame scheduler wakeups.',
+             [('', scheduler.wakeups)])
+    w.metric('pura_scheduler_load', 'gauge', 'Fraction of event loop time used by views.',
+             [('', scheduler.load)])
+    w.metric('pura_scheduler_lag_seconds', 'gauge', 'Maximum event loop lag.',
+             [('', scheduler.lag)])
+    w.metric('pura_image_store_bytes', 'gauge', 'Size of images in the image store.',
+             [('', image_store.bytes)])
+    w.metric('pura_image_store_evictions_total', 'counter',
+             'Unreferenced images evicted from the image store.', [('', image_store.evictions)])
+    w.metric('pura_view_peers', 'gauge', 'Clients connected to the view.',
+             [(labels, len(ctx._peers)) for labels, ctx in views])
+    w.metric('pura_view_frames_total', 'counter', 'Frames sent.',
+             [(labels, ctx.metrics.frames) for labels, ctx in views])
+    w.metric('pura_view_commands_total', 'counter', 'Draw commands sent.',
+             [(labels, ctx.metrics.commands) for labels, ctx in views])
+    w.metric('pura_view_bytes_raw_total', 'counter', 'Bytes encoded, before compression.',
+             [(labels, ctx.metrics.bytes_raw) for labels, ctx in views])
+    w.metric('pura_view_bytes_sent_total', 'counter', 'Bytes queued to clients.',
+             [(labels, ctx.metrics.bytes_sent) for labels, ctx in views])
+    w.metric('pura_view_last_frame_commands', 'gauge', 'Draw commands of the last frame.',
+             [(labels, ctx.metrics.last_commands) for labels, ctx in views])
+    w.metric('pura_view_last_frame_bytes', 'gauge', 'Bytes sent of the last frame.',
+             [(labels, ctx.metrics.last_bytes_sent) for labels, ctx in views])
+    w.histogram('pura_view_draw_seconds', 'Time to draw a frame.',
+                [(labels, ctx.metrics.draw_time) for labels, ctx in views])
+    w.histogram('pura_view_send_seconds', 'Time to encode and queue a frame.',
+                [(labels, ctx.metrics.send_time) for labels, ctx in views])
+    w.metric('pura_view_dropped_frames_total', 'counter',
+             'Frames skipped by clients due to backlog or pacing.',
+             [(labels, ctx.metrics.dropped) for labels, ctx in views])
+    w.metric('pura_view_discarded_frames_total', 'counter', 'Draw calls timed out.',
+             [(labels, ctx.discardedFrames) for labels, ctx in views])
+    w.metric('pura_view_missed_deadlines_total', 'counter', 'Frame deadlines missed.',
+             [(labels, ctx.missedDeadlines) for labels, ctx in views])
+    w.metric('pura_view_throttle', 'gauge', 'Frame rate divisor due to the render budget.',
+             [(labels, ctx.throttle) for labels, ctx in views])
+    w.metric('pura_view_send_queue_frames', 'gauge', 'Frames queued to clients.',
+             [(labels, sum(peer.queued_frames for peer in ctx._peers)) for labels, ctx in views])
+    w.metric('pura_view_receive_queue', 'gauge', 'Client messages awaiting the next frame.',
+             [(labels, len(ctx._receiveQueue)) for labels, ctx in views])
+    w.metric('pura_view_dropped_inputs_total', 'counter',
+             'Client messages dropped due to a full receive queue.',
+             [(labels, ctx.droppedInputs) for labels, ctx in views])
+    w.lines.append('')
+    return '\n'.join(w.lines)
@@ -0,0 +1,111 @@
+import json
+import logging
+
+import anyio
+
+from ._peer import Peer
+from ._protocol import channel_message, control_channel
+
+_logger = logging.getLogger(__name__)
+
+MUX_PATH = '_mux'
+MAX_CHANNEL_ID = 0xffff
+
+
+class Channel:
+    """Channel of a multiplexed websocket, standing in for the websocket of a peer"""
+
+    def __init__(self, mux, channel_id):
+        self.args = mux.websocket.args
+        self._mux = mux
+        self._id = channel_id
+
+    async def send(self, msg):
+        await self._mux.send(channel_message(self._id, msg))
+
+
+async def _run_sender(peer, *, task_status=anyio.TASK_STATUS_IGNORED):
+    with anyio.CancelScope() as scope:
+        task_status.started(scope)
+        await peer.run_sender()
+
+
+class Multiplexer:
+    """Websocket over which a client subscribes to many paths, as channels
+
+    Each channel has the peer state (encoding, diff, compression, pacing) of
+    a websocket of its own, with the options of the multiplexed websocket.
+    See _protocol.py for the message format.
+    """
+
+    def __init__(self, websocket, handlers_by_path, peer_options):
+        """
+        :param websocket: accepted quart websocket
+        :param handlers_by_path: handlers (views, etc.) which may be subscribed
+        :param peer_options: Peer options of each channel
+        """
+        self.websocket = websocket
+        self._handlersByPath = handlers_by_path
+        self._peerOptions = peer_options
+        self._channels = {}  # id: (peer, handler, cancel scope of sender)
+        self._sendLock = anyio.Lock()
+
+    async def send(self, data):
+        # (channel senders are separate tasks)
+        async with self._sendLock:
+            await self.websocket.send(data)
+
+    async def _subscribe(self, channel_id, path, tg):
+        handler = self._handlersByPath.get(path)
+        if handler is None:
+            _logger.warning('webview server: no handler for path "%s"', path)
+            return
+        if not 0 <= channel_id <= MAX_CHANNEL_ID or channel_id in self._channels:
+            _logger.warning('webview server: invalid channel %d', channel_id)
+            return
+        peer = Peer.from_websocket(Channel(self, channel_id), **self._peerOptions)
+        scope = await tg.start(_run_sender, peer)
+        self._channels[channel_id] = peer, handler, scope
+        await handler._handleConnected(peer)
+
+    def _unsubscribe(self, channel_id):
+        channel = self._channels.pop(channel_id, None)
+        if channel is not None:
+            peer, handler, scope = channel
+            handler._handleClose(peer)
+            scope.cancel()
+
+    async def _handleMessage(self, message, tg):
+        if message.startswith('{'):
+            msg = json.loads(message)
+            channel_id = int(msg.get('channel', -1))
+            msg_type = msg.get('type')
+            if msg_type == 'subscribe':
+                await self._subscribe(channel_id, msg['path'], tg)
+            elif msg_type == 'unsubscribe':
+                self._unsubscribe(channel_id)
+            return
+        # (channel message, which is only parsed by its handler if need be)
+        channel_id, _, message = message.partition(' ')
+        channel = self._channels.get(int(channel_id)) if channel_id.isdigit() else None
+        # (channel may have just been unsubscribed)
+        if channel is not None:
+            peer, handler, _ = channel
+            await handler._handleMessage(peer, message)
+
+    async def run(self):
+        """Process messages of the websocket until it's closed"""
+        async with anyio.create_task_group() as tg:
+            try:
+                while True:
+                    message = await self.websocket.receive()
+                    if isinstance(message, bytes):
+                        channel = self._channels.get(control_channel(message))
+                        if channel is not None:
+                            channel[0].handle_control(message)
+                    else:
+                        await self._handleMessage(message, tg)
+            finally:
+                for channel_id in list(self._channels):
+                    self._unsubscribe(channel_id)
+                tg.cancel_scope.cancel()
@@ -0,0 +1,170 @@
+import logging
+import math
+import time
+
+import anyio
+
+from ._protocol import compress_message, compressor, ControlKind, Protocol
+
+_logger = logging.getLogger(__name__)
+
+
+class Peer:
+    """Websocket client connection
+
+    Wraps the websocket along with options the client negotiated at connect
+    time via the query string of the websocket URL:
+
+        protocol: 'js' (default) or 'binary' draw command encoding
+        diff: '1' if the client supports frame diffs (see DrawContext)
+        compress: 'deflate' if the client supports compressed messages.
+            They're only sent if compression is enabled on the server.
+        credits: number of frames which may be unacknowledged.  If set, the
+            client acknowledges each frame once it's rendered, and the peer
+            is sent frames only while it has credit (pull mode).
+        max_bps: cap on bytes per second sent to the peer, beyond which
+            frames are skipped
+
+    Outgoing messages are queued, and sent by the peer's own task (see
+    run_sender()), so that a slow client doesn't hold up the sending task
+    or other clients.  Frames are queued as a unit, and the sender of the
+    frame should check admit_frame() beforehand, skipping the frame if false.
+    """
+
+    def __init__(self, websocket, *, protocol=Protocol.JS, diff=False,
+                 compression_level=None, compression_min_size=0, max_queued_frames=2,
+                 credits=None, max_bps=None):  # pylint: disable=redefined-builtin
+        """
+        :param compression_level: zlib level for compressing messages to the
+          peer, or None to disable compression
+        :param compression_min_size: messages smaller than this are sent as is
+        :param max_queued_frames: number of queued frames beyond which the
+          peer is considered backlogged
+        :param credits: (pull mode) number of frames which may be sent
+          without acknowledgement, or None to disable pull mode
+        :param max_bps: optional cap on bytes per second sent to the peer
+        """
+        self.websocket = websocket
+        self.protocol = protocol
+        self.diff = diff
+        # (diff mode) the next frame must be sent in full
+        self.needs_keyframe = True
+        # (diff mode) commands of the last frame sent, as retained by the client
+        self.reference_frame = None
+        # the compression stream persists for the life of the connection
+        self._compressor = None if compression_level is None else compressor(compression_level)
+        self._compression_min_size = compression_min_size
+        self._max_queued_frames = max_queued_frames
+        # items are (messages, is_frame)
+        self._sendStream, self._receiveStream = anyio.create_memory_object_stream(math.inf)
+        self.queued_frames = 0  # frames queued or being sent
+        self.dropped_frames = 0  # frames skipped due to backlog
+        self.paced_frames = 0  # frames skipped due to lack of credit or bandwidth
+        self._maxCredits = credits
+        self._credits = credits
+        # token bucket, allowing bursts of up to 1/4 second
+        self._maxBps = max_bps
+        self._bandwidthBalance = 0 if max_bps is None else max_bps / 4
+        self._bandwidthTime = time.monotonic()
+
+    @classmethod
+    def from_websocket(cls, websocket, **kwargs):
+        """Return peer of websocket, having options requested by the client
+
+        :param kwargs: see __init__()
+        """
+        args = websocket.args
+        try:
+            protocol = Protocol(args.get('protocol', Protocol.JS.value))
+        except ValueError:
+            # unknown protocol requested, so fall back to the default
+            protocol = Protocol.JS
+        if args.get('compress') != 'deflate':
+            kwargs['compression_level'] = None
+        for name, type_ in (('credits', int), ('max_bps', float)):
+            try:
+                value = type_(args[name])
+            except (KeyError, ValueError):
+                continue
+            if value > 0:
+                kwargs[name] = value
+        return cls(websocket, protocol=protocol, diff=args.get('diff') == '1', **kwargs)
+
+    @property
+    def is_backlogged(self):
+        return self.queued_frames >= self._max_queued_frames
+
+    def _updateBandwidth(self):
+        now = time.monotonic()
+        self._bandwidthBalance = min(
+            self._maxBps / 4,
+            self._bandwidthBalance + (now - self._bandwidthTime) * self._maxBps)
+        self._bandwidthTime = now
+
+    def admit_frame(self):
+        """Return True if a frame should be sent to the peer now
+
+        Otherwise the skipped frame is recorded.  If True, the frame must be
+        queued with send_prepared().
+        """
+        if self._maxBps is not None:
+            self._updateBandwidth()
+        if self.is_backlogged:
+            self.dropped_frames += 1
+            # (diff mode) resync the client in full once it catches up
+            self.needs_keyframe = True
+        elif self._credits == 0 or self._bandwidthBalance < 0:
+            # (frame rate degrades until the client acks or budget recovers.
+            # In diff mode the next frame is diffed against reference_frame,
+            # so pacing doesn't force larger key frames.)
+            self.paced_frames += 1
+        else:
+            if self._credits is not None:
+                self._credits -= 1
+            return True
+        return False
+
+    def handle_control(self, msg):
+        """Process binary control message from the client"""
+        if len(msg) >= 2 and msg[0] == ControlKind.ACK:
+            if self._credits is not None:
+                self._credits = min(self._maxCredits, self._credits + msg[1])
+        else:
+            _logger.warning('unknown or malformed control message %r', bytes(msg[:8]))
+
+    def prepare(self, msg):
+        """Return message as it will be sent (i.e. compressed, if applicable)
+
+        Prepared messages must be sent in the order they were prepared.  This
+        may be called from a worker thread.
+        """
+        if self._compressor is not None and len(msg) >= self._compression_min_size:
+            return compress_message(self._compressor, msg)
+        return msg
+
+    def send_prepared(self, messages, *, is_frame=False):
+        """Queue prepared messages, which are a frame if is_frame is set"""
+        if is_frame:
+            self.queued_frames += 1
+        if self._maxBps is not None:
+            self._updateBandwidth()
+            self._bandwidthBalance -= sum(map(len, messages))
+        self._sendStream.send_nowait((messages, is_frame))
+
+    async def send(self, msg):
+        """Queue message, returning its size as sent (compressed size, if applicable)"""
+        msg = self.prepare(msg)
+        self.send_prepared([msg])
+        return len(msg)
+
+    async def aclose(self):
+        """Stop the sender task once queued messages are sent"""
+        await self._sendStream.aclose()
+
+    async def run_sender(self):
+        """Task sending queued messages to the websocket"""
+        async for messages, is_frame in self._receiveStream:
+            for msg in messages:
+                await self.websocket.send(msg)
+            if is_frame:
+                self.queued_frames -= 1
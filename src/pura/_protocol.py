@@ -0,0 +1,669 @@
+"""Draw command encoding
+
+DrawContext primitives queue commands, which are tuples of (op, *args).
+Each webview peer receives them in one of two encodings, negotiated when
+the peer connects:
+
+    Protocol.JS - JavaScript source which is simply eval'd by the client.
+        This is the original protocol, and the fallback.
+
+    Protocol.BINARY - one opcode byte per command followed by packed
+        little-endian arguments, interpreted by pura.execBinary().
+
+Binary messages begin with a single MessageKind byte.
+
+Peers may also negotiate compression, in which case messages of either
+protocol can be sent as a MessageKind.COMPRESSED binary message.  The
+payload is a raw deflate stream shared by all messages sent to the peer,
+so that later messages may reference earlier ones.
+
+In diff mode (see DrawContext), each frame is sent as either a key frame
+with the full list of frame commands, an edit script against the previous
+frame sent to the client, or a marker to repeat that frame.  The client
+retains the frame's command list and replays it.
+
+Binary argument codes:
+
+    f: float32
+    B: uint8
+    I: uint32
+    c: color (r, g, b, a uint8)
+    s: string (uint16 byte length, utf-8)
+    S: long string (uint32 byte length, utf-8)
+    F: float32 array (uint32 byte length, values).  The command argument
+       is bytes as returned by pack_floats(), and is base64 encoded in the
+       JS protocol.
+    C: color array (uint32 byte length, r, g, b, a uint8 per color).  The
+       command argument is bytes as returned by pack_colors(), and is base64
+       encoded in the JS protocol.  Empty if the batch primitive uses the
+       current style.
+    D: data (uint32 byte length, bytes), base64 encoded in the JS protocol
+    L: command list (uint32 byte length, commands).  The command argument is
+       a list of commands, which is a list of JavaScript batches (split
+       after image draws, see pura.loadLayer()) in the JS protocol.
+
+Layers (see DrawContext.layer()) are drawn by the client into offscreen
+canvases:  LOAD_LAYER carries the layer's commands, and is sent only when
+the layer changes, while LAYER composites the layer into each frame.  Since
+a layer's commands may be deferred by image loads like frame commands,
+LOAD_LAYER must be the last command of its message.
+
+Images loaded by views are sent by reference:  the argument of LOAD_IMAGE
+is the key of the image in the server's image store (see _image_store.py),
+which the client fetches from the server's /img/<key> route.
+
+Messages from the client are JSON (input events), or binary control
+messages beginning with a ControlKind byte.
+
+Multiplexing:  a browser may instead open a single websocket to a server
+(path "_mux"), over which it subscribes to any number of paths (views, and
+"_main" for view registrations) as channels, each having a u16 id chosen by
+the client.  Each channel has its own peer state, with the options given by
+the query string of the websocket URL.  Server messages of a channel are
+wrapped as a MessageKind.CHANNEL message (see channel_message()).  Client
+JSON messages of type "subscribe" (with "path") or "unsubscribe" carry a
+"channel" key.  Other client JSON messages are prefixed by the decimal
+channel id and a space (e.g. '3 {"type": "mousemove", ...}'), and are passed
+to the channel's handler as is, so that the server needn't parse them on
+arrival.  Client control messages are followed by the u16 channel id.
+
+NOTE: op, message kind, control kind, and image format values must be kept
+in sync with static/js/pura.js.
+"""
+
+import json
+import struct
+import sys
+import zlib
+from array import array
+from base64 import b64encode
+from enum import Enum, IntEnum
+from functools import partial
+
+
+class Protocol(Enum):
+    JS = 'js'
+    BINARY = 'binary'
+
+
+class MessageKind(IntEnum):
+    COMMANDS = 0
+    KEY_FRAME = 1  # u32 count, count * u32 byte lengths, commands
+    DIFF_FRAME = 2  # u32 count, count * edit (u32 start, u32 end, command list)
+    REPEAT_FRAME = 3
+    COMPRESSED = 4  # u8 is_text, u32 message byte length, deflate stream data
+    CHANNEL = 5  # u16 channel id, u8 is_text, message (multiplexed websocket)
+
+
+class ImageFormat(IntEnum):
+    """Format of IMAGE_DATA image data"""
+    RGBA = 0  # raw r, g, b, a uint8 per pixel
+    PNG = 1
+    JPEG = 2
+    WEBP = 3
+
+
+class ControlKind(IntEnum):
+    """First byte of binary messages from the client, which control the peer"""
+    ACK = 0  # u8 number of frames rendered, (multiplexed) u16 channel id
+
+
+class Op(IntEnum):
+    SWAP = 0
+    BACKGROUND = 1
+    STROKE_WEIGHT = 2
+    STROKE_CAP = 3
+    STROKE = 4
+    FILL = 5
+    TRANSLATE = 6
+    ROTATE = 7
+    SCALE = 8
+    BEGIN_PATH = 9
+    END_SHAPE = 10
+    MOVE_TO = 11
+    LINE_TO = 12
+    LINE = 13
+    RECT = 14
+    CIRCLE = 15
+    ARC = 16
+    TEXT = 17
+    TEXT_SIZE = 18
+    TEXT_FONT = 19
+    FONT = 20
+    TEXT_ALIGN = 21
+    IMAGE_SMOOTHING = 22
+    SAVE = 23
+    RESTORE = 24
+    LOAD_IMAGE = 25
+    UNLOAD_IMAGE = 26
+    IMAGE = 27
+    IMAGE_SIZED = 28
+    IMAGE_INLINE = 29
+    IMAGE_INLINE_SIZED = 30
+    LOAD_SHAPE = 31
+    UNLOAD_SHAPE = 32
+    SHAPE = 33
+    VERTICES = 34
+    LINES = 35
+    POINTS = 36
+    POLYLINE = 37
+    RECTS = 38
+    CIRCLES = 39
+    IMAGE_DATA = 40
+    LOAD_LAYER = 41
+    UNLOAD_LAYER = 42
+    LAYER = 43
+
+
+_ARG_SPECS = {
+    Op.SWAP: '',
+    Op.BACKGROUND: 'cff',
+    Op.STROKE_WEIGHT: 'f',
+    Op.STROKE_CAP: 's',
+    Op.STROKE: 'c',
+    Op.FILL: 'c',
+    Op.TRANSLATE: 'ff',
+    Op.ROTATE: 'f',
+    Op.SCALE: 'ff',
+    Op.BEGIN_PATH: '',
+    Op.END_SHAPE: 'B',
+    Op.MOVE_TO: 'ff',
+    Op.LINE_TO: 'ff',
+    Op.LINE: 'ffff',
+    Op.RECT: 'ffff',
+    Op.CIRCLE: 'fffff',
+    Op.ARC: 'ffffff',
+    Op.TEXT: 'Sff',
+    Op.TEXT_SIZE: 'f',
+    Op.TEXT_FONT: 's',
+    Op.FONT: 'fs',
+    Op.TEXT_ALIGN: 'ss',
+    Op.IMAGE_SMOOTHING: 'B',
+    Op.SAVE: '',
+    Op.RESTORE: '',
+    Op.LOAD_IMAGE: 'IS',
+    Op.UNLOAD_IMAGE: 'I',
+    Op.IMAGE: 'Iff',
+    Op.IMAGE_SIZED: 'Iffff',
+    Op.IMAGE_INLINE: 'Sff',
+    Op.IMAGE_INLINE_SIZED: 'Sffff',
+    Op.LOAD_SHAPE: 'IBF',
+    Op.UNLOAD_SHAPE: 'I',
+    Op.SHAPE: 'Iff',
+    Op.VERTICES: 'BF',
+    Op.LINES: 'FC',
+    Op.POINTS: 'FC',
+    Op.POLYLINE: 'BF',
+    Op.RECTS: 'FC',
+    Op.CIRCLES: 'FFC',
+    Op.IMAGE_DATA: 'BIIDffff',
+    Op.LOAD_LAYER: 'IL',
+    Op.UNLOAD_LAYER: 'I',
+    Op.LAYER: 'I',
+}
+
+
+# indices of command elements which quantize() rounds
+_QUANTIZED_ARGS = {op: tuple(i for i, code in enumerate(spec, 1) if code == 'f')
+                   for op, spec in _ARG_SPECS.items()}
+# (arc angles are excluded, since rounding may leave a gap in a full circle)
+_QUANTIZED_ARGS[Op.CIRCLE] = (1, 2, 3)
+_QUANTIZED_ARGS[Op.ARC] = (1, 2, 3, 4)
+# ops for which all arguments are rounded, which have a faster path
+_ALL_QUANTIZED = {op for op, indices in _QUANTIZED_ARGS.items()
+                  if indices and len(indices) == len(_ARG_SPECS[op])}
+
+
+def quantize(commands, precision):
+    """Return commands with float arguments rounded to the given decimal digits
+
+    This reduces the size of the JS protocol, and improves matching of frame
+    diffs.  Array arguments (e.g. of batch primitives) are not affected.
+    """
+    # round(x * scale) / scale is about twice as fast as round(x, precision),
+    # and likewise yields the float closest to the decimal value (so that repr()
+    # is short).  int is passed through, since it's already short.
+    scale = 10 ** precision
+    if scale == 1:
+        def q(a):
+            return a if a.__class__ is int else round(a)
+    else:
+        def q(a):
+            return a if a.__class__ is int else round(a * scale) / scale
+    quantized_args = _QUANTIZED_ARGS
+    all_quantized = _ALL_QUANTIZED
+    result = []
+    append = result.append
+    for cmd in commands:
+        op = cmd[0]
+        if op in all_quantized and scale != 1:
+            # (inlined for speed)
+            append((op, *[a if a.__class__ is int else round(a * scale) / scale
+                          for a in cmd[1:]]))
+            continue
+        indices = quantized_args[op]
+        if indices:
+            cmd = list(cmd)
+            for i in indices:
+                cmd[i] = q(cmd[i])
+            cmd = tuple(cmd)
+        append(cmd)
+    return result
+
+
+def pack_floats(values):
+    """Return bytes of the given float values packed as little-endian float32
+
+    values may be any iterable of numbers, an object supporting the buffer
+    protocol (array.array, memoryview, etc.), or a NumPy array.  Multi-
+    dimensional arrays are flattened in C order.
+    """
+    astype = getattr(values, 'astype', None)
+    if astype is not None:
+        # NumPy array (duck-typed, so that NumPy is not required)
+        return astype('<f4', copy=False).tobytes()
+    if isinstance(values, memoryview) and values.ndim > 1:
+        values = values.cast('B').cast(values.format)
+    a = array('f', values)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tobytes()
+
+
+def pack_colors(colors):
+    """Return bytes of the given colors packed as r, g, b, a uint8
+
+    colors may be a sequence of Color objects, a NumPy array of shape (n, 4)
+    or (n, 3) holding 8-bit channel values, or a buffer of r, g, b, a bytes.
+    """
+    shape = getattr(colors, 'shape', None)
+    if shape is not None:
+        if len(shape) != 2 or shape[1] not in (3, 4):
+            raise ValueError('expected color array of shape (n, 3) or (n, 4)')
+        colors = colors.astype('u1', copy=False)
+        if shape[1] == 3:
+            import numpy  # pylint: disable=import-outside-toplevel
+            colors = numpy.concatenate(
+                (colors, numpy.full((shape[0], 1), 255, dtype='u1')), axis=1)
+        return colors.tobytes()
+    try:
+        return bytes(memoryview(colors).cast('B'))
+    except TypeError:
+        pass
+    return bytes(channel for color in colors
+                 for channel in (color.r, color.g, color.b, color.a))
+
+
+# JavaScript eval environment:
+#
+#     available global state:
+#         ctx: HTML5 canvas context object for drawing
+#         ws_url: base URL of this webview server
+#     pura namespace methods:
+#         swap() - move hidden canvas (for drawing) to the front
+#         add_webview(name, port, width, height) - register the given webview.
+#             (For use by main websocket only.)
+#
+#     See static/js/pura.js for the implementation.
+
+def _js_background(color, width, height):
+    return (
+        f"ctx.save();"
+        f"ctx.fillStyle = '{color.js_string()}';"
+        f"ctx.fillRect(0, 0, {width}, {height});"
+        f"ctx.restore();"
+    )
+
+
+def _js_end_shape(close):
+    return ('ctx.closePath();' if close else '') + 'ctx.fill();ctx.stroke();'
+
+
+def _js_floats(points):
+    return f'pura.decodeFloats("{b64encode(points).decode()}")'
+
+
+def _js_colors(colors):
+    return f'pura.decodeColors("{b64encode(colors).decode()}")'
+
+
+def _js_image(id_, x, y, size_args=''):
+    # (assignment marks a possible deferral, see pura.frameBatches())
+    return (f'pura.isImageLoadPending = '
+            f'pura.drawImage(ctx,pura.imagesById[{id_}],[{x},{y}{size_args}]);')
+
+
+def _js_image_data(format_, width, height, data, *position):
+    # (position is x, y, w, h)
+    return (f'pura.isImageLoadPending = pura.drawImageData(ctx,{format_},{width},{height},'
+            f'pura.decodeBytes("{b64encode(data).decode()}"),[{",".join(map(str, position))}]);')
+
+
+def _js_load_layer(id_, commands):
+    # (batches split after image draws, which may defer subsequent commands)
+    batches = []
+    batch = []
+    for command in _js_command_list(commands):
+        batch.append(command)
+        if 'isImageLoadPending' in command:
+            batches.append(''.join(batch))
+            batch = []
+    if batch:
+        batches.append(''.join(batch))
+    return f'pura.loadLayer({id_},{json.dumps(batches)});'
+
+
+def _js_image_inline(base64_str, x, y, size_args=''):
+    return (
+        '{'
+        'let image = new Image();'
+        'pura.isImageLoadPending = true;'
+        'image.onload = function(){'
+        f' ctx.drawImage(image,{x},{y}{size_args});'
+        '  pura.isImageLoadPending = false;'
+        '  pura.resumeCommands();'
+        '};'
+        f'image.src = "data:image/png;base64,{base64_str}";'
+        '}'
+    )
+
+
+_JS_FORMATTERS = {
+    Op.SWAP: 'pura.swap();'.format,
+    Op.BACKGROUND: _js_background,
+    Op.STROKE_WEIGHT: 'ctx.lineWidth = {};'.format,
+    Op.STROKE_CAP: "ctx.lineCap = '{}';".format,
+    Op.STROKE: lambda color: f"ctx.strokeStyle = '{color.js_string()}';",
+    Op.FILL: lambda color: f"ctx.fillStyle = '{color.js_string()}';",
+    Op.TRANSLATE: 'ctx.translate({}, {});'.format,
+    Op.ROTATE: 'ctx.rotate({});'.format,
+    Op.SCALE: 'ctx.scale({}, {});'.format,
+    Op.BEGIN_PATH: 'ctx.beginPath();'.format,
+    Op.END_SHAPE: _js_end_shape,
+    Op.MOVE_TO: 'ctx.moveTo({}, {});'.format,
+    Op.LINE_TO: 'ctx.lineTo({}, {});'.format,
+    Op.LINE: 'ctx.beginPath();ctx.moveTo({}, {});ctx.lineTo({}, {});ctx.stroke();'.format,
+    Op.RECT: 'ctx.beginPath();ctx.rect({},{},{},{});ctx.fill();ctx.stroke();'.format,
+    Op.CIRCLE: 'ctx.beginPath();ctx.arc({},{},{},{},{});ctx.fill();ctx.stroke();'.format,
+    Op.ARC: (
+        'ctx.beginPath();'
+        'ctx.save();'
+        'ctx.translate({0}, {1});'
+        'ctx.scale({2}, {3});'
+        'ctx.moveTo(0, 0);'
+        'ctx.arc(0, 0, 0.5, {4}, {5});'
+        'ctx.fill();'
+        'ctx.beginPath();'
+        'ctx.arc(0, 0, 0.5, {4}, {5});'
+        'ctx.restore();'
+        'ctx.stroke();'
+    ).format,
+    # string repr() should be fine as JavaScript, and is 2x faster than json.dumps()
+    Op.TEXT: 'ctx.fillText({!r}, {}, {});'.format,
+    Op.TEXT_SIZE: "ctx.font = '{}px ' + ctx.font.split(' ')[1];".format,
+    Op.TEXT_FONT: "ctx.font = ctx.font.split(' ')[0] + ' {}';".format,
+    Op.FONT: "ctx.font = '{}px {}';".format,
+    Op.TEXT_ALIGN: "ctx.textAlign = '{}'; ctx.textBaseline = '{}';".format,
+    Op.IMAGE_SMOOTHING: lambda enabled: (
+        f"ctx.imageSmoothingEnabled = {'true' if enabled else 'false'};"),
+    Op.SAVE: 'ctx.save();'.format,
+    Op.RESTORE: 'ctx.restore();'.format,
+    Op.LOAD_IMAGE: 'pura.imagesById[{}]=pura.loadImage("{}");'.format,
+    Op.UNLOAD_IMAGE: 'delete pura.imagesById[{}];'.format,
+    Op.IMAGE: _js_image,
+    Op.IMAGE_SIZED: lambda id_, x, y, w, h: _js_image(id_, x, y, f', {w}, {h}'),
+    Op.IMAGE_INLINE: _js_image_inline,
+    Op.IMAGE_INLINE_SIZED: lambda s, x, y, w, h: _js_image_inline(s, x, y, f', {w}, {h}'),
+    Op.LOAD_SHAPE: lambda id_, closed, points: (
+        f'pura.shapesById[{id_}]=pura.makePath({_js_floats(points)},'
+        f'{"true" if closed else "false"});'),
+    Op.UNLOAD_SHAPE: 'delete pura.shapesById[{}];'.format,
+    Op.SHAPE: 'pura.drawShape(ctx,pura.shapesById[{}],{},{});'.format,
+    Op.VERTICES: lambda move_first, points: (
+        f'pura.vertices(ctx,{_js_floats(points)},{"true" if move_first else "false"});'),
+    Op.LINES: lambda points, colors: f'pura.lines(ctx,{_js_floats(points)},{_js_colors(colors)});',
+    Op.POINTS: lambda points, colors: (
+        f'pura.points(ctx,{_js_floats(points)},{_js_colors(colors)});'),
+    Op.POLYLINE: lambda closed, points: (
+        f'pura.polyline(ctx,{_js_floats(points)},{"true" if closed else "false"});'),
+    Op.RECTS: lambda points, colors: f'pura.rects(ctx,{_js_floats(points)},{_js_colors(colors)});',
+    Op.CIRCLES: lambda points, sizes, colors: (
+        f'pura.circles(ctx,{_js_floats(points)},{_js_floats(sizes)},{_js_colors(colors)});'),
+    Op.IMAGE_DATA: _js_image_data,
+    Op.LOAD_LAYER: _js_load_layer,
+    Op.UNLOAD_LAYER: 'delete pura.layersById[{}];'.format,
+    Op.LAYER: 'pura.drawLayer(ctx,{});'.format,
+}
+
+_FIXED_FORMATS = {'f': 'f', 'B': 'B', 'I': 'I', 'c': '4s'}
+_FIXED_SIZES = {'f': 4, 'B': 1, 'I': 4, 'c': 4}
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_RGBA_PACK = struct.Struct('>I').pack
+_MESSAGE_HEADERS = {kind: bytes((kind,)) for kind in MessageKind}
+_COMPRESSED_HEADER = struct.Struct('<BBI')
+_CHANNEL_HEADER = struct.Struct('<BHB')
+
+
+def _rgba_bytes(color):
+    return _RGBA_PACK(color.rgba_int())
+
+
+def _encode_variable(spec, cmd):
+    parts = [bytes((cmd[0],))]
+    for code, arg in zip(spec, cmd[1:]):
+        if code in ('s', 'S'):
+            b = arg.encode()
+            if code == 's' and len(b) > 0xffff:
+                raise ValueError(f'{cmd[0].name} string exceeds 65535 bytes')
+            parts.append((_U16 if code == 's' else _U32).pack(len(b)))
+            parts.append(b)
+        elif code in ('F', 'C', 'D'):
+            parts.append(_U32.pack(len(arg)))
+            parts.append(arg)
+        elif code == 'L':
+            commands = b''.join([_BINARY_ENCODERS[command[0]](command) for command in arg])
+            parts.append(_U32.pack(len(commands)))
+            parts.append(commands)
+        elif code == 'c':
+            parts.append(_rgba_bytes(arg))
+        else:
+            parts.append(struct.pack('<' + code, arg))
+    return b''.join(parts)
+
+
+def _compile_encoder(spec):
+    """Return function encoding a command having the given argument spec"""
+    if not set(spec) <= _FIXED_FORMATS.keys():
+        return partial(_encode_variable, spec)
+    pack = struct.Struct('<B' + ''.join(_FIXED_FORMATS[code] for code in spec)).pack
+    if 'c' not in spec:
+        return lambda cmd: pack(*cmd)
+
+    color_indices = [i for i, code in enumerate(spec, 1) if code == 'c']
+
+    def encode_command(cmd):
+        args = list(cmd)
+        for i in color_indices:
+            args[i] = _rgba_bytes(args[i])
+        return pack(*args)
+    return encode_command
+
+
+_BINARY_ENCODERS = {op: _compile_encoder(spec) for op, spec in _ARG_SPECS.items()}
+
+
+def _js_command_list(commands):
+    formatters = _JS_FORMATTERS
+    return [formatters[cmd[0]](*cmd[1:]) for cmd in commands]
+
+
+def encode_js(commands):
+    """Return JavaScript source for the given commands"""
+    return ''.join(_js_command_list(commands))
+
+
+def encode_binary(commands):
+    """Return binary message for the given commands"""
+    encoders = _BINARY_ENCODERS
+    return _MESSAGE_HEADERS[MessageKind.COMMANDS] + \
+        b''.join([encoders[cmd[0]](cmd) for cmd in commands])
+
+
+def _binary_command_list(commands):
+    encoders = _BINARY_ENCODERS
+    parts = [encoders[cmd[0]](cmd) for cmd in commands]
+    n = len(parts)
+    return struct.pack(f'<I{n}I', n, *map(len, parts)) + b''.join(parts)
+
+
+def encode_key_frame(commands, protocol):
+    """Return message for the given frame commands, to be retained by the client"""
+    if protocol is Protocol.JS:
+        return f'pura.keyFrame(ctx,{json.dumps(_js_command_list(commands))});'
+    return _MESSAGE_HEADERS[MessageKind.KEY_FRAME] + _binary_command_list(commands)
+
+
+def encode_diff_frame(edits, protocol):
+    """Return message for the given frame edits (see frame_edits())
+
+    An empty edit list indicates that the previous frame should be repeated.
+    """
+    if protocol is Protocol.JS:
+        if not edits:
+            return 'pura.repeatFrame(ctx);'
+        edits = [[start, end, _js_command_list(commands)] for start, end, commands in edits]
+        return f'pura.diffFrame(ctx,{json.dumps(edits)});'
+    if not edits:
+        return _MESSAGE_HEADERS[MessageKind.REPEAT_FRAME]
+    return b''.join([_MESSAGE_HEADERS[MessageKind.DIFF_FRAME], _U32.pack(len(edits)),
+                     *(struct.pack('<II', start, end) + _binary_command_list(commands)
+                       for start, end, commands in edits)])
+
+
+def compressor(level):
+    """Return object for compress_message(), having the given zlib level"""
+    return zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+
+def compress_message(compressor_, msg):
+    """Return compressed message given compressor of the peer"""
+    is_text = isinstance(msg, str)
+    data = msg.encode() if is_text else msg
+    return b''.join([_COMPRESSED_HEADER.pack(MessageKind.COMPRESSED, is_text, len(data)),
+                     compressor_.compress(data),
+                     compressor_.flush(zlib.Z_SYNC_FLUSH)])
+
+
+def decompress_message(decompressor, data):
+    """Return original message given compressed message and decompressor
+
+    The decompressor is zlib.decompressobj(-zlib.MAX_WBITS), and must be
+    given all compressed messages of a peer in order.
+    """
+    _, is_text, _ = _COMPRESSED_HEADER.unpack_from(data)
+    msg = decompressor.decompress(data[_COMPRESSED_HEADER.size:])
+    return msg.decode() if is_text else msg
+
+
+def channel_message(channel, msg):
+    """Return message wrapped for the given channel of a multiplexed websocket"""
+    is_text = isinstance(msg, str)
+    return b''.join([_CHANNEL_HEADER.pack(MessageKind.CHANNEL, channel, is_text),
+                     msg.encode() if is_text else msg])
+
+
+def unwrap_channel_message(data):
+    """Return (channel, message) given message from channel_message()"""
+    _, channel, is_text = _CHANNEL_HEADER.unpack_from(data)
+    msg = data[_CHANNEL_HEADER.size:]
+    return channel, msg.decode() if is_text else msg
+
+
+def control_channel(msg):
+    """Return channel id of a client control message of a multiplexed websocket
+
+    Returns None if the message is too short to have one.
+    """
+    if len(msg) < 4:
+        return None
+    return _U16.unpack_from(msg, 2)[0]
+
+
+_ENCODERS = {
+    Protocol.JS: encode_js,
+    Protocol.BINARY: encode_binary,
+}
+
+
+def encode(commands, protocol):
+    """Return message for the given commands encoded in the given protocol"""
+    return _ENCODERS[protocol](commands)
+
+
+def _decode_commands(view, offset, end):
+    commands = []
+    while offset < end:
+        op = Op(view[offset])
+        offset += 1
+        cmd = [op]
+        for code in _ARG_SPECS[op]:
+            if code in ('s', 'S'):
+                size_struct = _U16 if code == 's' else _U32
+                n, = size_struct.unpack_from(view, offset)
+                offset += size_struct.size
+                cmd.append(bytes(view[offset:offset+n]).decode())
+                offset += n
+            elif code in ('F', 'C', 'D'):
+                n, = _U32.unpack_from(view, offset)
+                offset += 4
+                cmd.append(bytes(view[offset:offset+n]))
+                offset += n
+            elif code == 'L':
+                n, = _U32.unpack_from(view, offset)
+                offset += 4
+                cmd.append(_decode_commands(view, offset, offset + n))
+                offset += n
+            elif code == 'c':
+                cmd.append(tuple(view[offset:offset+4]))
+                offset += 4
+            else:
+                cmd.append(struct.unpack_from('<' + code, view, offset)[0])
+                offset += _FIXED_SIZES[code]
+        commands.append(tuple(cmd))
+    return commands
+
+
+def _decode_command_list(view, offset):
+    """Return (commands, end offset) of binary command list"""
+    n, = _U32.unpack_from(view, offset)
+    offset += 4
+    size = sum(struct.unpack_from(f'<{n}I', view, offset))
+    offset += 4 * n
+    return _decode_commands(view, offset, offset + size), offset + size
+
+
+def decode_binary(data):
+    """Return (message kind, payload) from binary message
+
+    The payload is a list of commands, or a list of (start, end, commands)
+    edits in the case of MessageKind.DIFF_FRAME.  Colors are decoded as
+    (r, g, b, a) tuples.  This is not used by the server, but is useful for
+    tests and tools consuming the protocol.
+    """
+    view = memoryview(data)
+    kind = MessageKind(view[0])
+    if kind is MessageKind.COMMANDS:
+        return kind, _decode_commands(view, 1, len(view))
+    if kind is MessageKind.KEY_FRAME:
+        return kind, _decode_command_list(view, 1)[0]
+    if kind is MessageKind.DIFF_FRAME:
+        n, = _U32.unpack_from(view, 1)
+        offset = 5
+        edits = []
+        for _ in range(n):
+            start, end = struct.unpack_from('<II', view, offset)
+            commands, offset = _decode_command_list(view, offset + 8)
+            edits.append((start, end, commands))
+        return kind, edits
+    return kind, []
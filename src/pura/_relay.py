@@ -0,0 +1,318 @@
+"""Relay of the views of an upstream server, see pura.relay"""
+
+import logging
+import re
+import time
+import urllib.parse
+import urllib.request
+import zlib
+
+import anyio
+
+from ._diff import apply_edits
+from ._image_store import image_store
+from ._protocol import (_ARG_SPECS, ControlKind, decode_binary, decompress_message, MessageKind,
+                        Op)
+from ._web_view import _color, DrawContext, FrameStats
+from ._ws_client import WebsocketClient
+
+_logger = logging.getLogger(__name__)
+
+_ADD_WEBVIEW = re.compile(
+    r'pura\.add_webview\(ws_url,"([^"]*)",(\d+),(\d+),"([^"]*)","([^"]*)"\);')
+_SUBSCRIBE = re.compile(r'pura\.webview_server_subscribe\(\'([^\']*)\'\);')
+
+# upstream options, as requested by the browser
+_UPSTREAM_QUERY = 'protocol=binary&diff=1&compress=deflate&credits=2'
+
+# unload op of each resource load op
+_UNLOAD_OPS = {Op.LOAD_IMAGE: Op.UNLOAD_IMAGE, Op.LOAD_SHAPE: Op.UNLOAD_SHAPE,
+               Op.LOAD_LAYER: Op.UNLOAD_LAYER}
+_LOAD_OPS = {unload: load for load, unload in _UNLOAD_OPS.items()}
+
+# ops drawing images, after which a batched frame is split (see DrawContext.image())
+_IMAGE_OPS = {Op.IMAGE, Op.IMAGE_SIZED, Op.IMAGE_INLINE, Op.IMAGE_INLINE_SIZED, Op.IMAGE_DATA}
+
+# indices of color arguments, which decode_binary() returns as tuples
+_COLOR_ARGS = {op: tuple(i for i, code in enumerate(spec, 1) if code == 'c')
+               for op, spec in _ARG_SPECS.items() if 'c' in spec}
+
+
+def _http_get(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.read()
+
+
+def _restore_colors(commands):
+    """Return decoded commands with colors as Color objects, so they can be re-encoded"""
+    result = []
+    for cmd in commands:
+        indices = _COLOR_ARGS.get(cmd[0])
+        if indices:
+            cmd = list(cmd)
+            for i in indices:
+                cmd[i] = _color(*cmd[i])
+            cmd = tuple(cmd)
+        elif cmd[0] is Op.LOAD_LAYER:
+            cmd = (*cmd[:2], _restore_colors(cmd[2]))
+        result.append(cmd)
+    return result
+
+
+class RelayContext(DrawContext):
+    """Draw context of a view relayed from an upstream server
+
+    Rather than drawing, frames are received from an upstream connection,
+    which is held while the view has clients (and for `linger` seconds
+    after the last one leaves).
+    """
+
+    def __init__(self, host, port, name, *, size, secure=False, display_name='', frame_rate=30,
+                 forward_input=False, linger=2., retry_interval=2.):
+        """
+        :param host, port: upstream server
+        :param name: upstream view name
+        :param secure: if True, connect to the upstream server over TLS
+        :param display_name: optional name shown by clients (see WebViewServer)
+        :param frame_rate: nominal frame rate, for dashboards
+        :param forward_input: if True, send input of clients upstream
+        :param linger: seconds the upstream connection is kept without clients
+        :param retry_interval: seconds between upstream connection attempts
+        """
+        super().__init__(size=size, frame_rate=frame_rate, draw_fn=None, diff=True)
+        self._host, self._port = host, port
+        self._secure = secure
+        self._target = f'/{urllib.parse.quote(name)}?{_UPSTREAM_QUERY}'
+        self._forwardInput = forward_input
+        self._linger = linger
+        self._retryInterval = retry_interval
+        self._upstream = None
+        self.display_name = display_name
+        # load commands of resources in effect, keyed by (load op, id)
+        self._resources = {}
+
+    def _resourceCommands(self):
+        return list(self._resources.values())
+
+    async def _handleMessage(self, peer, msg):
+        """Forward input from the client upstream, if enabled"""
+        if self._forwardInput and self._upstream is not None:
+            await self._upstream.send(msg)
+
+    async def _addImages(self, commands):
+        """Reference the images loaded by commands in the image store, fetching
+        them from upstream if needed"""
+        added = []
+        try:
+            for cmd in commands:
+                if cmd[0] is Op.LOAD_IMAGE:
+                    key = cmd[2]
+                    data = image_store.get(key)
+                    if data is None:
+                        scheme = 'https' if self._secure else 'http'
+                        data = await anyio.to_thread.run_sync(
+                            _http_get, f'{scheme}://{self._host}:{self._port}/img/{key}')
+                    added.append(image_store.add(data))
+        except BaseException:
+            for key in added:
+                image_store.release(key)
+            raise
+
+    @staticmethod
+    def _releaseResource(cmd):
+        if cmd is not None and cmd[0] is Op.LOAD_IMAGE:
+            image_store.release(cmd[2])
+
+    def _resetResources(self, commands):
+        """Adopt the resources loaded on connecting upstream, queueing changes to peers
+
+        (Images of commands must have been added by _addImages().)
+        """
+        loaded = {(cmd[0], cmd[1]): cmd for cmd in commands if cmd[0] in _UNLOAD_OPS}
+        for (op, id_) in self._resources.keys() - loaded.keys():
+            self._resourceQueue.append((_UNLOAD_OPS[op], id_))
+        self._resourceQueue.extend(cmd for key, cmd in loaded.items()
+                                   if self._resources.get(key) != cmd)
+        for cmd in self._resources.values():
+            self._releaseResource(cmd)
+        self._resources = loaded
+
+    def _takeResource(self, cmd):
+        """Return True if the command is a resource command, queueing it to peers
+
+        (Images of commands must have been added by _addImages().)
+        """
+        op = cmd[0]
+        if op in _UNLOAD_OPS:
+            self._releaseResource(self._resources.get((op, cmd[1])))
+            self._resources[op, cmd[1]] = cmd
+        elif op in _LOAD_OPS:
+            self._releaseResource(self._resources.pop((_LOAD_OPS[op], cmd[1]), None))
+        else:
+            return False
+        self._resourceQueue.append(cmd)
+        return True
+
+    async def _relayFrame(self, commands, t_start):
+        self._frameStats = FrameStats(commands=len(commands))
+        self._sendQueue = commands
+        # (batched mode) restore the upstream's split after image draws, which
+        # the client may defer subsequent commands of
+        self._batchBoundaries.extend(i for i, cmd in enumerate(commands, 1)
+                                     if cmd[0] in _IMAGE_OPS)
+        t_received = time.perf_counter()
+        await self._sendFrame(self._peers.copy())
+        self.metrics.record_frame(self._frameStats, t_received - t_start,
+                                  time.perf_counter() - t_received)
+        self._endFrame()
+
+    async def _receiveFrames(self, client):
+        """Relay frames received from the upstream client until it's closed"""
+        decompressor = None
+        frame = []  # upstream frame, which diffs apply to
+        batch = []  # (batched mode) commands of the frame being received
+        batch_depth = 0  # (batched mode) pushContext() depth
+        batch_swapped = False
+        is_initial = True  # (first message has canvas defaults and resources)
+        async for msg in client:
+            t_start = time.perf_counter()
+            if isinstance(msg, bytes) and msg[0] == MessageKind.COMPRESSED:
+                if decompressor is None:
+                    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                msg = decompress_message(decompressor, msg)
+            if isinstance(msg, str):
+                _logger.warning('relay: ignoring text message from %s', self._target)
+                continue
+            kind, payload = decode_binary(msg)
+            if kind is MessageKind.COMMANDS:
+                commands = _restore_colors(payload)
+                await self._addImages(commands)
+                if is_initial:
+                    is_initial = False
+                    self._resetResources(commands)
+                    continue
+                # a batched frame ends with the SWAP of its outermost context
+                for cmd in commands:
+                    if self._takeResource(cmd):
+                        continue
+                    op = cmd[0]
+                    batch_depth += (op is Op.SAVE) - (op is Op.RESTORE)
+                    batch_swapped = batch_swapped or op is Op.SWAP
+                    batch.append(cmd)
+                if not (batch_swapped and batch_depth == 0):
+                    continue
+                frame, batch, batch_swapped = batch, [], False
+            elif kind is MessageKind.KEY_FRAME:
+                frame = _restore_colors(payload)
+            elif kind is MessageKind.DIFF_FRAME:
+                frame = apply_edits(frame, [(start, end, _restore_colors(commands))
+                                            for start, end, commands in payload])
+            # (else REPEAT_FRAME, of the same frame)
+            await self._relayFrame(frame, t_start)
+            await client.send(bytes([ControlKind.ACK, 1]))
+
+    async def _closeWhenIdle(self, cancel_scope):
+        while True:
+            await anyio.sleep(self._linger)
+            if not self._peers:
+                cancel_scope.cancel()
+                return
+
+    async def run(self):
+        """Task relaying the view from upstream while it has clients"""
+        while True:
+            await self._hasPeers.wait()
+            try:
+                async with await WebsocketClient.connect(self._host, self._port, self._target,
+                                                         tls=self._secure) as client, \
+                        anyio.create_task_group() as tg:
+                    tg.start_soon(self._closeWhenIdle, tg.cancel_scope)
+                    self._upstream = client
+                    await self._receiveFrames(client)
+                    _logger.warning('relay: upstream closed %s', self._target)
+                    tg.cancel_scope.cancel()
+            except (OSError, anyio.BrokenResourceError) as e:
+                _logger.warning('relay: upstream %s failed: %r', self._target, e)
+            finally:
+                self._upstream = None
+            if self._peers:
+                await anyio.sleep(self._retryInterval)
+
+
+class Relay:
+    """Relay of the views of an upstream WebViewServer (see module docs)"""
+
+    def __init__(self, upstream_url, *, server, forward_input=False, linger=2.,
+                 retry_interval=2.):
+        """
+        :param upstream_url: URL of the upstream server, e.g. http://host:8080.
+          With https, the upstream connections are over TLS.
+        :param server: WebViewServer to offer the views on, either of the app
+          (see run()) or of the relay's own (see serve())
+        :param forward_input: if True, send input of viewers upstream
+        :param linger: seconds the upstream connection of a view is kept
+          without viewers
+        :param retry_interval: seconds between upstream connection attempts
+        """
+        url = urllib.parse.urlsplit(upstream_url if '//' in upstream_url
+                                    else f'//{upstream_url}')
+        self._host = url.hostname
+        self._secure = url.scheme in ('https', 'wss')
+        self._port = url.port or (443 if self._secure else 80)
+        self._contextOptions = {'secure': self._secure, 'forward_input': forward_input,
+                                'linger': linger, 'retry_interval': retry_interval}
+        self._retryInterval = retry_interval
+        self.server = server
+        self.contexts = {}  # view name: RelayContext
+
+    async def _handleMainMessage(self, msg, tg):
+        for name, width, height, display_name, link_url in _ADD_WEBVIEW.findall(msg):
+            if link_url or name in self.contexts:
+                # (links, like the REPL, are specific to the upstream server)
+                continue
+            if name in self.server.handlers_by_path:
+                _logger.warning('relay: view "%s" conflicts with a local view', name)
+                continue
+            ctx = RelayContext(self._host, self._port, name, size=(int(width), int(height)),
+                               display_name=display_name, **self._contextOptions)
+            self.contexts[name] = ctx
+            await self.server.add_webview(name, ctx)
+            tg.start_soon(ctx.run)
+        for url in _SUBSCRIBE.findall(msg):
+            if url not in self.server.remote_webview_servers:
+                await self.server.add_remote(url)
+
+    async def _followUpstream(self, tg):
+        """Task following the views registered on the upstream server"""
+        while True:
+            try:
+                async with await WebsocketClient.connect(self._host, self._port, '/_main',
+                                                         tls=self._secure) as client:
+                    async for msg in client:
+                        if isinstance(msg, str):
+                            await self._handleMainMessage(msg, tg)
+                _logger.warning('relay: upstream closed')
+            except OSError as e:
+                _logger.warning('relay: upstream %s:%s failed: %r', self._host, self._port, e)
+            await anyio.sleep(self._retryInterval)
+
+    async def run(self):
+        """Task relaying the upstream views on the server"""
+        async with anyio.create_task_group() as tg:
+            await self._followUpstream(tg)
+
+    async def serve(self, title, host, port, *, shutdown_trigger=None,
+                    task_status=anyio.TASK_STATUS_IGNORED):
+        """Task running the server, and relaying
+
+        :param shutdown_trigger: see WebViewServer.serve()
+        """
+        async with anyio.create_task_group() as tg:
+
+            async def serve_server(*, task_status):
+                await self.server.serve(title, host, port, shutdown_trigger=shutdown_trigger,
+                                        task_status=task_status)
+                tg.cancel_scope.cancel()  # (relaying)
+            await tg.start(serve_server)
+            tg.start_soon(self.run)
+            task_status.started()
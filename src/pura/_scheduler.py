@@ -0,0 +1,157 @@
+import heapq
+import logging
+import math
+
+import anyio
+
+_logger = logging.getLogger(__name__)
+
+
+def grid_deadline(t, period):
+    """Return the latest multiple of period not after time t
+
+    Deadlines of all views are on this grid (relative to the event loop's
+    clock), so views of the same or harmonic frame rates are due at the
+    same moment.
+    """
+    # (tolerating rounding error of times already on the grid)
+    return math.floor(t / period + 1e-9) * period
+
+
+class FrameScheduler:
+    """Shared frame clock for the web views of a server
+
+    Views wait on absolute deadlines (see wait_until()), so time spent
+    drawing or waking up doesn't accumulate as drift.  A single task (see
+    run()) sleeps until the earliest deadline and wakes all views due within
+    `coalesce` seconds of it, so that many views don't each wake the event
+    loop at unaligned moments.
+
+    Only deadlines of views which are waiting are tracked.  Views count the
+    deadlines they miss, which are totalled by missed_deadlines.
+
+    Render budget: views report the event loop time of each frame (drawing
+    and sending, see charge()), and the scheduler measures loop lag as the
+    lateness of its own wakeups.  Once per interval, if the views' share of
+    loop time exceeds load_budget, or lag exceeds lag_threshold, the frame
+    rate of one view is halved (via its `throttle` divisor), lowest priority
+    first.  When both fall below half their limits, throttled views are
+    restored one step per interval, highest priority first.  The current
+    measurements are available as `load` and `lag`.
+    """
+
+    MAX_THROTTLE = 16
+
+    def __init__(self, *, coalesce=.004, load_budget=None, lag_threshold=None, interval=1):
+        """
+        :param coalesce: views due within this many seconds of each other are
+          woken together (possibly early by up to this amount)
+        :param load_budget: optional fraction of event loop time which views
+          may use, e.g. .05
+        :param lag_threshold: optional event loop lag (seconds) beyond which
+          views are throttled
+        :param interval: seconds between render budget updates
+        """
+        self._coalesce = coalesce
+        self._loadBudget = load_budget
+        self._lagThreshold = lag_threshold
+        self._interval = interval
+        self._waiters = []  # heap of (deadline, seq, event)
+        self._seq = 0
+        self._changed = None  # set when the earliest deadline changes
+        self._views = {}  # draw context: loop time in current interval
+        self._intervalStart = None
+        self._maxLag = 0
+        self.is_running = False
+        self.wakeups = 0
+        self.missed_deadlines = 0
+        self.load = 0.
+        self.lag = 0.
+
+    async def wait_until(self, deadline):
+        """Wait until the given deadline (anyio.current_time() clock)
+
+        If the scheduler isn't running, this is a plain sleep.
+        """
+        if not self.is_running:
+            await anyio.sleep(max(0, deadline - anyio.current_time()))
+            return
+        event = anyio.Event()
+        self._seq += 1
+        heapq.heappush(self._waiters, (deadline, self._seq, event))
+        if self._waiters[0][2] is event:
+            self._changed.set()
+        await event.wait()
+
+    def report_missed(self, count):
+        """Record that a view missed `count` frame deadlines"""
+        self.missed_deadlines += count
+        _logger.debug('view missed %d frame deadline(s)', count)
+
+    def add_view(self, ctx):
+        """Register draw context subject to the render budget"""
+        self._views[ctx] = 0.
+
+    def remove_view(self, ctx):
+        self._views.pop(ctx, None)
+        ctx.throttle = 1
+
+    def charge(self, ctx, seconds):
+        """Record event loop time used by a view's frame"""
+        self._views[ctx] += seconds
+
+    def _updateBudget(self, now):
+        views = self._views
+        self.load = sum(views.values()) / (now - self._intervalStart)
+        self.lag = self._maxLag
+        self._intervalStart = now
+        self._maxLag = 0
+        budget, lag_threshold = self._loadBudget, self._lagThreshold
+        if (budget is not None and self.load > budget) or \
+                (lag_threshold is not None and self.lag > lag_threshold):
+            # (views without clients are idle, so not candidates)
+            candidates = [ctx for ctx, load in views.items()
+                          if load and ctx.throttle < self.MAX_THROTTLE]
+            if candidates:
+                # lowest priority, then highest load
+                ctx = min(candidates, key=lambda ctx_: (ctx_.priority, -views[ctx_]))
+                ctx.throttle *= 2
+                _logger.info('render budget: throttling view (load %.3f, lag %.3f s), '
+                             'frame rate divisor %d', self.load, self.lag, ctx.throttle)
+        elif (budget is None or self.load < budget / 2) and \
+                (lag_threshold is None or self.lag < lag_threshold / 2):
+            throttled = [ctx for ctx in views if ctx.throttle > 1]
+            if throttled:
+                ctx = max(throttled, key=lambda ctx_: ctx_.priority)
+                ctx.throttle //= 2
+                _logger.info('render budget: restoring view, frame rate divisor %d',
+                             ctx.throttle)
+        for ctx in views:
+            views[ctx] = 0.
+
+    async def run(self):
+        """Task waking views at their deadlines"""
+        waiters = self._waiters
+        self.is_running = True
+        self._intervalStart = anyio.current_time()
+        try:
+            while True:
+                self._changed = anyio.Event()
+                if waiters:
+                    target = waiters[0][0]
+                    with anyio.move_on_after(target - anyio.current_time()):
+                        await self._changed.wait()
+                        continue
+                else:
+                    await self._changed.wait()
+                    continue
+                self.wakeups += 1
+                now = anyio.current_time()
+                self._maxLag = max(self._maxLag, now - target)
+                if now - self._intervalStart >= self._interval:
+                    self._updateBudget(now)
+                due = now + self._coalesce
+                while waiters and waiters[0][0] <= due:
+                    heapq.heappop(waiters)[2].set()
+        finally:
+            self.is_running = False
@@ -1,15 +1,26 @@
+import inspect
 import json
 import logging
 import math
 import numbers
+import time
+from base64 import b64decode
 from contextlib import contextmanager
 from enum import Enum, auto
-from functools import wraps, total_ordering
-from itertools import takewhile
-from typing import NamedTuple
+from functools import lru_cache, wraps, total_ordering
+from itertools import count
+from typing import NamedTuple, Optional
 
 import anyio
-from attr import attrs
+from attr import attrib, attrs, Factory
+
+from ._diff import edits_cost, frame_edits
+from ._image_store import image_store
+from ._metrics import ViewMetrics
+from ._peer import Peer
+from ._protocol import (Op, Protocol, encode, encode_diff_frame, encode_key_frame, pack_colors,
+                        pack_floats, quantize)
+from ._scheduler import FrameScheduler, grid_deadline
 
 TWO_PI = math.pi * 2
 
@@ -20,6 +31,9 @@ DEFAULT_TEXT_FONT = 'Arial'
 DEFAULT_TEXT_SIZE = 12
 DEFAULT_BACKGROUND_COLOR = 200
 DEFAULT_FILL_COLOR = 255
+# (diff mode) frames with edits of more than this fraction of their commands
+# are sent as key frames
+MAX_DIFF_FRACTION = .5
 
 
 @total_ordering
@@ -72,7 +86,9 @@ class Color:
     Like Processing color(), values are immutable.
     As an extension, the raw r/g/b/a channel values are available as attributes.
 
-    TODO: support raw input similar to Processing (e.g. 0xFFCC00)
+    Packed input is supported with Color.from_int(0xRRGGBBAA).  (Unlike
+    Processing, a plain int argument is always gray.)
+
     TODO: implement colorMode(), red(), green(), etc. functions of Processing
     """
 
@@ -80,6 +96,9 @@ class Color:
     g: int
     b: int
     a: int
+    # cached encodings, see js_string() and rgba_int()
+    _js_string: Optional[str] = attrib(default=None, eq=False, repr=False)
+    _rgba_int: Optional[int] = attrib(default=None, eq=False, repr=False)
 
     def __init__(self, *args):
         """
@@ -109,13 +128,37 @@ class Color:
             r, g, b, a = args
         # __setattr__() must be used to bypass frozen restriction
         for name, val in zip('rgba', (r, g, b, a)):
+            # (int() of e.g. NumPy integers, which would overflow when packed)
+            val = int(val)
+            if not 0 <= val <= 255:
+                raise ValueError(f'color channel out of range 0..255: {val}')
             object.__setattr__(self, name, val)
+        object.__setattr__(self, '_js_string', None)
+        object.__setattr__(self, '_rgba_int', None)
+
+    @classmethod
+    def from_int(cls, value):
+        """Returns color given packed 0xRRGGBBAA int"""
+        return _color_from_int(value)
 
     def js_string(self):
         """Returns JavaScript color string"""
-        if self.a == 255:
-            return '#%02X%02X%02X' % (self.r, self.g, self.b)
-        return '#%02X%02X%02X%02X' % (self.r, self.g, self.b, self.a)
+        s = self._js_string
+        if s is None:
+            if self.a == 255:
+                s = '#%02X%02X%02X' % (self.r, self.g, self.b)
+            else:
+                s = '#%02X%02X%02X%02X' % (self.r, self.g, self.b, self.a)
+            object.__setattr__(self, '_js_string', s)
+        return s
+
+    def rgba_int(self):
+        """Returns packed 0xRRGGBBAA int"""
+        v = self._rgba_int
+        if v is None:
+            v = self.r << 24 | self.g << 16 | self.b << 8 | self.a
+            object.__setattr__(self, '_rgba_int', v)
+        return v
 
 
 class TextAlign(Enum):
@@ -139,70 +182,227 @@ class _ShapeState(Enum):
     OPEN = auto()
 
 
+# small integer ids for referencing images, etc. on the client
+_resource_ids = count(1)
+
+
 @attrs(auto_attribs=True)
 class Image:
-    _base64_str: str
+    _key: str  # in image_store
+    _id: int = Factory(lambda: next(_resource_ids))
+
+
+@attrs(auto_attribs=True, slots=True)
+class FrameStats:
+    """Counters of a single frame, see DrawContext.frameStats"""
+    commands: int = 0  # draw commands queued
+    elided: int = 0  # redundant canvas state commands dropped
+    bytes_raw: int = 0  # size of messages sent, summed over peers
+    bytes_sent: int = 0  # likewise, after compression
+    finalize_time: float = 0.  # seconds spent encoding, diffing, and compressing
+    # finalize time (threaded mode) and imageArray() encoding moved off the event loop
+    loop_time_saved: float = 0.
+    dropped: int = 0  # peers which skipped the frame (see Peer.admit_frame())
+
+
+class Shape:
+    """Retained shape, as returned by DrawContext.createShape()
+
+    Like Processing PShape, the shape is recorded once using beginShape(),
+    vertex(), and endShape().  It's then uploaded to clients, and drawn by
+    reference with DrawContext.shape() using the current transform and style.
+    """
+
+    def __init__(self, ctx):
+        self._ctx = ctx
+        self._id = next(_resource_ids)
+        self._state = _ShapeState.NONE
+        self._vertices = []  # packed chunks of vertices
+        self._points = None  # packed vertices once recorded
+        self._closed = False
+
+    def beginShape(self):
+        assert self._state is _ShapeState.NONE and self._points is None, \
+            'unexpected beginShape()'
+        self._state = _ShapeState.OPEN
+
+    def vertex(self, x, y):
+        assert self._state is _ShapeState.OPEN, 'path not open'
+        self._vertices.append(pack_floats((x, y)))
+
+    def vertices(self, points):
+        """Add vertices given array of x, y per vertex (see DrawContext.vertices())"""
+        assert self._state is _ShapeState.OPEN, 'path not open'
+        self._vertices.append(_pack_batch(points, 2))
+
+    def endShape(self, close=False):
+        assert self._state is _ShapeState.OPEN, 'unexpected endShape()'
+        self._state = _ShapeState.NONE
+        self._closed = bool(close)
+        self._points = b''.join(self._vertices)
+        self._vertices = None
+        self._ctx._loadShape(self)
+
+
+# Colors are interned, since draw code tends to use the same few colors every
+# frame.  Besides saving construction, the cached JS string, etc. of each
+# color object are reused, and identical colors compare quickly.
+_COLOR_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=_COLOR_CACHE_SIZE)
+def _color(*args):
+    """Return color object given color object or color object init args."""
+    if len(args) == 1 and isinstance(args[0], Color):
+        return args[0]
+    return Color(*args)
+
+
+@lru_cache(maxsize=_COLOR_CACHE_SIZE)
+def _color_from_int(value):
+    return _color(value >> 24 & 0xff, value >> 16 & 0xff, value >> 8 & 0xff, value & 0xff)
 
 
 def _canvas_color(*args):
     """Return JS color string given color object or color object init args."""
-    if len(args) == 1 and isinstance(args[0], Color):
-        return args[0].js_string()
-    return Color(*args).js_string()
+    return _color(*args).js_string()
+
+
+def _pack_batch(values, stride):
+    """Return packed coordinates of a batch primitive
+
+    :param values: array of `stride` values per element (see pack_floats())
+    """
+    points = pack_floats(values)
+    if len(points) % (4 * stride):
+        raise ValueError(f'expected {stride} values per element')
+    return points
+
+
+def _pack_batch_colors(colors, points, stride):
+    """Return packed per-element colors of a batch primitive, or empty bytes"""
+    if colors is None:
+        return b''
+    packed_colors = pack_colors(colors)
+    n = len(points) // (4 * stride)
+    if len(packed_colors) != 4 * n:
+        raise ValueError(f'expected {n} colors')
+    return packed_colors
 
 
-def queue_eval(func):
-    """Decorator taking returned eval and adding to send queue."""
+def queue_command(func):
+    """Decorator taking returned command and adding to send queue."""
     @wraps(func)
     def wrapper(self, *args, **kwargs):
-        s = func(self, *args, **kwargs)
-        assert s.endswith((';', '}'))
+        cmd = func(self, *args, **kwargs)
         assert self._is_draw_context, 'WebView API used outside of draw() context'
-        self._sendQueue.append(s)
-        # A terrible hack... since the client must queue commands while an image
-        # load is pending, and since commands are batched from our side, it's
-        # necessary to force a batch boundary after an image load.  The existence
-        # of "isImageLoadPending" indicates such an image load, but this will add
-        # unnecessary boundaries due to conditional expressions in the commands.
-        # TODO: Use a different approach like command grouping so that the client
-        #  understands boundaries regardless of batching.
-        if 'isImageLoadPending' in s:
-            self._sendQueue.append('')
+        self._sendQueue.append(cmd)
+    return wrapper
+
+
+def queue_state_command(func):
+    """Decorator like queue_command, for commands setting canvas state.
+
+    If state elision is enabled, the command is dropped when it wouldn't change
+    the effective canvas state.  State is keyed by op, so each op must set a
+    distinct part of the state.
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        cmd = func(self, *args, **kwargs)
+        assert self._is_draw_context, 'WebView API used outside of draw() context'
+        if self._elide:
+            state = self._canvasState
+            if state.get(cmd[0]) == cmd:
+                self._frameStats.elided += 1
+                return
+            state[cmd[0]] = cmd
+        self._sendQueue.append(cmd)
     return wrapper
 
 
-def queue_eval_optional(func):
-    """Decorator taking returned eval and adding to send queue if in draw context."""
+def queue_resource_command(func):
+    """Decorator taking returned command and adding to resource queue.
+
+    Resource commands (image loads, etc.) alter client state beyond the frame,
+    so they are sent separately from the frame's draw commands.  Outside of
+    the draw context, the command is held until the next frame is drawn, or
+    dropped if no client is connected (clients are sent current resources
+    on connecting).
+    """
     @wraps(func)
     def wrapper(self, *args, **kwargs):
+        cmd = func(self, *args, **kwargs)
         if self._is_draw_context:
-            s = func(self, *args, **kwargs)
-            assert s.endswith((';', '}'))
-            self._sendQueue.append(s)
+            self._resourceQueue.append(cmd)
+        elif self._peers:
+            self._pendingResources.append(cmd)
     return wrapper
 
 
+def queue_release_command(func):
+    """Decorator taking returned command and adding to release queue.
+
+    Release commands free client resources, and are sent after the frame's
+    draw commands.  Outside of the draw context, the command is held until
+    the next frame is drawn, or dropped if no client is connected.
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        cmd = func(self, *args, **kwargs)
+        if self._is_draw_context:
+            self._releaseQueue.append(cmd)
+        elif self._peers:
+            self._pendingReleases.append(cmd)
+    return wrapper
+
+
+def _split_after_layers(commands):
+    """Return command lists split after each LOAD_LAYER, which must end its message"""
+    parts = []
+    start = 0
+    for i, cmd in enumerate(commands, 1):
+        if cmd[0] is Op.LOAD_LAYER:
+            parts.append(commands[start:i])
+            start = i
+    if start < len(commands) or not parts:
+        parts.append(commands[start:])
+    return parts
+
+
+class RenderedFrame(NamedTuple):
+    """Frame drawn offline by WebView.render_frame()"""
+    commands: list  # (Op, *args) tuples
+    messages: list  # as sent to a client (str or bytes)
+    stats: FrameStats
+
+
+class _FrameMode(Enum):
+    BATCHED = auto()  # full frame split into batches
+    KEY = auto()  # (diff mode) full frame retained by client
+    DIFF = auto()  # (diff mode) edits to previous frame
+    SKIP = auto()  # frame skipped due to peer backlog or pacing (resources are still sent)
+
+
 # About client commands
 #
-# All command strings are JavaScript which are simply eval'd by the client.
-# Eval environment:
-#
-#     available global state:
-#         ctx: HTML5 canvas context object for drawing
-#         ws_url: base URL of this webview server
-#     pura namespace methods:
-#         swap() - move hidden canvas (for drawing) to the front
-#         add_webview(name, port, width, height) - register the given webview.
-#             (For use by main websocket only.)
-#
-#     See html/js/pura.js for the implementation.
+# Drawing primitives queue commands, which are tuples of (Op, *args).  At the
+# end of each frame the commands are encoded for each peer according to the
+# protocol it negotiated: either JavaScript to be eval'd by the client, or a
+# compact binary encoding.  See _protocol.py for details.
 
 class WebView:
     """Remote visualization agent"""
 
-    def __init__(self, name, *, size, draw_fn, frame_rate=5):
+    def __init__(self, name, *, size, draw_fn, frame_rate=5, diff=False, elide=True,
+                 precision=None, threaded=False, draw_timeout=None, priority=0,
+                 input_queue_size=256):
         self.name = name
-        self._ctx = DrawContext(size=size, draw_fn=draw_fn, frame_rate=frame_rate)
+        self._ctx = DrawContext(size=size, draw_fn=draw_fn, frame_rate=frame_rate,
+                                diff=diff, elide=elide, precision=precision,
+                                threaded=threaded, draw_timeout=draw_timeout,
+                                priority=priority, input_queue_size=input_queue_size)
+        self._offlinePeer = None  # (options, Peer) of render_frame()
 
     @property
     def width(self):
@@ -212,19 +412,49 @@ class WebView:
     def height(self):
         return self._ctx.height
 
+    def render_frame(self, *, protocol='binary', diff=False, compression_level=None,
+                     messages=()):
+        """Draw and encode one frame offline, without a server or client
+
+        This is for benchmarks, tests, and the like.  Frames are encoded as
+        for a client with the given options, and consecutive calls with the
+        same options continue the same (diff or compression) stream.  Don't
+        call this while the view is being served.
+
+        :param protocol: 'js' or 'binary'
+        :param diff: if the view has diff enabled, encode frame diffs
+        :param compression_level: optional zlib level for compressing messages
+        :param messages: JSON input messages from the client, as received
+          before the frame
+        :return: RenderedFrame
+        """
+        options = Protocol(protocol), diff, compression_level
+        if self._offlinePeer is None or self._offlinePeer[0] != options:
+            self._offlinePeer = options, Peer(None, protocol=options[0], diff=diff,
+                                              compression_level=compression_level)
+        return self._ctx._renderFrame(self._offlinePeer[1], messages)
+
     async def serve(self, webview_server):
         """Make webview available on the given webview server."""
         await webview_server.add_webview(self.name, self._ctx)
-        await self._ctx._run_draw_loop()
+        await self._ctx._run_draw_loop(webview_server.scheduler)
 
-    def loadImage(self, base64_str):
-        """Returns image reference"""
-        return self._ctx.loadImage(base64_str)
+    def loadImage(self, data):
+        """Returns image reference, given encoded image as bytes or base64 string"""
+        return self._ctx.loadImage(data)
 
     def unloadImage(self, image):
         """Unloads image"""
         return self._ctx.unloadImage(image)
 
+    def createShape(self):
+        """Returns shape to be recorded, and then drawn with DrawContext.shape()"""
+        return self._ctx.createShape()
+
+    def unloadShape(self, shape):
+        """Unloads shape"""
+        return self._ctx.unloadShape(shape)
+
 
 class DrawContext:
     """webview draw context
@@ -249,20 +479,36 @@ class DrawContext:
 
         * Color type is capitalized
 
-        * loadImage() takes inline image (base64 string) rather than file path,
-          and the returned image handle is opaque (no fields for width,
-          height, etc.).
+        * loadImage() takes an encoded image (bytes or base64 string)
+          rather than file path, and the returned image handle is opaque (no
+          fields for width, height, etc.).  Clients fetch the image from the
+          server by content hash, and may cache it.
 
         * unloadImage() is provided to free sever and client memory if needed.
 
+        * createShape() takes no arguments, and the shape is limited to a
+          single path of vertices.  Once recorded, it's stored on the client
+          so that shape() need only send a reference.  unloadShape() is
+          provided to free memory if needed.
+
+        * batch primitives lines(), points(), polyline(), rects(), and
+          circles() draw many elements from an array of coordinates (e.g.
+          NumPy) with a single command.  vertices() is an array form of
+          vertex().
+
         * image() accepts inline image (base64 string) in addition to handle
           from loadImage().  Since it the client draw is blocked until the
           image is ready, streaming of image sequences is possible.
+          imageArray() draws a NumPy array, encoded off the event loop.
 
         * smooth() takes no argument, and applies only to image() and not to
           other drawing primitives.  Unlike Processing 3, it's bound to the
           draw context.
 
+    Commands which wouldn't change the canvas state (e.g. fill() with the
+    current fill color) are dropped unless disabled with elide=False.  Counters
+    of the most recently sent frame are available as frameStats.
+
     inputEvents "event_name: value":
         keydown/keyup: KeyboardKey
         mousedown/mouseup: (x, y)
@@ -270,24 +516,86 @@ class DrawContext:
 
     # pylint: disable=no-self-use
 
-    def __init__(self, *, size, frame_rate, draw_fn):
+    def __init__(self, *, size, frame_rate, draw_fn, diff=False, elide=True,
+                 precision=None, threaded=False, draw_timeout=None, priority=0,
+                 input_queue_size=256):
         """
         :param size: sequence of width, height
         :param frame_rate: rate of draw calls when the view is active
-        :param draw_fn: draw function called each frame when the view is active
+        :param draw_fn: draw function called each frame when the view is active.
+          It may be a coroutine function, in which case it's awaited (see
+          draw_timeout).
+        :param diff: if True, send clients supporting it only the changes
+          relative to the previous frame.  This saves bandwidth for mostly
+          static views, at the cost of some CPU.
+        :param elide: if True, drop commands which wouldn't change the canvas
+          state, such as fill() with the current fill color
+        :param precision: if set, round coordinates, sizes, and angles of
+          drawing primitives to this number of decimal digits, for frames
+          sent to clients of the JS protocol or in diff mode.  E.g. 2 is
+          plenty for a canvas a few hundred pixels wide.  It shortens the
+          number literals of the JS protocol, and lets frame diffs match
+          values differing only beyond the precision.  (The binary protocol
+          has fixed size floats, so doesn't benefit otherwise.)
+        :param threaded: if True, finalize each frame (encoding, diffing, and
+          compression) in a worker thread, while the event loop only hands
+          over the frame's commands.  The draw function still runs on the
+          event loop.  Since Python code contends for the GIL, this mostly
+          helps loop latency rather than total CPU.  See
+          frameStats.loop_time_saved.
+        :param draw_timeout: (coroutine draw_fn only) seconds to wait for the
+          draw function, defaulting to the frame period.  A frame which times
+          out is discarded, and counted by discardedFrames.
+        :param priority: views of lower priority are throttled first when the
+          server's render budget is exceeded (see FrameScheduler)
+        :param input_queue_size: maximum client messages held for the next
+          frame.  Consecutive mouse moves are coalesced on arrival, and
+          messages beyond the limit are dropped, counted by droppedInputs.
         """
         self.width, self.height = size
         self._draw_fn = draw_fn
+        self._draw_is_async = inspect.iscoroutinefunction(draw_fn)
+        self._draw_timeout = 1 / frame_rate if draw_timeout is None else draw_timeout
         self._frame_rate = frame_rate
+        self.priority = priority
+        self.throttle = 1  # frame rate divisor set by the render budget
+        self._diff = diff
+        self._elide = elide
+        self._precision = precision
+        self._threaded = threaded
+        # (elide mode) state commands in effect, keyed by op, and the state
+        # saved by each open pushContext()
+        self._canvasState = {}
+        self._canvasStateStack = []
+        self._frameStats = FrameStats()
+        self.frameStats = FrameStats()  # of the most recently sent frame
         self._peers = set()
         self._hasPeers = anyio.Event()
-        # NOTE: empty string is used to force a batching boundary
         self._sendQueue = []
+        # send queue indices at which to force a batching boundary
+        self._batchBoundaries = []
+        # sent before and after the frame, respectively
+        self._resourceQueue = []
+        self._releaseQueue = []
+        # likewise, queued outside of the draw context for the next frame
+        self._pendingResources = []
+        self._pendingReleases = []
+        # (send queue index, ArrayImage) of imageArray() placeholders
+        self._arrayImages = []
         self._receiveQueue = []  # oldest to newest
+        self._receiveQueueSize = input_queue_size
+        self._lastReceivedMove = False  # last queued message is a mousemove
         self._shapeState = _ShapeState.NONE
-        self._images = []
+        self._images = {}  # by id
+        self._shapes = []
+        self._layers = {}  # name: (id, key, LOAD_LAYER command)
+        self._inLayer = False
         self._is_draw_context = False
         self.frameCount = 0
+        self.missedDeadlines = 0  # frame deadlines passed while drawing or sending
+        self.discardedFrames = 0  # (coroutine draw_fn) frames timed out or cancelled
+        self.droppedInputs = 0  # client messages beyond input_queue_size
+        self.metrics = ViewMetrics()  # cumulative, see WebViewServer /metrics
         self.mousePressed = False
         self.mouseX = 0
         self.mouseY = 0
@@ -295,23 +603,42 @@ class DrawContext:
         self.key = ''
         self.inputEvents = []
 
-    @staticmethod
-    async def _broadcast(peers, msg):
-        """Broadcast message to given clients, ignoring connection errors."""
-        for peer in peers:
-            await peer.send(msg)
+    def _defaultsCommands(self):
+        """Return commands setting up canvas defaults"""
+        return [
+            (Op.STROKE_CAP, StrokeCap.ROUND.value),
+            (Op.FONT, DEFAULT_TEXT_SIZE, DEFAULT_TEXT_FONT),
+            (Op.BACKGROUND, _color(DEFAULT_BACKGROUND_COLOR), self.width, self.height),
+            (Op.FILL, _color(DEFAULT_FILL_COLOR)),
+        ]
+
+    def _initialCanvasState(self):
+        """Return canvas state in effect at the start of each frame"""
+        return {
+            # canvas defaults
+            Op.STROKE: (Op.STROKE, _color(0)),
+            Op.STROKE_WEIGHT: (Op.STROKE_WEIGHT, 1),
+            Op.IMAGE_SMOOTHING: (Op.IMAGE_SMOOTHING, True),
+            # see _defaultsCommands()
+            Op.STROKE_CAP: (Op.STROKE_CAP, StrokeCap.ROUND.value),
+            Op.TEXT_SIZE: (Op.TEXT_SIZE, DEFAULT_TEXT_SIZE),
+            Op.TEXT_FONT: (Op.TEXT_FONT, DEFAULT_TEXT_FONT),
+            Op.FILL: (Op.FILL, _color(DEFAULT_FILL_COLOR)),
+        }
+
+    def _resourceCommands(self):
+        """Return commands loading current resources, for newly connected peers"""
+        commands = [(Op.LOAD_IMAGE, image._id, image._key) for image in self._images.values()]
+        commands.extend((Op.LOAD_SHAPE, shape._id, shape._closed, shape._points)
+                        for shape in self._shapes)
+        commands.extend(load for _, _, load in self._layers.values())
+        return commands
 
     async def _handleConnected(self, peer):
-        # set up canvas defaults, etc.
-        await peer.send(
-            f"ctx.lineCap = '{StrokeCap.ROUND.value}';"
-            f"ctx.font = '{DEFAULT_TEXT_SIZE}px {DEFAULT_TEXT_FONT}';"
-            f"ctx.fillStyle = '{_canvas_color(DEFAULT_BACKGROUND_COLOR)}';"
-            f"ctx.fillRect(0, 0, {self.width}, {self.height});"
-            f"ctx.fillStyle = '{_canvas_color(DEFAULT_FILL_COLOR)}';"
-        )
-        for image in self._images:
-            await peer.send(self._loadImage(id(image), image._base64_str))
+        commands = self._defaultsCommands()
+        commands.extend(self._resourceCommands())
+        for part in _split_after_layers(commands):
+            await peer.send(encode(part, peer.protocol))
         # peer will be included at start of next draw loop
         self._peers.add(peer)
         self._hasPeers.set()
@@ -320,12 +647,25 @@ class DrawContext:
         self._peers.remove(peer)
         if not self._peers:
             self._hasPeers = anyio.Event()
+            self._pendingResources.clear()
+            self._pendingReleases.clear()
 
     async def _handleMessage(self, peer, msg):
         """Process incoming JSON message from webview client."""
         # TODO: only accept input from one webview client
         # queue the message until our next draw iteration
-        self._receiveQueue.append(msg)
+        queue = self._receiveQueue
+        # Only the latest of consecutive mouse moves matters, so it replaces
+        # the previous one.  (Cheap test of the raw message, which can't
+        # otherwise contain this string.)
+        is_move = '"mousemove"' in msg
+        if is_move and self._lastReceivedMove:
+            queue[-1] = msg
+        elif len(queue) < self._receiveQueueSize:
+            queue.append(msg)
+            self._lastReceivedMove = is_move
+        else:
+            self.droppedInputs += 1
 
     def _handleDeferredMessage(self, msg):
         msg = json.loads(msg)
@@ -369,137 +709,431 @@ class DrawContext:
         else:
             logger.warning(f"unhandled message type: {msg['type']}")
 
-    async def _run_draw_loop(self):
-        period = 1 / self._frame_rate
-        while True:
-            t_start = anyio.current_time()
-            await self._hasPeers.wait()
-            peers = self._peers.copy()
-            self.inputEvents.clear()
-            for msg in self._receiveQueue:
-                self._handleDeferredMessage(msg)
-            self._receiveQueue.clear()
-            self._is_draw_context = True
-            with self.pushContext():
-                self._draw_fn(self)
-                self._swapBuffer()
+    def _batchRanges(self):
+        """Return (start, end) send queue ranges to be sent as separate messages"""
+        queue_length = len(self._sendQueue)
+        boundaries = self._batchBoundaries
+        # force a break mid-queue to provide some pipelining with client
+        if queue_length > 1:
+            mid_index = queue_length // 2
+            if not any(abs(i - mid_index) <= 1 for i in boundaries):
+                boundaries.append(mid_index)
+                boundaries.sort()
+        bounds = [0, *boundaries, queue_length]
+        return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+    def _frameMessages(self, protocol, mode, edits):
+        """Return list of messages conveying the queued frame"""
+        messages = []
+        if self._resourceQueue:
+            messages.extend(encode(part, protocol)
+                            for part in _split_after_layers(self._resourceQueue))
+        if mode is _FrameMode.SKIP:
+            pass
+        elif mode is _FrameMode.BATCHED:
+            queue = self._sendQueue
+            messages.extend(encode(queue[start:end], protocol)
+                            for start, end in self._batchRanges())
+        elif mode is _FrameMode.KEY:
+            messages.append(encode_key_frame(self._sendQueue, protocol))
+        else:
+            messages.append(encode_diff_frame(edits, protocol))
+        if self._releaseQueue:
+            messages.append(encode(self._releaseQueue, protocol))
+        return messages
+
+    def _finalizeFrame(self, peer_modes):
+        """Return [(peer, mode, messages)] of queued frame, ready to be sent
+
+        Messages are in the protocol and mode of each peer, and prepared for
+        sending (i.e. compressed).  In threaded mode this is called from a
+        worker thread, so it must not access state which could be changed
+        by the event loop in the meantime.
+        """
+        t_start = time.perf_counter()
+        stats = self._frameStats
+        if self._precision is not None and any(
+                mode is not _FrameMode.SKIP
+                and (peer.protocol is Protocol.JS or mode is not _FrameMode.BATCHED)
+                for peer, mode in peer_modes):
+            self._sendQueue = quantize(self._sendQueue, self._precision)
+        # (diff mode) edits by id of the peer's reference frame, which peers
+        # usually share, or None if a key frame is to be sent instead
+        edits_by_reference = {}
+        for peer, mode in peer_modes:
+            reference = peer.reference_frame
+            if mode is _FrameMode.DIFF and id(reference) not in edits_by_reference:
+                edits = frame_edits(reference, self._sendQueue)
+                # (a key frame is cheaper for the client to apply, and no larger)
+                edits_by_reference[id(reference)] = \
+                    None if edits_cost(edits) > len(self._sendQueue) * MAX_DIFF_FRACTION \
+                    else edits
+        messages_by_variant = {}
+        peer_messages = []
+        for peer, mode in peer_modes:
+            edits = None
+            if mode is _FrameMode.DIFF:
+                edits = edits_by_reference[id(peer.reference_frame)]
+                if edits is None:
+                    mode = _FrameMode.KEY
+            variant = peer.protocol, mode, id(edits)
+            messages = messages_by_variant.get(variant)
+            if messages is None:
+                messages = messages_by_variant[variant] = \
+                    self._frameMessages(peer.protocol, mode, edits)
+            prepared = [peer.prepare(msg) for msg in messages]
+            stats.bytes_raw += sum(map(len, messages))
+            stats.bytes_sent += sum(map(len, prepared))
+            peer_messages.append((peer, mode, prepared))
+        stats.finalize_time = time.perf_counter() - t_start
+        return peer_messages
+
+    def _peerFrameMode(self, peer):
+        if not (self._diff and peer.diff):
+            return _FrameMode.BATCHED
+        if peer.needs_keyframe:
+            peer.needs_keyframe = False
+            return _FrameMode.KEY
+        return _FrameMode.DIFF
+
+    def _setReferenceFrame(self, peer, mode):
+        """(diff mode) Record the queued frame as retained by the peer, if sent"""
+        if mode in (_FrameMode.KEY, _FrameMode.DIFF):
+            peer.reference_frame = self._sendQueue
+
+    def _encodeArrayImagesSync(self):
+        queue = self._sendQueue
+        for i, array_image in self._arrayImages:
+            queue[i] = array_image.encode()
+
+    async def _encodeArrayImages(self):
+        """Replace imageArray() placeholders of the send queue with the encoded images
+
+        Images are encoded concurrently in worker threads.
+        """
+        queue = self._sendQueue
+
+        async def encode_image(i, array_image):
+            queue[i] = await anyio.to_thread.run_sync(array_image.encode)
+
+        t_start = time.perf_counter()
+        async with anyio.create_task_group() as tg:
+            for i, array_image in self._arrayImages:
+                tg.start_soon(encode_image, i, array_image)
+        self._frameStats.loop_time_saved += time.perf_counter() - t_start
+
+    async def _sendFrame(self, peers):
+        """Send queued frame to peers, in the protocol and mode of each.
+
+        Messages are queued to each peer, so this doesn't wait on the network.
+        Peers still sending previous frames, or lacking credit or bandwidth,
+        skip this one.  (Images of imageArray() are only encoded if some peer
+        takes the frame, otherwise the frame's draw commands are discarded.)
+        """
+        peer_modes = []
+        for peer in peers:
+            if peer.admit_frame():
+                mode = self._peerFrameMode(peer)
+            else:
+                mode = _FrameMode.SKIP
+                self._frameStats.dropped += 1
+            peer_modes.append((peer, mode))
+        if self._arrayImages:
+            if any(mode is not _FrameMode.SKIP for _, mode in peer_modes):
+                await self._encodeArrayImages()
+            else:
+                self._sendQueue.clear()
+                self._batchBoundaries.clear()
+                self._arrayImages.clear()
+        if self._threaded:
+            peer_messages = await anyio.to_thread.run_sync(self._finalizeFrame, peer_modes)
+            self._frameStats.loop_time_saved += self._frameStats.finalize_time
+        else:
+            peer_messages = self._finalizeFrame(peer_modes)
+        for peer, mode, messages in peer_messages:
+            self._setReferenceFrame(peer, mode)
+            if messages:
+                peer.send_prepared(messages, is_frame=mode is not _FrameMode.SKIP)
+
+    def _endFrame(self):
+        """Reset queues once the frame is sent"""
+        self.frameStats = self._frameStats
+        if self._diff:
+            # (not cleared, since it may be the reference frame of peers)
+            self._sendQueue = []
+        else:
+            self._sendQueue.clear()
+        self._batchBoundaries.clear()
+        self._arrayImages.clear()
+        self._resourceQueue.clear()
+        self._releaseQueue.clear()
+        self.frameCount += 1
+
+    def _renderFrame(self, peer, messages):
+        """Draw and encode a frame for the given peer, which isn't sent"""
+        self.inputEvents.clear()
+        for msg in messages:
+            self._handleDeferredMessage(msg)
+        self._drawFrame()
+        self._encodeArrayImagesSync()
+        _, mode, prepared = self._finalizeFrame([(peer, self._peerFrameMode(peer))])[0]
+        self._setReferenceFrame(peer, mode)
+        commands = list(self._sendQueue)
+        self._endFrame()
+        return RenderedFrame(commands, prepared, self.frameStats)
+
+    def _takePendingCommands(self):
+        self._resourceQueue.extend(self._pendingResources)
+        self._pendingResources.clear()
+        self._releaseQueue.extend(self._pendingReleases)
+        self._pendingReleases.clear()
+
+    def _drawFrame(self):
+        """Call draw function, queueing the frame's commands"""
+        self._frameStats = FrameStats()
+        if self._elide:
+            self._canvasState = self._initialCanvasState()
+            self._canvasStateStack.clear()
+        self._takePendingCommands()
+        self._is_draw_context = True
+        with self.pushContext():
+            self._draw_fn(self)
+            self._swapBuffer()
+        self._is_draw_context = False
+        self._frameStats.commands = len(self._sendQueue)
+
+    async def _drawFrameAsync(self):
+        """Await draw coroutine function, queueing the frame's commands
+
+        Returns False if the draw function timed out or was cancelled, in
+        which case the frame's draw commands are discarded.  Resource
+        commands are kept, since the resources themselves remain.
+        """
+        self._frameStats = FrameStats()
+        if self._elide:
+            self._canvasState = self._initialCanvasState()
+            self._canvasStateStack.clear()
+        self._takePendingCommands()
+        self._is_draw_context = True
+        completed = False
+        try:
+            with anyio.move_on_after(self._draw_timeout):
+                with self.pushContext():
+                    await self._draw_fn(self)
+                    self._swapBuffer()
+                completed = True
+        finally:
             self._is_draw_context = False
-            # batch messages to minimize send count
-            # honor explicit batch boundaries (empty string)
-            # force a break mid-queue to provide some pipelining with client
-            if len(self._sendQueue) > 1:
-                mid_index = len(self._sendQueue) // 2
-                if '' not in self._sendQueue[mid_index-1:mid_index+1]:
-                    self._sendQueue.insert(mid_index, '')
-            strings_iter = iter(self._sendQueue)
+            if not completed:
+                self._sendQueue.clear()
+                self._batchBoundaries.clear()
+                self._arrayImages.clear()
+                self._shapeState = _ShapeState.NONE
+                self.discardedFrames += 1
+        self._frameStats.commands = len(self._sendQueue)
+        return completed
+
+    async def _run_draw_loop(self, scheduler=None):
+        """Draw frames at the frame rate while there are peers
+
+        Frames are due at absolute deadlines (see grid_deadline()), waited on
+        via the given scheduler, if any.  A frame finishing after the next
+        deadline counts as missed deadlines, and the next frame is drawn
+        right away.
+
+        The event loop time of each frame is charged to the scheduler's render
+        budget, which may reduce the frame rate by the `throttle` divisor.
+        (Coroutine draw functions are charged their elapsed time.)
+        """
+        if scheduler is None:
+            scheduler = FrameScheduler()  # (not running, so plain sleeps)
+        base_period = 1 / self._frame_rate
+        deadline = None
+        scheduler.add_view(self)
+        try:
             while True:
-                msg = ''.join(takewhile(lambda s: s, strings_iter))
-                if msg:
-                    await self._broadcast(peers, msg)
+                if not self._hasPeers.is_set():
+                    await self._hasPeers.wait()
+                    deadline = None
+                period = base_period * self.throttle
+                if deadline is None:
+                    deadline = grid_deadline(anyio.current_time(), period)
+                t_start = time.perf_counter()
+                peers = self._peers.copy()
+                self.inputEvents.clear()
+                for msg in self._receiveQueue:
+                    self._handleDeferredMessage(msg)
+                self._receiveQueue.clear()
+                self._lastReceivedMove = False
+                if self._draw_is_async:
+                    completed = await self._drawFrameAsync()
                 else:
-                    break
-            self._sendQueue.clear()
-            self.frameCount += 1
-            user_elapsed = anyio.current_time() - t_start
-            await anyio.sleep(max(0, period - user_elapsed))
-
-    @queue_eval
+                    self._drawFrame()
+                    completed = True
+                if completed:
+                    t_drawn = time.perf_counter()
+                    await self._sendFrame(peers)
+                    self.metrics.record_frame(self._frameStats, t_drawn - t_start,
+                                              time.perf_counter() - t_drawn)
+                    self._endFrame()
+                scheduler.charge(self, time.perf_counter() - t_start -
+                                 self._frameStats.loop_time_saved)
+                # (throttle may have changed, so realign to the grid)
+                period = base_period * self.throttle
+                deadline = grid_deadline(deadline, period) + period
+                now = anyio.current_time()
+                if now < deadline:
+                    await scheduler.wait_until(deadline)
+                else:
+                    missed = math.floor((now - deadline) / period) + 1
+                    self.missedDeadlines += missed
+                    scheduler.report_missed(missed)
+                    deadline = grid_deadline(now, period)
+                    await anyio.sleep(0)
+        finally:
+            scheduler.remove_view(self)
+
+    @queue_command
     def background(self, *args):
-        return (
-            f"ctx.save();"
-            f"ctx.fillStyle = '{_canvas_color(*args)}';"
-            f"ctx.fillRect(0, 0, {self.width}, {self.height});"
-            f"ctx.restore();"
-        )
-
-    @queue_eval
+        return Op.BACKGROUND, _color(*args), self.width, self.height
+
+    @queue_command
     def _swapBuffer(self):
-        return 'pura.swap();'
+        return (Op.SWAP,)
 
-    @queue_eval
+    @queue_state_command
     def strokeWeight(self, x):
-        return f"ctx.lineWidth = {x};"
+        return Op.STROKE_WEIGHT, x
 
-    @queue_eval
+    @queue_state_command
     def strokeCap(self, cap: StrokeCap):
-        return f"ctx.lineCap = '{cap.value}';"
+        return Op.STROKE_CAP, cap.value
 
-    @queue_eval
+    @queue_state_command
     def stroke(self, *args):
-        return f"ctx.strokeStyle = '{_canvas_color(*args)}';"
+        return Op.STROKE, _color(*args)
 
     def noStroke(self):
         self.stroke(0, 0)
 
-    @queue_eval
+    @queue_state_command
     def fill(self, *args):
-        return f"ctx.fillStyle = '{_canvas_color(*args)}';"
+        return Op.FILL, _color(*args)
 
     def noFill(self):
         self.fill(0, 0)
 
-    @queue_eval
+    @queue_command
     def translate(self, x, y):
-        return f'ctx.translate({x}, {y});'
+        return Op.TRANSLATE, x, y
 
-    @queue_eval
+    @queue_command
     def rotate(self, a):
-        return f'ctx.rotate({a});'
+        return Op.ROTATE, a
 
-    @queue_eval
+    @queue_command
     def scale(self, x, y=None):
         if y is None:
             y = x
-        return f'ctx.scale({x}, {y});'
+        return Op.SCALE, x, y
 
     # TODO: support kind option
     # TODO: context manager (Processing.py has beginShape and beginClosedShape)
-    @queue_eval
+    @queue_command
     def beginShape(self):
         assert self._shapeState is _ShapeState.NONE, 'unexpected beginShape()'
         self._shapeState = _ShapeState.FIRST
-        return 'ctx.beginPath();'
+        return (Op.BEGIN_PATH,)
 
-    @queue_eval
+    @queue_command
     def endShape(self, close=False):
         assert self._shapeState is _ShapeState.OPEN, 'unexpected endShape()'
         self._shapeState = _ShapeState.NONE
-        return ('ctx.closePath();' if close else '') + (
-            'ctx.fill();'
-            'ctx.stroke();'
-        )
+        return Op.END_SHAPE, bool(close)
 
-    @queue_eval
+    @queue_command
     def vertex(self, x, y):
         if self._shapeState is _ShapeState.OPEN:
-            return f'ctx.lineTo({x}, {y});'
+            return Op.LINE_TO, x, y
         if self._shapeState is _ShapeState.FIRST:
             self._shapeState = _ShapeState.OPEN
-            return f'ctx.moveTo({x}, {y});'
+            return Op.MOVE_TO, x, y
         raise AssertionError('path not open')
 
-    @queue_eval
+    @queue_command
+    def vertices(self, points):
+        """Add vertices to the shape given array of x, y per vertex
+
+        Array form of vertex(), e.g. for an (n, 2) NumPy array.
+        """
+        if self._shapeState is _ShapeState.NONE:
+            raise AssertionError('path not open')
+        points = _pack_batch(points, 2)
+        move_first = self._shapeState is _ShapeState.FIRST
+        if move_first and points:
+            self._shapeState = _ShapeState.OPEN
+        return Op.VERTICES, move_first, points
+
+    @queue_command
     def line(self, x1, y1, x2, y2):
-        return (
-            f'ctx.beginPath();'
-            f'ctx.moveTo({x1}, {y1});'
-            f'ctx.lineTo({x2}, {y2});'
-            f'ctx.stroke();'
-        )
+        return Op.LINE, x1, y1, x2, y2
 
     def point(self, x, y):
         return self.line(x, y, x, y)
 
+    # Batch primitives
+    #
+    # These take an array of coordinates--a NumPy array, any other buffer, or
+    # a plain sequence--and queue a single command, so that the per-element
+    # work happens on the client.  Drawing is equivalent to calling the
+    # corresponding primitive for each element.  Optional per-element colors
+    # (sequence of Color, or (n, 3) or (n, 4) uint8 array) override the
+    # stroke (lines, points) or fill (rects, circles) of each element.
+
+    @queue_command
+    def lines(self, coords, colors=None):
+        """Draw lines given array of x1, y1, x2, y2 per line"""
+        points = _pack_batch(coords, 4)
+        return Op.LINES, points, _pack_batch_colors(colors, points, 4)
+
+    @queue_command
+    def points(self, coords, colors=None):
+        """Draw points given array of x, y per point"""
+        points = _pack_batch(coords, 2)
+        return Op.POINTS, points, _pack_batch_colors(colors, points, 2)
+
+    @queue_command
+    def polyline(self, coords, close=False):
+        """Draw connected lines given array of x, y per vertex
+
+        Like beginShape()/vertices()/endShape() but without fill.
+        """
+        return Op.POLYLINE, bool(close), _pack_batch(coords, 2)
+
+    @queue_command
+    def rects(self, coords, colors=None):
+        """Draw rectangles given array of x, y, width, height per rectangle"""
+        points = _pack_batch(coords, 4)
+        return Op.RECTS, points, _pack_batch_colors(colors, points, 4)
+
+    @queue_command
+    def circles(self, coords, d, colors=None):
+        """Draw circles given array of x, y center per circle
+
+        :param d: diameter, either a single value or array with one value
+          per circle
+        """
+        points = _pack_batch(coords, 2)
+        sizes = pack_floats((d,) if isinstance(d, numbers.Number) else d)
+        if len(sizes) not in (4, len(points) // 2):
+            raise ValueError('expected one diameter per circle')
+        return Op.CIRCLES, points, sizes, _pack_batch_colors(colors, points, 2)
+
     # TODO: support corner radius
     # TODO: support rectMode()
-    @queue_eval
+    @queue_command
     def rect(self, a, b, c, d):
-        return (
-            f'ctx.beginPath();'
-            f'ctx.rect({a},{b},{c},{d});'
-            f'ctx.fill();'
-            f'ctx.stroke();'
-        )
+        return Op.RECT, a, b, c, d
 
     # TODO: support ellipseMode
     def ellipse(self, x, y, w, h):
@@ -507,98 +1141,129 @@ class DrawContext:
 
     # TODO: support ellipseMode
     # TODO: support draw mode
-    @queue_eval
+    @queue_command
     def arc(self, x, y, w, h, start, stop):
         if w == h and abs(stop - start) == TWO_PI:
-            return (
-                f'ctx.beginPath();'
-                f'ctx.arc({x},{y},{w/2},{start},{stop});'
-                f'ctx.fill();'
-                f'ctx.stroke();'
-            )
-        return (
-            f'ctx.beginPath();'
-            f'ctx.save();'
-            f'ctx.translate({x}, {y});'
-            f'ctx.scale({w}, {h});'
-            f'ctx.moveTo(0, 0);'
-            f'ctx.arc(0, 0, 0.5, {start}, {stop});'
-            f'ctx.fill();'
-            f'ctx.beginPath();'
-            f'ctx.arc(0, 0, 0.5, {start}, {stop});'
-            f'ctx.restore();'
-            f'ctx.stroke();'
-        )
-
-    def _loadImage(self, id_, base64_str):
-        return (
-            '{'
-            'let image = new Image();'
-            f'pura.imagesById[{id_}]=image;'
-            f'image.src = "data:image/png;base64,{base64_str}";'
-            '}'
-        )
-
-    @queue_eval_optional
-    def _loadImageAllPeers(self, id_, base64_str):
-        return self._loadImage(id_, base64_str)
-
-    # TODO: take bytes
-    def loadImage(self, base64_str):
+            return Op.CIRCLE, x, y, w/2, start, stop
+        return Op.ARC, x, y, w, h, start, stop
+
+    @queue_resource_command
+    def _loadImageAllPeers(self, image):
+        return Op.LOAD_IMAGE, image._id, image._key
+
+    def loadImage(self, data):
         """Returns image reference
 
+        data is an encoded image (PNG, JPEG, etc.) as bytes, or base64 string.
+        It's kept in the server's image store (see _image_store.py), from
+        which clients fetch it.
+
         May be called outside of the draw() context.
         """
-        image = Image(base64_str)
-        self._images.append(image)
-        self._loadImageAllPeers(id(image), base64_str)
+        if isinstance(data, str):
+            data = b64decode(data)
+        image = Image(image_store.add(data))
+        self._images[image._id] = image
+        self._loadImageAllPeers(image)
         return image
 
-    @queue_eval_optional
+    @queue_release_command
     def unloadImage(self, image):
         """Unloads image
 
         May be called outside of the draw() context.
         """
-        self._images.remove(image)
-        return f'delete pura.imagesById[{id(image)}];'
+        del self._images[image._id]
+        image_store.release(image._key)
+        return Op.UNLOAD_IMAGE, image._id
+
+    def createShape(self):
+        """Returns shape to be recorded, and then drawn with shape()
+
+        May be called outside of the draw() context.
+        """
+        return Shape(self)
+
+    def _loadShape(self, shape):
+        self._shapes.append(shape)
+        self._loadShapeAllPeers(shape)
+
+    @queue_resource_command
+    def _loadShapeAllPeers(self, shape):
+        return Op.LOAD_SHAPE, shape._id, shape._closed, shape._points
+
+    @queue_release_command
+    def unloadShape(self, shape):
+        """Unloads shape
+
+        May be called outside of the draw() context.
+        """
+        self._shapes.remove(shape)
+        return Op.UNLOAD_SHAPE, shape._id
+
+    @queue_command
+    def shape(self, shape, x=0, y=0):
+        """Draw shape returned from createShape() at the given position"""
+        assert shape._points is not None, 'shape not recorded'
+        return Op.SHAPE, shape._id, x, y
+
+    @queue_command
+    def _image(self, image_or_base64_str, x, y, w, h):
+        assert w is None and h is None or (w is not None and h is not None)
+        if isinstance(image_or_base64_str, Image):
+            if w is None:
+                return Op.IMAGE, image_or_base64_str._id, x, y
+            return Op.IMAGE_SIZED, image_or_base64_str._id, x, y, w, h
+        if w is None:
+            return Op.IMAGE_INLINE, image_or_base64_str, x, y
+        return Op.IMAGE_INLINE_SIZED, image_or_base64_str, x, y, w, h
 
-    @queue_eval
     def image(self, image_or_base64_str, x, y, w=None, h=None):
         """
         image_or_base64_str is either image reference returned from
         loadImage(), or base64 of binary to be used immediately.
         """
-        # pylint: disable=line-too-long
-        assert w is None and h is None or (w is not None and h is not None)
-        size_args = '' if w is None else f', {w}, {h}'
-        if isinstance(image_or_base64_str, Image):
-            image = image_or_base64_str
-            return (
-                '{'
-                f'let image = pura.imagesById[{id(image)}];'
-                f'if (image.complete) ctx.drawImage(image,{x},{y}{size_args});'
-                'else {pura.isImageLoadPending = true; image.addEventListener("load", function(){'
-                f' ctx.drawImage(image,{x},{y}{size_args});'
-                '  pura.isImageLoadPending = false;'
-                '  pura.resumeCommands();'
-                '});}'                '}'
-            )
-        base64_str = image_or_base64_str
-        return (
-            '{'
-            'let image = new Image();'
-            'pura.isImageLoadPending = true;'
-            'image.onload = function(){'
-            f' ctx.drawImage(image,{x},{y}{size_args});'
-            '  pura.isImageLoadPending = false;'
-            '  pura.resumeCommands();'
-            '};'
-            f'image.src = "data:image/png;base64,{base64_str}";'
-            '}'
-        )
-
-    @queue_eval
+        self._image(image_or_base64_str, x, y, w, h)
+        # Since the client must queue commands while an image load is pending,
+        # and since commands are batched from our side, it's necessary to force
+        # a batch boundary after an image draw.
+        # TODO: Use a different approach like command grouping so that the client
+        #  understands boundaries regardless of batching.
+        self._batchBoundaries.append(len(self._sendQueue))
+
+    @queue_command
+    def _imageArray(self, array_image):
+        self._arrayImages.append((len(self._sendQueue), array_image))
+        return array_image  # (placeholder until the frame is sent)
+
+    def imageArray(self, array, x, y, w=None, h=None, *, colormap='gray', vmin=None, vmax=None,
+                   format='auto', quality=80):  # pylint: disable=redefined-builtin
+        """Draw NumPy array as an image, e.g. a camera frame or depth map
+
+        array is either uint8 of shape (h, w, 3) or (h, w, 4) (RGB or RGBA),
+        or scalar of shape (h, w), which is mapped through the colormap.
+        Requires NumPy, and Pillow for some formats (pip install pura[array]).
+
+        The array is copied, and encoded in a worker thread when the frame is
+        sent--or not at all if every client skips the frame.
+
+        :param colormap: (scalar array) 'gray', 'viridis', 'inferno', or a
+          lookup table of shape (n, 3) or (n, 4) uint8
+        :param vmin, vmax: (scalar array) values mapped to the ends of the
+          colormap, defaulting to the range of the array.  NaN values are
+          transparent.
+        :param format: 'png', 'jpeg', 'webp', 'raw' (RGBA), or 'auto', which
+          is raw for small arrays and PNG otherwise.  JPEG and WebP require
+          Pillow.
+        :param quality: (JPEG and WebP) quality, 0-100
+        """
+        from ._image_array import ArrayImage  # pylint: disable=import-outside-toplevel
+        self._imageArray(ArrayImage(array, x, y, w, h, colormap=colormap, vmin=vmin, vmax=vmax,
+                                    format_=format, quality=quality))
+        # (see image())
+        self._batchBoundaries.append(len(self._sendQueue))
+
+    @queue_command
     def text(self, t, x, y):
         if isinstance(t, str):
             pass
@@ -606,42 +1271,44 @@ class DrawContext:
             t = str(t)
         else:
             raise TypeError('expected string or number')
-        # string repr() should be fine as JavaScript, and is 2x faster than json.dumps()
-        return f"ctx.fillText({repr(t)}, {x}, {y});"
+        return Op.TEXT, t, x, y
 
-    @queue_eval
+    @queue_state_command
     def textSize(self, v):
-        # e.g. "12px Arial"
-        return f"ctx.font = '{v}px ' + ctx.font.split(' ')[1];"
+        return Op.TEXT_SIZE, v
 
     # TODO: size parameter
-    @queue_eval
+    @queue_state_command
     def textFont(self, v):
-        return f"ctx.font = ctx.font.split(' ')[0] + ' {v}';"
+        return Op.TEXT_FONT, v
 
-    @queue_eval
+    @queue_state_command
     def textAlign(self, align_x: TextAlign, align_y=TextAlign.BASELINE):
         h, v = align_x.value[0], align_y.value[1]
         if not (h and v):
             raise ValueError('incorrect alignment values')
-        return f"ctx.textAlign = '{h}'; ctx.textBaseline = '{v}';"
+        return Op.TEXT_ALIGN, h, v
 
-    @queue_eval
+    @queue_state_command
     def smooth(self):
-        return 'ctx.imageSmoothingEnabled = true;'
+        return Op.IMAGE_SMOOTHING, True
 
-    @queue_eval
+    @queue_state_command
     def noSmooth(self):
         # unfortunately there is no way to turn off primitive antialiasing...
-        return 'ctx.imageSmoothingEnabled = false;'
+        return Op.IMAGE_SMOOTHING, False
 
-    @queue_eval
+    @queue_command
     def _pushContext(self):
-        return 'ctx.save();'
+        if self._elide:
+            self._canvasStateStack.append(self._canvasState.copy())
+        return (Op.SAVE,)
 
-    @queue_eval
+    @queue_command
     def _popContext(self):
-        return 'ctx.restore();'
+        if self._elide:
+            self._canvasState = self._canvasStateStack.pop()
+        return (Op.RESTORE,)
 
     @contextmanager
     def pushContext(self):
@@ -649,12 +1316,75 @@ class DrawContext:
         yield None
         self._popContext()
 
+    @queue_command
+    def _layer(self, layer_id):
+        return Op.LAYER, layer_id
+
+    @contextmanager
+    def layer(self, name, key=None):
+        """Draw a layer cached by the client, yielding whether it must be drawn
+
+        Usage:
+
+            with ctx.layer('static', key=version) as changed:
+                if changed:
+                    ...  # draw the layer
+
+        The client draws each layer into an offscreen canvas, only when its
+        key changes (or on connecting), and composites the canvas in place
+        each frame.  So while the key is unchanged, there's no need to draw
+        the layer, and nothing of it is sent.  (Anything drawn regardless is
+        dropped.)  A key of None redraws the layer every frame.
+
+        Layers start from a transparent canvas with the default canvas state,
+        and are composited with the current transform.  They can't be nested.
+        """
+        assert self._is_draw_context, 'WebView API used outside of draw() context'
+        assert not self._inLayer, 'layers cannot be nested'
+        layer = self._layers.get(name)
+        changed = layer is None or key is None or layer[1] != key
+        layer_id = next(_resource_ids) if layer is None else layer[0]
+        # (record the layer's commands in place of the frame's)
+        frame_state = (self._sendQueue, self._batchBoundaries, self._arrayImages,
+                       self._canvasState, self._canvasStateStack)
+        self._sendQueue = [cmd for cmd in self._defaultsCommands() if cmd[0] is not Op.BACKGROUND]
+        self._batchBoundaries, self._arrayImages = [], []
+        self._canvasState, self._canvasStateStack = self._initialCanvasState(), []
+        self._inLayer = True
+        try:
+            yield changed
+            commands, array_images = self._sendQueue, self._arrayImages
+        finally:
+            self._inLayer = False
+            (self._sendQueue, self._batchBoundaries, self._arrayImages,
+             self._canvasState, self._canvasStateStack) = frame_state
+        if changed:
+            # (encoded right away, since the layer isn't part of the frame)
+            for i, array_image in array_images:
+                commands[i] = array_image.encode()
+            if self._precision is not None:
+                commands = quantize(commands, self._precision)
+            load = (Op.LOAD_LAYER, layer_id, commands)
+            self._layers[name] = layer_id, key, load
+            self._resourceQueue.append(load)
+        self._layer(layer_id)
+
+    @queue_release_command
+    def _unloadLayer(self, layer_id):
+        return Op.UNLOAD_LAYER, layer_id
+
+    def unloadLayer(self, name):
+        """Unloads layer of the given name, freeing client memory"""
+        layer_id, _, _ = self._layers.pop(name)
+        self._unloadLayer(layer_id)
+
 
 class WebViewMixin:
     """Remote visualization mixin
 
       * the host class inherits a single attribute, `webview`, and
-        must implement draw().
+        must implement draw().  draw() may be a coroutine function, e.g. to
+        query a device, and is then awaited under a timeout.
       * by default, the webview name is derived from the host class name
       * constructor kwargs that begin with 'webview_' are passed to the
         WebView constructor after removing the prefix
@@ -670,6 +1400,20 @@ class WebViewMixin:
         :param webview_size: sequence of width, height
         :param webview_frame_rate: optional rate of draw calls when the
           view is active (default 5)
+        :param webview_diff: optionally send only changes relative to the
+          previous frame (default False)
+        :param webview_elide: drop commands which wouldn't change the canvas
+          state (default True)
+        :param webview_precision: optional number of decimal digits to round
+          coordinates, etc. to (default full precision)
+        :param webview_threaded: optionally encode frames in a worker thread
+          (default False)
+        :param webview_draw_timeout: optional timeout of a coroutine draw()
+          (default frame period)
+        :param webview_priority: optional priority for keeping the frame rate
+          when the server's render budget is exceeded (default 0)
+        :param webview_input_queue_size: optional maximum of client messages
+          held for the next frame (default 256)
         """
         webview_kwargs = {k[len('webview_'):]: v for k, v in kwargs.items()
                           if k.startswith('webview_')}
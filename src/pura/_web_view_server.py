@@ -7,7 +7,14 @@ import hypercorn
 import quart
 import sniffio
 
-from pura import WebRepl
+from ._dashboard import OverheadView
+from ._image_store import image_store, mime_type
+from ._loop_view import LoopView
+from ._metrics import format_metrics
+from ._mux import Multiplexer, MUX_PATH
+from ._peer import Peer
+from ._repl import WebRepl
+from ._scheduler import FrameScheduler
 
 _logger = logging.getLogger(__name__)
 
@@ -15,8 +22,33 @@ _logger = logging.getLogger(__name__)
 class WebViewServer:
     """Server for web views"""
 
-    def __init__(self):
-        self._peers: List[quart.Websocket] = []
+    def __init__(self, *, compression_level=None, compression_min_size=256, max_queued_frames=2,
+                 coalesce=.004, load_budget=None, lag_threshold=None):
+        """
+        :param compression_level: optional zlib level (1-9) for compressing
+          webview messages.  Each client connection has its own compression
+          stream, which persists across frames.  Note that the websocket
+          transport may already apply permessage-deflate (which has no
+          controls), in which case this mainly trades CPU for ratio.
+        :param compression_min_size: messages smaller than this are sent
+          uncompressed
+        :param max_queued_frames: frames queued to a client beyond which it
+          will skip frames, until it catches up
+        :param coalesce: frame deadlines of views within this many seconds of
+          each other are served by a single wakeup (see FrameScheduler)
+        :param load_budget: optional fraction of event loop time which views
+          may use (e.g. .05), beyond which frame rates of views are reduced,
+          lowest webview_priority first
+        :param lag_threshold: optional event loop lag (seconds) beyond which
+          frame rates of views are reduced, as for load_budget
+        """
+        self._peer_options = {'compression_level': compression_level,
+                              'compression_min_size': compression_min_size,
+                              'max_queued_frames': max_queued_frames}
+        self._peers: List[Peer] = []
+        # frame clock of views served by this server, running with serve()
+        self.scheduler = FrameScheduler(coalesce=coalesce, load_budget=load_budget,
+                                        lag_threshold=lag_threshold)
         self.webviews = []  # (name, ctx)
         self.remote_webview_servers = []  # url
         # TODO: make a WebsocketHandler mixin, fix naming convention of _handleConnected(), etc.
@@ -34,6 +66,20 @@ class WebViewServer:
         async def _repl():
             return await quart.render_template('repl.html', title=title)
 
+        @blueprint.route('/metrics')
+        async def _metrics():
+            return format_metrics(self), {'Content-Type': 'text/plain; version=0.0.4'}
+
+        @blueprint.route('/img/<key>')
+        async def _img(key):
+            # (content-addressed, so never changes)
+            data = image_store.get(key)
+            if data is None:
+                return 'image not found', 404
+            return data, {'Content-Type': mime_type(data),
+                          'Cache-Control': 'public, max-age=31536000, immutable',
+                          'ETag': f'"{key}"'}
+
         @blueprint.route('/js/<path:path>')
         async def _js(path):
             return await blueprint.send_static_file(f'js/{path}')
@@ -43,6 +89,10 @@ class WebViewServer:
             websocket: quart.Websocket = quart.websocket._get_current_object()
 
             # print(path, 'connected')
+            if path == MUX_PATH:
+                await websocket.accept()
+                await Multiplexer(websocket, self.handlers_by_path, self._peer_options).run()
+                return
             handler = self.handlers_by_path.get(path)
             if handler is None:
                 full_path = websocket.full_path
@@ -53,22 +103,36 @@ class WebViewServer:
                 return
             # TODO: handle closed connection silently?  But quart-trio gives us no way to
             #   discern, see https://gitlab.com/pgjones/quart-trio/-/issues/19#note_496172565.
-            await handler._handleConnected(websocket)
-
-            try:
-                while True:
-                    message = await websocket.receive()
-                    # print(path, 'received', message)
-                    await handler._handleMessage(websocket, message)
-            finally:
-                # print(path, 'closed')
-                handler._handleClose(websocket)
+            peer = Peer.from_websocket(websocket, **self._peer_options)
+            await websocket.accept()
+            async with anyio.create_task_group() as tg:
+                # each peer has its own sender task, so that slow clients
+                # don't hold up others
+                tg.start_soon(peer.run_sender)
+                await handler._handleConnected(peer)
+                try:
+                    while True:
+                        message = await websocket.receive()
+                        # print(path, 'received', message)
+                        if isinstance(message, bytes):
+                            peer.handle_control(message)
+                        else:
+                            await handler._handleMessage(peer, message)
+                finally:
+                    # print(path, 'closed')
+                    handler._handleClose(peer)
+                    tg.cancel_scope.cancel()
 
         return blueprint
 
-    async def serve(self, title, host, port, *,
+    async def serve(self, title, host, port, *, shutdown_trigger=None,
                     task_status=anyio.TASK_STATUS_IGNORED):
-        """Web view server task."""
+        """Web view server task.
+
+        :param shutdown_trigger: optional async function, on return of which
+          the server is shut down gracefully, and this returns.  Otherwise
+          the server runs until cancelled.
+        """
 
         # (quart and hypercorn should have a common API for asyncio and trio...)
         async_lib = sniffio.current_async_library()
@@ -77,24 +141,36 @@ class WebViewServer:
             web_app = QuartTrio('pura')
             web_app.register_blueprint(self.get_blueprint(title))
             async with anyio.create_task_group() as tg:
-                urls = await tg.start(hypercorn.trio.serve, web_app,
-                                      hypercorn.Config.from_mapping(
-                                          bind=[f'{host}:{port}'],
-                                          loglevel='WARNING',
-                                      ))
+                tg.start_soon(self.scheduler.run)
+
+                async def serve_app(*, task_status):
+                    await hypercorn.trio.serve(web_app,
+                                               hypercorn.Config.from_mapping(
+                                                   bind=[f'{host}:{port}'],
+                                                   loglevel='WARNING',
+                                               ),
+                                               shutdown_trigger=shutdown_trigger,
+                                               task_status=task_status)
+                    tg.cancel_scope.cancel()  # (scheduler)
+                urls = await tg.start(serve_app)
                 _logger.info(f'listening on {urls[0]}')
                 task_status.started()
         elif async_lib == 'asyncio':
             web_app = quart.Quart('pura')
             web_app.register_blueprint(self.get_blueprint(title))
-            task_status.started()
-            await hypercorn.asyncio.serve(web_app,
-                                          hypercorn.Config.from_mapping(
-                                              bind=[f'{host}:{port}'],
-                                              loglevel='INFO',
-                                              graceful_timeout=.2,
-                                          ))
-            raise CancelledError
+            async with anyio.create_task_group() as tg:
+                tg.start_soon(self.scheduler.run)
+                task_status.started()
+                await hypercorn.asyncio.serve(web_app,
+                                              hypercorn.Config.from_mapping(
+                                                  bind=[f'{host}:{port}'],
+                                                  loglevel='INFO',
+                                                  graceful_timeout=.2,
+                                              ),
+                                              shutdown_trigger=shutdown_trigger)
+                if shutdown_trigger is None:
+                    raise CancelledError
+                tg.cancel_scope.cancel()  # (scheduler)
         else:
             raise RuntimeError('unsupported async library:', async_lib)
 
@@ -119,6 +195,23 @@ class WebViewServer:
         repl.link_url = '/repl'
         await self.add_webview('repl', repl)
 
+    async def serve_overhead_view(self, **kwargs):
+        """Serve a dashboard view of the cost of this server's views
+
+        :param kwargs: WebViewMixin options (see OverheadView)
+        """
+        await OverheadView(self, **kwargs).webview.serve(self)
+
+    async def serve_loop_view(self, **kwargs):
+        """Serve a view of event loop health and tasks, sampled while viewed
+
+        :param kwargs: LoopView options
+        """
+        view = LoopView(**kwargs)
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(view.run_sampler)
+            await view.webview.serve(self)
+
     @staticmethod
     def _add_remote_message(url):
         return f'pura.webview_server_subscribe({repr(url)});'
@@ -132,12 +225,25 @@ class WebViewServer:
         self.remote_webview_servers.append(url)
         await self._sendAllPeers(self._add_remote_message(url))
 
+    async def relay_remote(self, url, **kwargs):
+        """Offer the views of a remote webview server on this server
+
+        Unlike add_remote(), clients then need no connection to the remote
+        server, and it's sent each view once, however many clients are
+        viewing it.  See pura.relay.
+
+        :param url: remote server URL, e.g. http://host:8080
+        :param kwargs: Relay options
+        """
+        from ._relay import Relay  # pylint: disable=import-outside-toplevel
+        await Relay(url, server=self, **kwargs).run()
+
     # TODO: shared with WebView-- move these methods to a base class
     async def _sendAllPeers(self, msg):
         for peer in self._peers:
             await peer.send(msg)
 
-    async def _handleConnected(self, peer: quart.Websocket):
+    async def _handleConnected(self, peer: Peer):
         # TODO: reload client on version mismatch of HTML/JS resources
         self._peers.append(peer)
         for name, ctx in self.webviews:
@@ -146,10 +252,10 @@ class WebViewServer:
         for url in self.remote_webview_servers:
             await peer.send(self._add_remote_message(url))
 
-    def _handleClose(self, peer: quart.Websocket):
+    def _handleClose(self, peer: Peer):
         self._peers.remove(peer)
 
-    async def _handleMessage(self, peer: quart.Websocket, msg):
+    async def _handleMessage(self, peer: Peer, msg):
         """Process incoming JSON message from client."""
         #msg_type = msg['type']
         #logger.warning(f"unhandled message type: {msg['type']}")
@@ -0,0 +1,118 @@
+from collections import deque
+
+import anyio
+from wsproto import ConnectionType, WSConnection
+from wsproto.connection import ConnectionState
+from wsproto.events import (AcceptConnection, BytesMessage, CloseConnection, Message, Ping,
+                            RejectConnection, RejectData, Request, TextMessage)
+
+
+class WebsocketClient:
+    """Minimal websocket client, for consuming views of a WebViewServer
+
+    Complete messages (str or bytes) are received via receive() or async
+    iteration.  Pings are answered while receiving.  send() may be called
+    concurrently with receiving, and from multiple tasks.
+    """
+
+    def __init__(self, stream, ws):
+        self._stream = stream
+        self._ws = ws
+        self._sendLock = anyio.Lock()
+        self._messages = deque()
+        self._parts = []  # of fragmented message
+        self._accepted = False
+        self._closed = False
+
+    @classmethod
+    async def connect(cls, host, port, target, *, tls=False):
+        """Return client connected to the given websocket path and query
+
+        :param tls: if True, connect over TLS (i.e. wss://)
+        :raises ConnectionError: if the server rejected the connection
+        """
+        stream = await anyio.connect_tcp(host, port, tls=tls)
+        try:
+            ws = WSConnection(ConnectionType.CLIENT)
+            await stream.send(ws.send(Request(host=f'{host}:{port}', target=target)))
+            client = cls(stream, ws)
+            while not client._accepted:
+                await client._receiveData()
+        except BaseException:
+            await stream.aclose()
+            raise
+        return client
+
+    async def _sendData(self, data):
+        async with self._sendLock:
+            await self._stream.send(data)
+
+    async def _receiveData(self):
+        if self._closed:
+            raise anyio.EndOfStream
+        try:
+            data = await self._stream.receive()
+        except (anyio.EndOfStream, anyio.BrokenResourceError):
+            self._closed = True
+            raise anyio.EndOfStream from None
+        ws = self._ws
+        ws.receive_data(data)
+        for event in ws.events():
+            if isinstance(event, AcceptConnection):
+                self._accepted = True
+            elif isinstance(event, (RejectConnection, RejectData)):
+                raise ConnectionError('websocket connection rejected')
+            elif isinstance(event, Ping):
+                await self._sendData(ws.send(event.response()))
+            elif isinstance(event, CloseConnection):
+                self._closed = True
+                if ws.state is ConnectionState.REMOTE_CLOSING:
+                    await self._sendData(ws.send(event.response()))
+            elif isinstance(event, Message):
+                self._parts.append(event.data)
+                if event.message_finished:
+                    parts = self._parts
+                    self._messages.append(parts[0] if len(parts) == 1 else
+                                          (b'' if isinstance(event, BytesMessage) else '')
+                                          .join(parts))
+                    parts.clear()
+
+    async def receive(self):
+        """Return the next message
+
+        :raises anyio.EndOfStream: if the connection was closed
+        """
+        while not self._messages:
+            await self._receiveData()
+        return self._messages.popleft()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.receive()
+        except anyio.EndOfStream:
+            raise StopAsyncIteration from None
+
+    async def send(self, msg):
+        """Send message (str or bytes)"""
+        event = TextMessage(data=msg) if isinstance(msg, str) else BytesMessage(data=msg)
+        await self._sendData(self._ws.send(event))
+
+    async def aclose(self):
+        """Close the connection, without waiting for the server's response"""
+        with anyio.CancelScope(shield=True):
+            try:
+                if self._ws.state is ConnectionState.OPEN:
+                    await self._sendData(self._ws.send(CloseConnection(code=1000)))
+            except (anyio.BrokenResourceError, anyio.ClosedResourceError, OSError):
+                pass
+            finally:
+                await self._stream.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
@@ -0,0 +1,213 @@
+"""pura microbenchmarks
+
+Usage: python -m pura.bench [--json results.json] [--quick] [-k PATTERN]
+
+Benchmarks:
+
+  * primitive.*: command generation of DrawContext primitives, per call
+  * view.*: one draw loop iteration (draw, encode) of each view of the web
+    view example, per protocol, via WebView.render_frame()
+  * input.*: parsing of client input messages
+  * repl.*: REPL command and autocomplete round trips
+
+They're also run (in quick mode) by the test suite.  Compare JSON results
+between releases to catch performance regressions.
+"""
+
+import argparse
+import fnmatch
+import importlib.util
+import inspect
+import json
+import math
+import pathlib
+import platform
+import sys
+import timeit
+
+import anyio
+
+from ._repl import WebRepl
+from ._version import __version__
+from ._web_view import Color, DrawContext, WebViewMixin
+
+_EXAMPLE_PATH = pathlib.Path(__file__).parents[2] / 'examples' / 'web_view_example.py'
+_PRIMITIVE_CALLS = 100  # per frame
+
+
+def _push_context(ctx, _):
+    with ctx.pushContext():
+        pass
+
+
+_PRIMITIVES = {
+    'line': lambda ctx, i: ctx.line(i, 2.5, 3, 4),
+    'rect': lambda ctx, i: ctx.rect(i, 2.5, 3, 4),
+    'ellipse': lambda ctx, i: ctx.ellipse(i, 2.5, 3, 4),
+    'text': lambda ctx, i: ctx.text('hello', i, 2.5),
+    'fill': lambda ctx, i: ctx.fill(i % 256, 0, 0),
+    'fill_color': lambda ctx, i: ctx.fill(Color(i % 256)),
+    'translate': lambda ctx, i: ctx.translate(i, 2.5),
+    'push_context': _push_context,
+    'lines_100': lambda ctx, i: ctx.lines([float(i)] * 400),
+    'circles_100': lambda ctx, i: ctx.circles([float(i)] * 200, 4),
+}
+
+_INPUT_MESSAGES = {
+    'mousemove': '{"type": "mousemove", "x": 10, "y": 20, "button": 0}',
+    'mousedown': '{"type": "mousedown", "x": 10, "y": 20, "button": 0}',
+    'keydown': '{"type": "keydown", "key_code": "a", "alt_key": false, "ctrl_key": false, '
+               '"meta_key": false, "shift_key": true}',
+}
+
+_REPL_MESSAGES = {
+    'command': '{"type": "command", "text": "x + 1"}',
+    'autocomplete': '{"type": "autocomplete", "text": "x.bi"}',
+}
+
+
+def _time(fn, quick):
+    """Return seconds per call of fn (best of 3 repeats of at least 0.2 s)"""
+    timer = timeit.Timer(fn)
+    if quick:
+        return timer.timeit(3) / 3
+    number, _ = timer.autorange()
+    return min(timer.repeat(3, number)) / number
+
+
+# Benchmark generators yield (name, setup), where setup() returns
+# (fn, ops per call, extra), and extra() returns a dict of measurements
+# taken once fn has been timed.
+
+def _no_extra():
+    return {}
+
+
+def _primitive_benchmarks():
+    for name, primitive in _PRIMITIVES.items():
+        def setup(primitive=primitive):
+            def draw(ctx):
+                for i in range(_PRIMITIVE_CALLS):
+                    primitive(ctx, i)
+            ctx = DrawContext(size=(100, 100), frame_rate=1, draw_fn=draw)
+
+            def frame():
+                ctx._drawFrame()
+                ctx._sendQueue.clear()
+            return frame, _PRIMITIVE_CALLS, _no_extra
+        yield f'primitive.{name}', setup
+
+
+def _example_views(path):
+    spec = importlib.util.spec_from_file_location('_pura_bench_example', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return [obj for obj in vars(module).values()
+            if inspect.isclass(obj) and issubclass(obj, WebViewMixin) and
+            obj.__module__ == module.__name__]
+
+
+def _view_benchmarks():
+    if not _EXAMPLE_PATH.exists():  # (not installed with the package)
+        return
+    for cls in _example_views(_EXAMPLE_PATH):
+        for protocol in ('binary', 'js'):
+            def setup(cls=cls, protocol=protocol):
+                view = cls().webview
+                frames = []
+
+                def frame():
+                    frames.append(view.render_frame(protocol=protocol).stats)
+
+                def extra():
+                    return {
+                        'commands': sum(stats.commands for stats in frames) / len(frames),
+                        'bytes': sum(stats.bytes_sent for stats in frames) / len(frames),
+                    }
+                return frame, 1, extra
+            yield f'view.{cls.__name__}.{protocol}', setup
+
+
+def _input_benchmarks():
+    for name, msg in _INPUT_MESSAGES.items():
+        def setup(msg=msg):
+            ctx = DrawContext(size=(100, 100), frame_rate=1, draw_fn=lambda ctx: None)
+
+            def parse():
+                ctx._handleDeferredMessage(msg)
+                ctx.inputEvents.clear()
+            return parse, 1, _no_extra
+        yield f'input.{name}', setup
+
+
+class _ReplPeer:
+    async def send(self, msg):
+        pass
+
+
+def _repl_benchmarks():
+    for name, msg in _REPL_MESSAGES.items():
+        def setup(msg=msg):
+            repl = WebRepl({'x': 1})
+            peer = _ReplPeer()
+
+            def round_trip():
+                coro = repl._handleMessage(peer, msg)
+                try:
+                    coro.send(None)  # (completes without suspending)
+                except StopIteration:
+                    pass
+            return round_trip, 1, _no_extra
+        yield f'repl.{name}', setup
+
+
+_BENCHMARKS = (_primitive_benchmarks, _view_benchmarks, _input_benchmarks, _repl_benchmarks)
+
+
+def run(pattern='*', *, quick=False):
+    """Return list of benchmark results matching the name pattern
+
+    Each result is a dict of name, seconds (per operation), and optional
+    extra measurements.  Must be called from an event loop, since views are
+    created.
+    """
+    results = []
+    for benchmarks in _BENCHMARKS:
+        for name, setup in benchmarks():
+            if fnmatch.fnmatch(name, pattern):
+                fn, ops, extra = setup()
+                results.append({'name': name, 'seconds': _time(fn, quick) / ops, **extra()})
+    return results
+
+
+def _format(result):
+    seconds = result['seconds']
+    exponent = min(max(math.floor(math.log10(seconds) / 3) * 3, -9), 0) if seconds else 0
+    unit = {0: 's', -3: 'ms', -6: 'µs', -9: 'ns'}[exponent]
+    extra = ''.join(f'  {k}={v:g}' for k, v in result.items() if k not in ('name', 'seconds'))
+    return f'{result["name"]:40} {seconds / 10 ** exponent:8.2f} {unit}{extra}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pura.bench',
+                                     description='pura microbenchmarks')
+    parser.add_argument('-k', dest='pattern', default='*',
+                        help='run benchmarks with names matching glob pattern')
+    parser.add_argument('--quick', action='store_true', help='few iterations (smoke test)')
+    parser.add_argument('--json', help='write results to the given JSON file')
+    args = parser.parse_args(argv)
+
+    async def run_():
+        return run(args.pattern, quick=args.quick)
+
+    results = anyio.run(run_)
+    for result in results:
+        print(_format(result))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'version': __version__, 'python': platform.python_version(),
+                       'platform': platform.platform(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,356 @@
+"""pura load test, with headless websocket clients
+
+Usage:
+
+    python -m pura.loadtest [--clients 1,4,16] [--views 1,4] [--duration 5]
+                            [--no-mux] [--json results.json]
+
+A local WebViewServer serving synthetic views (LoadView) is started in a
+subprocess, and for each step of the ramp, N headless clients each subscribe
+to the main channel and to M views, consuming frames (and acknowledging them,
+as a browser does) for the given duration.  As in the browser, each client
+multiplexes its views over a single websocket (MuxClient), unless --no-mux
+is given, in which case it opens a websocket per view.  Each step reports the achieved
+frame rate per view connection, per-frame latency percentiles, bytes
+received, and the CPU use of the server and of the clients.
+
+Latency is measured from the time drawn into each frame by LoadView to
+its arrival at the client, so it covers drawing, encoding, queueing, and
+the network, but not rendering.
+
+HeadlessClient and MuxClient can also be used against any server (e.g. in
+tests), in which case latency is only available for LoadView views.
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+import zlib
+from functools import partial
+
+import anyio
+
+from ._mux import MUX_PATH
+from ._protocol import (ControlKind, decode_binary, decompress_message, MessageKind, Op,
+                        unwrap_channel_message)
+from ._web_view import DrawContext, WebViewMixin
+from ._ws_client import WebsocketClient
+
+_TIMESTAMP_PREFIX = '@'
+_JS_FRAME_PREFIXES = ('pura.keyFrame(', 'pura.diffFrame(', 'pura.repeatFrame(')
+_JS_TIMESTAMP = re.compile(r'fillText\([\'"]@([0-9.]+)')
+
+
+class LoadView(WebViewMixin):
+    """Synthetic view drawing a number of moving primitives and a timestamp"""
+
+    def __init__(self, name, *, primitives=50, **kwargs):
+        super().__init__(webview_name=name, webview_size=(320, 240), **kwargs)
+        self._primitives = primitives
+
+    def draw(self, ctx: DrawContext):
+        ctx.background(32)
+        t = time.time()
+        ctx.fill(80, 180, 255)
+        for i in range(self._primitives):
+            a = t + i * 0.3
+            ctx.rect(160 + math.cos(a) * i * 2, 120 + math.sin(a) * i * 2, 6, 6)
+        ctx.fill(255)
+        ctx.text(f'{_TIMESTAMP_PREFIX}{t:.6f}', 10, 20)
+
+
+def _frame_info(payload):
+    """Return (is frame, timestamp or None) of decoded message payload"""
+    kind, commands = payload
+    if kind is MessageKind.DIFF_FRAME:
+        commands = [command for _, _, edit in commands for command in edit]
+    elif kind is MessageKind.REPEAT_FRAME:
+        return True, None
+    is_frame = kind is not MessageKind.COMMANDS
+    timestamp = None
+    for command in commands:
+        op = command[0]
+        if op is Op.SWAP:
+            is_frame = True
+        elif op is Op.TEXT and command[1].startswith(_TIMESTAMP_PREFIX):
+            timestamp = float(command[1][1:])
+    return is_frame, timestamp
+
+
+def _client_query(protocol, diff, credits, compress):  # pylint: disable=redefined-builtin
+    query = f'protocol={protocol}&diff={int(diff)}&credits={credits}'
+    if compress:
+        query += '&compress=deflate'
+    return query
+
+
+class HeadlessClient:
+    """Websocket client consuming frames of a view, like a browser would
+
+    Frames are acknowledged on arrival (pull mode).  Optionally, random mouse
+    and keyboard input is sent at input_rate messages per second.
+    """
+
+    def __init__(self, host, port, path, *, protocol='binary', diff=True,
+                 credits=2, compress=False, input_rate=0):  # pylint: disable=redefined-builtin
+        self.host, self.port = host, port
+        self.path = path
+        query = _client_query(protocol, diff, credits, compress)
+        self.target = f'/{urllib.parse.quote(path)}?{query}'
+        self._inputRate = input_rate
+        self._decompressor = None
+        self.messages = 0
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []  # seconds
+
+    def _handleMessage(self, data, t, size=None):
+        """Return True if message completes a frame
+
+        :param size: size of the message as received, if not len(data)
+        """
+        self.messages += 1
+        self.bytes += len(data) if size is None else size
+        if isinstance(data, (bytes, bytearray)) and data and data[0] == MessageKind.COMPRESSED:
+            if self._decompressor is None:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = decompress_message(self._decompressor, data)
+        if isinstance(data, str):
+            is_frame = 'pura.swap()' in data or data.startswith(_JS_FRAME_PREFIXES)
+            match = _JS_TIMESTAMP.search(data)
+            timestamp = float(match.group(1)) if match else None
+        else:
+            is_frame, timestamp = _frame_info(decode_binary(data))
+        if is_frame:
+            self.frames += 1
+            if timestamp is not None:
+                self.latencies.append(t - timestamp)
+        return is_frame
+
+    async def _sendInput(self, send):
+        rng = random.Random()
+        while True:
+            await anyio.sleep(1 / self._inputRate)
+            msg_type = rng.choice(('mousemove', 'mousemove', 'mousemove', 'mousedown',
+                                   'mouseup', 'keydown', 'keyup'))
+            msg = {'type': msg_type, 'x': rng.randrange(320), 'y': rng.randrange(240),
+                   'button': 0, 'alt_key': False, 'ctrl_key': False, 'meta_key': False,
+                   'shift_key': False, 'key_code': rng.choice('abc')}
+            await send(json.dumps(msg))
+
+    async def run(self, duration):
+        """Connect and consume messages for the given duration (seconds)"""
+        async with await WebsocketClient.connect(self.host, self.port, self.target) as client, \
+                anyio.create_task_group() as tg:
+            if self._inputRate:
+                tg.start_soon(self._sendInput, client.send)
+            with anyio.move_on_after(duration):
+                async for data in client:
+                    if self._handleMessage(data, time.time()):
+                        await client.send(bytes([ControlKind.ACK, 1]))
+            tg.cancel_scope.cancel()
+
+
+class MuxClient:
+    """Client subscribing to views over one multiplexed websocket, as the browser does
+
+    Each path is subscribed to as a channel, whose messages are consumed by
+    a HeadlessClient (holding the channel's statistics) in channels.  Options
+    are those of HeadlessClient.
+    """
+
+    def __init__(self, host, port, paths, *, protocol='binary', diff=True,
+                 credits=2, compress=False, input_rate=0):  # pylint: disable=redefined-builtin
+        self.host, self.port = host, port
+        self.target = f'/{MUX_PATH}?{_client_query(protocol, diff, credits, compress)}'
+        # by channel id  (input is only sent to views)
+        self.channels = [HeadlessClient(host, port, path,
+                                        input_rate=0 if path == '_main' else input_rate)
+                         for path in paths]
+
+    @staticmethod
+    def _channelSender(client, channel_id):
+        """Return function sending text messages of the given channel"""
+        async def send(msg):
+            await client.send(f'{channel_id} {msg}')
+        return send
+
+    async def run(self, duration):
+        """Connect and consume messages for the given duration (seconds)"""
+        async with await WebsocketClient.connect(self.host, self.port, self.target) as client, \
+                anyio.create_task_group() as tg:
+            for channel_id, channel in enumerate(self.channels):
+                await client.send(json.dumps({'type': 'subscribe', 'channel': channel_id,
+                                              'path': channel.path}))
+                if channel._inputRate:
+                    tg.start_soon(channel._sendInput, self._channelSender(client, channel_id))
+            with anyio.move_on_after(duration):
+                async for data in client:
+                    channel_id, msg = unwrap_channel_message(data)
+                    if self.channels[channel_id]._handleMessage(msg, time.time(), len(data)):
+                        await client.send(bytes([ControlKind.ACK, 1,
+                                                 channel_id & 0xff, channel_id >> 8]))
+            tg.cancel_scope.cancel()
+
+
+def percentile(values, p):
+    """Return the p-th percentile (0-100) of values, by nearest rank"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def _server_cpu_seconds(host, port):
+    with urllib.request.urlopen(f'http://{host}:{port}/metrics') as response:
+        for line in response.read().decode().splitlines():
+            if line.startswith('process_cpu_seconds_total '):
+                return float(line.split()[1])
+    return None
+
+
+async def run_step(host, port, n_clients, view_names, duration, *, mux=True, **client_kwargs):
+    """Run N clients, each viewing the given views, and return step results
+
+    :param mux: if True, each client multiplexes its views over one websocket
+      (MuxClient), otherwise it opens a websocket per view
+    :param client_kwargs: see HeadlessClient
+    """
+    # (the main channel or socket of each client only receives view registrations)
+    if mux:
+        runners = [MuxClient(host, port, ['_main', *view_names], **client_kwargs)
+                   for _ in range(n_clients)]
+        clients = [channel for runner in runners for channel in runner.channels[1:]]
+    else:
+        clients = [HeadlessClient(host, port, name, **client_kwargs)
+                   for _ in range(n_clients) for name in view_names]
+        runners = [HeadlessClient(host, port, '_main') for _ in range(n_clients)] + clients
+    server_cpu = await anyio.to_thread.run_sync(_server_cpu_seconds, host, port)
+    client_cpu = time.process_time()
+    t_start = time.monotonic()
+    async with anyio.create_task_group() as tg:
+        for runner in runners:
+            tg.start_soon(runner.run, duration)
+    elapsed = time.monotonic() - t_start
+    server_cpu = await anyio.to_thread.run_sync(_server_cpu_seconds, host, port) - server_cpu
+    client_cpu = time.process_time() - client_cpu
+    fps = [client.frames / elapsed for client in clients]
+    latencies = [latency for client in clients for latency in client.latencies]
+    return {
+        'clients': n_clients,
+        'views': len(view_names),
+        'mux': mux,
+        'fps_mean': sum(fps) / len(fps),
+        'fps_min': min(fps),
+        'latency_p50': percentile(latencies, 50),
+        'latency_p90': percentile(latencies, 90),
+        'latency_p99': percentile(latencies, 99),
+        'bytes_per_sec': sum(client.bytes for client in clients) / elapsed,
+        'server_cpu': server_cpu / elapsed,
+        'client_cpu': client_cpu / elapsed,
+    }
+
+
+async def serve(host, port, n_views, *, frame_rate, primitives):
+    """Serve LoadView views (see main())"""
+    from ._web_view_server import WebViewServer  # pylint: disable=import-outside-toplevel
+    server = WebViewServer()
+    async with anyio.create_task_group() as tg:
+        await tg.start(server.serve, 'pura load test', host, port)
+        for i in range(n_views):
+            view = LoadView(f'load{i}', primitives=primitives, webview_frame_rate=frame_rate)
+            tg.start_soon(view.webview.serve, server)
+
+
+def _wait_for_server(host, port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return _server_cpu_seconds(host, port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(.1)
+
+
+def _format_step(result):
+    def ms(value):
+        return '-' if value is None else f'{value * 1000:.1f}'
+    return (f'{result["clients"]:4d} clients x {result["views"]:2d} views: '
+            f'{result["fps_mean"]:6.1f} fps (min {result["fps_min"]:5.1f})  '
+            f'latency p50/p90/p99 {ms(result["latency_p50"])}/{ms(result["latency_p90"])}/'
+            f'{ms(result["latency_p99"])} ms  {result["bytes_per_sec"] / 1000:8.1f} kB/s  '
+            f'server CPU {result["server_cpu"]:.0%}  client CPU {result["client_cpu"]:.0%}')
+
+
+def _int_list(s):
+    return [int(v) for v in s.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pura.loadtest',
+                                     description='pura load test with headless clients')
+    parser.add_argument('--clients', type=_int_list, default=[1, 4, 16],
+                        help='comma-separated ramp of concurrent clients')
+    parser.add_argument('--views', type=_int_list, default=[1, 4],
+                        help='comma-separated numbers of views per client')
+    parser.add_argument('--duration', type=float, default=5, help='seconds per step')
+    parser.add_argument('--frame-rate', type=float, default=30)
+    parser.add_argument('--primitives', type=int, default=50, help='rects drawn per frame')
+    parser.add_argument('--input-rate', type=float, default=0,
+                        help='input messages per second per client and view')
+    parser.add_argument('--protocol', choices=['binary', 'js'], default='binary')
+    parser.add_argument('--no-mux', dest='mux', action='store_false',
+                        help='open a websocket per view, rather than multiplexing the views '
+                             'of each client over one (as browsers do)')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--serve', action='store_true',
+                        help='(internal) only run the server, with max(--views) views')
+    parser.add_argument('--json', help='write results to the given JSON file')
+    args = parser.parse_args(argv)
+    max_views = max(args.views)
+
+    if args.serve:
+        try:
+            anyio.run(lambda: serve(args.host, args.port, max_views,
+                                    frame_rate=args.frame_rate, primitives=args.primitives))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    results = []
+    # (the server is waited for on exit)
+    with subprocess.Popen(
+            [sys.executable, '-m', 'pura.loadtest', '--serve', '--host', args.host,
+             '--port', str(args.port), '--views', str(max_views),
+             '--frame-rate', str(args.frame_rate), '--primitives', str(args.primitives)]) \
+            as server:
+        try:
+            _wait_for_server(args.host, args.port)
+            for n_views in args.views:
+                for n_clients in args.clients:
+                    result = anyio.run(partial(
+                        run_step, args.host, args.port, n_clients,
+                        [f'load{i}' for i in range(n_views)], args.duration, mux=args.mux,
+                        protocol=args.protocol, input_rate=args.input_rate))
+                    results.append(result)
+                    print(_format_step(result), flush=True)
+        finally:
+            server.terminate()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'frame_rate': args.frame_rate, 'primitives': args.primitives,
+                       'protocol': args.protocol, 'mux': args.mux, 'results': results},
+                      f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
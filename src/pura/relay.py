@@ -0,0 +1,57 @@
+"""pura relay, fanning out the views of a server to many viewers
+
+Usage:
+
+    python -m pura.relay UPSTREAM_URL [--host HOST] [--port PORT]
+                         [--forward-input] [--compression-level LEVEL]
+
+e.g. `python -m pura.relay http://robot.local:8080 --port 8081`, and point
+browsers at port 8081 of the relay rather than at the robot.
+
+The relay follows the views registered on the upstream WebViewServer, and
+offers them on its own server.  While a view has viewers, the relay holds a
+single upstream connection to it, and sends each frame it receives to every
+viewer as a local view would (i.e. in the protocol, diff mode, compression,
+and pacing negotiated by each).  Loaded images and shapes are retained, and
+replayed to viewers joining later.  (Images are fetched from the upstream
+image store into the relay's, from which viewers fetch them.)  So the
+upstream server's cost is that of a single viewer, however many are
+watching.
+
+Viewer input isn't forwarded upstream unless enabled.
+"""
+
+import argparse
+import logging
+import sys
+
+import anyio
+
+from ._relay import Relay
+from ._web_view_server import WebViewServer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pura.relay',
+                                     description='relay the views of a pura server to many viewers')
+    parser.add_argument('upstream', help='URL of the upstream server, e.g. http://host:8080')
+    parser.add_argument('--host', default='localhost', help='interface to serve on')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--title', default='pura relay')
+    parser.add_argument('--forward-input', action='store_true',
+                        help='send mouse and keyboard input of viewers upstream')
+    parser.add_argument('--compression-level', type=int,
+                        help='zlib level (1-9) for compressing messages to viewers')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    relay = Relay(args.upstream, server=WebViewServer(compression_level=args.compression_level),
+                  forward_input=args.forward_input)
+    try:
+        anyio.run(lambda: relay.serve(args.title, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
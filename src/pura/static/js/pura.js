@@ -12,7 +12,7 @@ let reqAnimFrame = window.requestAnimationFrame ||
 let pura = {};
 
 pura.baseTitle = document.title;
-pura.webviewSocket = null;
+pura.viewChannel = null;  // channel of the selected view (see openChannel())
 pura.webviewServers = [];
 pura.context = canvas.getContext("2d");
 pura.backCanvas = document.createElement("canvas");
@@ -27,27 +27,53 @@ pura.lastWebview = window.location.hash ? window.location.hash.slice(1) : null;
 pura.lastButtons = [];
 pura.lastAxes = [];
 pura.imagesById = {};
+pura.shapesById = {};  // Path2D
+pura.layersById = {};  // offscreen canvas
 pura.isImageLoadPending = false;
 pura.pendingCommands = [];  // to queue commands during image loading
+pura.frame = {commands: [], batches: null};  // retained frame (diff mode)
 
 // Subscribe to a webview server to receive information about added views,
 // which we then present in the selection dropdown.  See add_webview().
 //
+// A single websocket is opened to each server, over which views are
+// subscribed to as channels (see openChannel()), as is the server's "_main"
+// channel of view registrations.
+//
 // The root webview server is tied to initialization of the view dropdown
 // and the connection status display.
 //
 // TODO: fix race conditions due to retry handling
 pura.webview_server_subscribe = function(base_url, is_root) {
-    if (!is_root && pura.webviewServers.some(ws => ws.url === base_url + "_main")) {
+    if (!is_root && pura.webviewServers.some(ws => ws.baseUrl === base_url)) {
         return;
     }
 
-    if (is_root && pura.webviewSocket) {
-        pura.webviewSocket.close();
+    if (is_root && pura.viewChannel) {
+        pura.closeChannel(pura.viewChannel);
+        pura.viewChannel = null;
     }
 
     window.console.info('webview server subscribe', base_url);
-    let ws = new WebSocket(base_url + "_main");
+    // request binary draw commands, frame diffs, compression, and pull mode
+    // for all channels
+    // (servers not supporting these will send full frames of JavaScript)
+    let query = "?protocol=binary&diff=1&credits=" + pura.credits;
+    // optional bandwidth cap (bytes/sec) given in the page URL
+    let max_bps = new URLSearchParams(window.location.search).get("max_bps");
+    if (max_bps) {
+        query += "&max_bps=" + encodeURIComponent(max_bps);
+    }
+    let compress = typeof DecompressionStream !== "undefined";
+    if (compress) {
+        query += "&compress=deflate";
+    }
+    let ws = new WebSocket(base_url + "_mux" + query);
+    ws.binaryType = "arraybuffer";
+    ws.baseUrl = base_url;
+    ws.compress = compress;
+    ws.channels = {};  // by id
+    ws.nextChannelId = 0;
     let open_success = false;
 
     ws.onopen = function() {
@@ -63,15 +89,21 @@ pura.webview_server_subscribe = function(base_url, is_root) {
         }
         pura.webviewServers.push(ws);
         open_success = true;
+        pura.openChannel(ws, "_main", function(data) {
+            pura.eval(data, null, base_url);
+        });
     };
 
     ws.onmessage = function(e) {
-        pura.eval(e.data, null, base_url);
+        pura.handleMuxMessage(ws, e.data);
     };
 
     ws.onclose = function() {
         window.console.log('webview server connection closed', base_url);
-        ws = null;
+        if (pura.viewChannel && pura.viewChannel.ws === ws) {
+            pura.viewChannel = null;
+            pura.connectionStatus.className = "status dead";
+        }
         if (is_root) {
             pura.webviewServers.slice(1).forEach(child_ws => child_ws.close());
             pura.connectionStatus.className = "status dead";
@@ -85,6 +117,63 @@ pura.webview_server_subscribe = function(base_url, is_root) {
     };
 };
 
+// Subscribe to the given path (view) of the server of websocket ws, returning
+// the channel.  Messages of the channel are passed to onmessage(data), after
+// decompression.  Messages sent by the client on behalf of the channel
+// carry its id (see _protocol.py).
+pura.openChannel = function(ws, path, onmessage) {
+    let channel = {
+        id: ws.nextChannelId,
+        ws: ws,
+        onmessage: onmessage,
+        inflater: ws.compress ? pura.makeInflater() : null,
+        unackedFrames: 0
+    };
+    ws.nextChannelId = ws.nextChannelId % 0xffff + 1;
+    ws.channels[channel.id] = channel;
+    ws.send(JSON.stringify({type: "subscribe", channel: channel.id, path: path}));
+    return channel;
+};
+
+pura.isChannelOpen = function(channel) {
+    return channel.ws.readyState === WebSocket.OPEN && channel.ws.channels[channel.id] === channel;
+};
+
+pura.closeChannel = function(channel) {
+    if (pura.isChannelOpen(channel)) {
+        channel.ws.send(JSON.stringify({type: "unsubscribe", channel: channel.id}));
+    }
+    delete channel.ws.channels[channel.id];
+};
+
+// Dispatch message of a multiplexed websocket to its channel
+pura.handleMuxMessage = function(ws, data) {
+    let view = new DataView(data);
+    if (view.getUint8(0) !== pura.messageKind.CHANNEL) {
+        window.console.error("unexpected message kind", view.getUint8(0));
+        return;
+    }
+    let channel = ws.channels[view.getUint16(1, true)];
+    if (!channel) {
+        // (unsubscribed)
+        return;
+    }
+    data = view.getUint8(3) ? pura.textDecoder.decode(new Uint8Array(data, 4)) : data.slice(4);
+    let inflater = channel.inflater;
+    // (other messages must wait for any compressed message being decoded)
+    if (inflater && (inflater.pending > 0 || inflater.isCompressed(data))) {
+        inflater.decode(data).then(function(data) {
+            if (ws.channels[channel.id] === channel) {
+                channel.onmessage(data);
+            }
+        }, function(err) {
+            window.console.error("failed to decompress message", err);
+        });
+    } else {
+        channel.onmessage(data);
+    }
+};
+
 pura.input_handler = function(e) {
     if (!pura.isConnected()) {
         return;
@@ -100,7 +189,34 @@ pura.input_handler = function(e) {
         shift_key: e.shiftKey || false,
         key_code: e.key || 0
     };
-    pura.webviewSocket.send(JSON.stringify(msg));
+    if (msg.type === "mousemove") {
+        if (pura.pendingMove === null) {
+            window.requestAnimationFrame(pura.sendPendingMove);
+        }
+        pura.pendingMove = msg;
+        pura.pendingMoveChannel = pura.viewChannel;
+        return;
+    }
+    pura.sendPendingMove();
+    pura.sendChannelMessage(pura.viewChannel, msg);
+};
+
+// Send JSON message to the handler of the channel, prefixed by the channel
+// id (see _protocol.py)
+pura.sendChannelMessage = function(channel, msg) {
+    channel.ws.send(channel.id + " " + JSON.stringify(msg));
+};
+
+// Pointer moves are sent at most once per animation frame (the latest one),
+// and ahead of any other input, so the server sees events in order.
+pura.pendingMove = null;
+pura.pendingMoveChannel = null;
+pura.sendPendingMove = function() {
+    let msg = pura.pendingMove;
+    pura.pendingMove = null;
+    if (msg !== null && pura.isConnected() && pura.viewChannel === pura.pendingMoveChannel) {
+        pura.sendChannelMessage(pura.viewChannel, msg);
+    }
 };
 
 pura.swap = function() {
@@ -110,6 +226,31 @@ pura.swap = function() {
     //reqAnimFrame(function () {
         pura.context.drawImage(pura.backCanvas, 0, 0);
     //});
+    pura.requestAck();
+};
+
+// Frames are acknowledged once the browser is ready to paint, and the server
+// only sends as many unacknowledged frames as the credits we requested.  This
+// bounds latency, and a tab which isn't painting (no animation frames)
+// receives no frames.
+pura.credits = 2;
+pura.controlKind = {ACK: 0};  // (in sync with _protocol.py)
+pura.requestAck = function() {
+    let channel = pura.viewChannel;
+    if (!channel) {
+        return;
+    }
+    channel.unackedFrames += 1;
+    if (channel.unackedFrames === 1) {
+        window.requestAnimationFrame(function() {
+            if (pura.isChannelOpen(channel)) {
+                channel.ws.send(new Uint8Array([pura.controlKind.ACK,
+                                                Math.min(channel.unackedFrames, 255),
+                                                channel.id & 0xff, channel.id >> 8]));
+            }
+            channel.unackedFrames = 0;
+        });
+    }
 };
 
 pura.eval = function(s, ctx, ws_url) {
@@ -117,16 +258,610 @@ pura.eval = function(s, ctx, ws_url) {
     eval(s);
 };
 
+// Binary draw command protocol.  Message kind and op values must be kept
+// in sync with _protocol.py.
+pura.messageKind = {
+    COMMANDS: 0, KEY_FRAME: 1, DIFF_FRAME: 2, REPEAT_FRAME: 3, COMPRESSED: 4, CHANNEL: 5
+};
+pura.op = {
+    SWAP: 0, BACKGROUND: 1, STROKE_WEIGHT: 2, STROKE_CAP: 3, STROKE: 4,
+    FILL: 5, TRANSLATE: 6, ROTATE: 7, SCALE: 8, BEGIN_PATH: 9, END_SHAPE: 10,
+    MOVE_TO: 11, LINE_TO: 12, LINE: 13, RECT: 14, CIRCLE: 15, ARC: 16,
+    TEXT: 17, TEXT_SIZE: 18, TEXT_FONT: 19, FONT: 20, TEXT_ALIGN: 21,
+    IMAGE_SMOOTHING: 22, SAVE: 23, RESTORE: 24, LOAD_IMAGE: 25,
+    UNLOAD_IMAGE: 26, IMAGE: 27, IMAGE_SIZED: 28, IMAGE_INLINE: 29,
+    IMAGE_INLINE_SIZED: 30, LOAD_SHAPE: 31, UNLOAD_SHAPE: 32, SHAPE: 33,
+    VERTICES: 34, LINES: 35, POINTS: 36, POLYLINE: 37, RECTS: 38, CIRCLES: 39,
+    IMAGE_DATA: 40, LOAD_LAYER: 41, UNLOAD_LAYER: 42, LAYER: 43
+};
+// MIME types by image format, other than raw RGBA (0)
+pura.imageFormatTypes = [null, "image/png", "image/jpeg", "image/webp"];
+pura.textDecoder = new TextDecoder();
+
+// Draw image, returning true if drawing is deferred due to a pending image
+// load.  In that case the remaining commands must be queued, and they will be
+// resumed by resumeCommands() once the load completes.
+pura.drawImage = function(ctx, image, args) {
+    if (!image) {
+        // unloaded (e.g. replay of retained frame)
+        return false;
+    }
+    if (image.complete) {
+        // (zero width if the image failed to load)
+        if (image.naturalWidth) {
+            ctx.drawImage(image, ...args);
+        }
+        return false;
+    }
+    pura.isImageLoadPending = true;
+    let done = function(e) {
+        image.removeEventListener("load", done);
+        image.removeEventListener("error", done);
+        if (e.type === "load") {
+            ctx.drawImage(image, ...args);
+        } else {
+            window.console.error("failed to load image", image.src);
+        }
+        pura.isImageLoadPending = false;
+        pura.resumeCommands();
+    };
+    image.addEventListener("load", done);
+    image.addEventListener("error", done);
+    return true;
+};
+
+// Return image of the given key, fetched from the image store of the server
+// of the current view (see _image_store.py).  Images are immutable, so the
+// browser may serve them from its cache.
+pura.loadImage = function(key) {
+    let base_url = pura.viewChannel ? pura.viewChannel.ws.baseUrl : root_ws_url;
+    let url = new URL("img/" + key, new URL(base_url, window.location.href));
+    url.protocol = url.protocol.replace(/^ws/, "http");
+    let image = new Image();
+    image.src = url.href;
+    return image;
+};
+
+// Draw image data of imageArray(), returning true if drawing is deferred
+// (see drawImage()).  Raw RGBA is drawn right away, via a scratch canvas so
+// that the transform and scaling apply.
+pura.drawImageData = function(ctx, format, width, height, data, args) {
+    if (!pura.imageFormatTypes[format]) {
+        let canvas = pura.scratchCanvas;
+        canvas.width = width;
+        canvas.height = height;
+        let pixels = new Uint8ClampedArray(data.buffer, data.byteOffset, data.byteLength);
+        canvas.getContext("2d").putImageData(new ImageData(pixels, width, height), 0, 0);
+        ctx.drawImage(canvas, ...args);
+        return false;
+    }
+    let url = URL.createObjectURL(new Blob([data], {type: pura.imageFormatTypes[format]}));
+    let image = new Image();
+    let revoke = function() { URL.revokeObjectURL(url); };
+    image.addEventListener("load", revoke);
+    image.addEventListener("error", revoke);
+    image.src = url;
+    return pura.drawImage(ctx, image, args);
+};
+pura.scratchCanvas = document.createElement("canvas");
+
+// Draw the given commands into the offscreen canvas of a layer, which
+// replaces any previous content.  Commands are either JavaScript batches
+// split after image draws, or binary commands (Uint8Array).  Like frame
+// commands, they may be deferred by an image load, in which case true is
+// returned.
+pura.loadLayer = function(id, commands) {
+    let layer = pura.layersById[id];
+    if (!layer) {
+        layer = pura.layersById[id] = document.createElement("canvas");
+    }
+    // (resizing also clears the canvas and resets its state)
+    layer.width = pura.backCanvas.width;
+    layer.height = pura.backCanvas.height;
+    layer.scale = window.devicePixelRatio;
+    let ctx = layer.getContext("2d");
+    ctx.scale(layer.scale, layer.scale);
+    let batches = commands instanceof Uint8Array ?
+        [{view: new DataView(commands.buffer, commands.byteOffset, commands.byteLength),
+          offset: 0, ctx: ctx}] : commands;
+    for (let i = 0; i < batches.length; ++i) {
+        if (pura.isImageLoadPending) {
+            pura.pendingCommands.unshift(...batches.slice(i).map(
+                batch => typeof batch === "string" ? {data: batch, ctx: ctx} : batch));
+            return true;
+        }
+        pura.execMessage(batches[i], ctx);
+    }
+    return pura.isImageLoadPending;
+};
+
+pura.drawLayer = function(ctx, id) {
+    let layer = pura.layersById[id];
+    if (layer) {
+        ctx.drawImage(layer, 0, 0, layer.width / layer.scale, layer.height / layer.scale);
+    }
+};
+
+// Return Uint8Array of base64-encoded bytes
+pura.decodeBytes = function(s) {
+    return Uint8Array.from(window.atob(s), c => c.charCodeAt(0));
+};
+
+// Return Float32Array of base64-encoded little-endian float32 values
+pura.decodeFloats = function(s) {
+    return new Float32Array(Uint8Array.from(window.atob(s), c => c.charCodeAt(0)).buffer);
+};
+
+// Return array of color strings given r, g, b, a bytes, or null if empty
+pura.colorStrings = function(bytes) {
+    if (bytes.length === 0) {
+        return null;
+    }
+    let colors = new Array(bytes.length / 4);
+    for (let i = 0; i < colors.length; ++i) {
+        let j = i * 4;
+        colors[i] = "rgba(" + bytes[j] + "," + bytes[j + 1] + "," + bytes[j + 2] + "," +
+                    bytes[j + 3] / 255 + ")";
+    }
+    return colors;
+};
+
+// Return color strings of base64-encoded r, g, b, a bytes (see colorStrings())
+pura.decodeColors = function(s) {
+    return pura.colorStrings(Uint8Array.from(window.atob(s), c => c.charCodeAt(0)));
+};
+
+// Return Path2D of the given [x0, y0, x1, y1, ...] vertices
+pura.makePath = function(points, closed) {
+    let path = new Path2D();
+    if (points.length >= 2) {
+        path.moveTo(points[0], points[1]);
+    }
+    for (let i = 2; i < points.length; i += 2) {
+        path.lineTo(points[i], points[i + 1]);
+    }
+    if (closed) {
+        path.closePath();
+    }
+    return path;
+};
+
+pura.drawShape = function(ctx, path, x, y) {
+    if (!path) {
+        return;
+    }
+    ctx.save();
+    ctx.translate(x, y);
+    ctx.fill(path);
+    ctx.stroke(path);
+    ctx.restore();
+};
+
+// Batch primitives.  Each element is drawn as by the corresponding single
+// primitive.  colors is an array of per-element color strings overriding the
+// stroke (lines, points) or fill (rects, circles) style, or null.
+
+pura.vertices = function(ctx, points, move_first) {
+    let i = 0;
+    if (move_first && points.length >= 2) {
+        ctx.moveTo(points[0], points[1]);
+        i = 2;
+    }
+    for (; i < points.length; i += 2) {
+        ctx.lineTo(points[i], points[i + 1]);
+    }
+};
+
+pura.lines = function(ctx, points, colors) {
+    let style = ctx.strokeStyle;
+    for (let i = 0, j = 0; j < points.length; ++i, j += 4) {
+        if (colors) ctx.strokeStyle = colors[i];
+        ctx.beginPath();
+        ctx.moveTo(points[j], points[j + 1]);
+        ctx.lineTo(points[j + 2], points[j + 3]);
+        ctx.stroke();
+    }
+    if (colors) ctx.strokeStyle = style;
+};
+
+pura.points = function(ctx, points, colors) {
+    let style = ctx.strokeStyle;
+    for (let i = 0, j = 0; j < points.length; ++i, j += 2) {
+        if (colors) ctx.strokeStyle = colors[i];
+        ctx.beginPath();
+        ctx.moveTo(points[j], points[j + 1]);
+        ctx.lineTo(points[j], points[j + 1]);
+        ctx.stroke();
+    }
+    if (colors) ctx.strokeStyle = style;
+};
+
+pura.polyline = function(ctx, points, closed) {
+    ctx.beginPath();
+    pura.vertices(ctx, points, true);
+    if (closed) ctx.closePath();
+    ctx.stroke();
+};
+
+pura.rects = function(ctx, points, colors) {
+    let style = ctx.fillStyle;
+    for (let i = 0, j = 0; j < points.length; ++i, j += 4) {
+        if (colors) ctx.fillStyle = colors[i];
+        ctx.beginPath();
+        ctx.rect(points[j], points[j + 1], points[j + 2], points[j + 3]);
+        ctx.fill();
+        ctx.stroke();
+    }
+    if (colors) ctx.fillStyle = style;
+};
+
+// sizes holds either a single diameter or one per circle
+pura.circles = function(ctx, points, sizes, colors) {
+    let style = ctx.fillStyle;
+    let sizeStep = sizes.length > 1 ? 1 : 0;
+    for (let i = 0, j = 0; j < points.length; ++i, j += 2) {
+        if (colors) ctx.fillStyle = colors[i];
+        ctx.beginPath();
+        ctx.arc(points[j], points[j + 1], sizes[i * sizeStep] / 2, 0, 2 * Math.PI);
+        ctx.fill();
+        ctx.stroke();
+    }
+    if (colors) ctx.fillStyle = style;
+};
+
+// Interpret binary commands of the given DataView, starting at offset.
+pura.execBinary = function(view, ctx, offset) {
+    let op = pura.op;
+    let u8 = function() { return view.getUint8(offset++); };
+    let u32 = function() { let v = view.getUint32(offset, true); offset += 4; return v; };
+    let f32 = function() { let v = view.getFloat32(offset, true); offset += 4; return v; };
+    let str = function(n) {
+        let s = pura.textDecoder.decode(new Uint8Array(view.buffer, view.byteOffset + offset, n));
+        offset += n;
+        return s;
+    };
+    let s16 = function() { let n = view.getUint16(offset, true); offset += 2; return str(n); };
+    let s32 = function() { return str(u32()); };
+    let floats = function() {
+        let n = u32();
+        let start = view.byteOffset + offset;
+        offset += n;
+        // (copy since Float32Array requires alignment)
+        return new Float32Array(view.buffer.slice(start, start + n));
+    };
+    let bytes = function() {
+        let n = u32();
+        let data = new Uint8Array(view.buffer, view.byteOffset + offset, n);
+        offset += n;
+        return data;
+    };
+    let colors = function() {
+        let n = u32();
+        let bytes = new Uint8Array(view.buffer, view.byteOffset + offset, n);
+        offset += n;
+        return pura.colorStrings(bytes);
+    };
+    let color = function() {
+        let v = view.getUint32(offset);
+        offset += 4;
+        return "#" + v.toString(16).padStart(8, "0");
+    };
+    let image, id, closed, move_first, x, y, w, h, start, stop, format;
+    while (offset < view.byteLength) {
+        let is_pending = false;
+        let code = u8();
+        switch (code) {
+        case op.SWAP:
+            pura.swap();
+            break;
+        case op.BACKGROUND:
+            ctx.save();
+            ctx.fillStyle = color();
+            ctx.fillRect(0, 0, f32(), f32());
+            ctx.restore();
+            break;
+        case op.STROKE_WEIGHT: ctx.lineWidth = f32(); break;
+        case op.STROKE_CAP: ctx.lineCap = s16(); break;
+        case op.STROKE: ctx.strokeStyle = color(); break;
+        case op.FILL: ctx.fillStyle = color(); break;
+        case op.TRANSLATE: ctx.translate(f32(), f32()); break;
+        case op.ROTATE: ctx.rotate(f32()); break;
+        case op.SCALE: ctx.scale(f32(), f32()); break;
+        case op.BEGIN_PATH: ctx.beginPath(); break;
+        case op.END_SHAPE:
+            if (u8()) ctx.closePath();
+            ctx.fill();
+            ctx.stroke();
+            break;
+        case op.MOVE_TO: ctx.moveTo(f32(), f32()); break;
+        case op.LINE_TO: ctx.lineTo(f32(), f32()); break;
+        case op.LINE:
+            ctx.beginPath();
+            ctx.moveTo(f32(), f32());
+            ctx.lineTo(f32(), f32());
+            ctx.stroke();
+            break;
+        case op.RECT:
+            ctx.beginPath();
+            ctx.rect(f32(), f32(), f32(), f32());
+            ctx.fill();
+            ctx.stroke();
+            break;
+        case op.CIRCLE:
+            ctx.beginPath();
+            ctx.arc(f32(), f32(), f32(), f32(), f32());
+            ctx.fill();
+            ctx.stroke();
+            break;
+        case op.ARC:
+            x = f32(); y = f32(); w = f32(); h = f32(); start = f32(); stop = f32();
+            ctx.beginPath();
+            ctx.save();
+            ctx.translate(x, y);
+            ctx.scale(w, h);
+            ctx.moveTo(0, 0);
+            ctx.arc(0, 0, 0.5, start, stop);
+            ctx.fill();
+            ctx.beginPath();
+            ctx.arc(0, 0, 0.5, start, stop);
+            ctx.restore();
+            ctx.stroke();
+            break;
+        case op.TEXT: ctx.fillText(s32(), f32(), f32()); break;
+        case op.TEXT_SIZE: ctx.font = f32() + "px " + ctx.font.split(" ")[1]; break;
+        case op.TEXT_FONT: ctx.font = ctx.font.split(" ")[0] + " " + s16(); break;
+        case op.FONT: ctx.font = f32() + "px " + s16(); break;
+        case op.TEXT_ALIGN:
+            ctx.textAlign = s16();
+            ctx.textBaseline = s16();
+            break;
+        case op.IMAGE_SMOOTHING: ctx.imageSmoothingEnabled = !!u8(); break;
+        case op.SAVE: ctx.save(); break;
+        case op.RESTORE: ctx.restore(); break;
+        case op.LOAD_IMAGE:
+            id = u32();
+            pura.imagesById[id] = pura.loadImage(s32());
+            break;
+        case op.UNLOAD_IMAGE: delete pura.imagesById[u32()]; break;
+        case op.IMAGE:
+            image = pura.imagesById[u32()];
+            is_pending = pura.drawImage(ctx, image, [f32(), f32()]);
+            break;
+        case op.IMAGE_SIZED:
+            image = pura.imagesById[u32()];
+            is_pending = pura.drawImage(ctx, image, [f32(), f32(), f32(), f32()]);
+            break;
+        case op.IMAGE_INLINE:
+        case op.IMAGE_INLINE_SIZED:
+            image = new Image();
+            image.src = "data:image/png;base64," + s32();
+            is_pending = pura.drawImage(ctx, image, code === op.IMAGE_INLINE ?
+                                        [f32(), f32()] : [f32(), f32(), f32(), f32()]);
+            break;
+        case op.LOAD_SHAPE:
+            id = u32();
+            closed = u8();
+            pura.shapesById[id] = pura.makePath(floats(), closed);
+            break;
+        case op.UNLOAD_SHAPE: delete pura.shapesById[u32()]; break;
+        case op.SHAPE: pura.drawShape(ctx, pura.shapesById[u32()], f32(), f32()); break;
+        case op.VERTICES:
+            move_first = u8();
+            pura.vertices(ctx, floats(), move_first);
+            break;
+        case op.LINES: pura.lines(ctx, floats(), colors()); break;
+        case op.POINTS: pura.points(ctx, floats(), colors()); break;
+        case op.POLYLINE:
+            closed = u8();
+            pura.polyline(ctx, floats(), closed);
+            break;
+        case op.RECTS: pura.rects(ctx, floats(), colors()); break;
+        case op.CIRCLES: pura.circles(ctx, floats(), floats(), colors()); break;
+        case op.LOAD_LAYER:
+            id = u32();
+            is_pending = pura.loadLayer(id, bytes());
+            break;
+        case op.UNLOAD_LAYER: delete pura.layersById[u32()]; break;
+        case op.LAYER: pura.drawLayer(ctx, u32()); break;
+        case op.IMAGE_DATA:
+            format = u8();
+            w = u32();
+            h = u32();
+            is_pending = pura.drawImageData(ctx, format, w, h, bytes(),
+                                            [f32(), f32(), f32(), f32()]);
+            break;
+        default:
+            window.console.error("unknown binary op", code);
+            return;
+        }
+        if (is_pending) {
+            if (offset < view.byteLength) {
+                pura.pendingCommands.unshift({view: view, offset: offset, ctx: ctx});
+            }
+            return;
+        }
+    }
+};
+
+// Diff mode:  the server sends either the full list of frame commands, edits
+// to the previous list, or a marker to repeat it.  Commands are JavaScript
+// strings or binary (Uint8Array) depending on the protocol.  In either case
+// the retained frame is replayed in full.
+
+pura.keyFrame = function(ctx, commands) {
+    pura.frame.commands = commands;
+    pura.frame.batches = null;
+    pura.replayFrame(ctx);
+};
+
+// edits are [start, end, commands] replacing ranges of the previous frame,
+// in ascending order
+pura.diffFrame = function(ctx, edits) {
+    let commands = pura.frame.commands;
+    for (let i = edits.length - 1; i >= 0; --i) {
+        let [start, end, replacement] = edits[i];
+        commands.splice(start, end - start, ...replacement);
+    }
+    pura.frame.batches = null;
+    pura.replayFrame(ctx);
+};
+
+pura.repeatFrame = function(ctx) {
+    pura.replayFrame(ctx);
+};
+
+// Return retained frame commands joined into messages for execMessage().
+// JavaScript is split after image draws, which may defer subsequent commands.
+pura.frameBatches = function(commands) {
+    if (commands.length > 0 && typeof commands[0] !== "string") {
+        let buffer = new Uint8Array(commands.reduce((n, c) => n + c.length, 0));
+        let offset = 0;
+        commands.forEach(function(c) { buffer.set(c, offset); offset += c.length; });
+        return [{view: new DataView(buffer.buffer), offset: 0}];
+    }
+    let batches = [];
+    let batch = [];
+    commands.forEach(function(c) {
+        batch.push(c);
+        if (c.includes("isImageLoadPending")) {
+            batches.push(batch.join(""));
+            batch = [];
+        }
+    });
+    if (batch.length > 0) {
+        batches.push(batch.join(""));
+    }
+    return batches;
+};
+
+pura.replayFrame = function(ctx) {
+    let frame = pura.frame;
+    if (!frame.batches) {
+        frame.batches = pura.frameBatches(frame.commands);
+    }
+    for (let i = 0; i < frame.batches.length; ++i) {
+        if (pura.isImageLoadPending) {
+            pura.pendingCommands.unshift(...frame.batches.slice(i));
+            return;
+        }
+        pura.execMessage(frame.batches[i], ctx);
+    }
+};
+
+// Return [commands, offset] of binary command list at the given offset
+pura.readCommandList = function(view, offset) {
+    let n = view.getUint32(offset, true);
+    let data_offset = offset + 4 + 4 * n;
+    let commands = [];
+    for (let i = 0; i < n; ++i) {
+        let size = view.getUint32(offset + 4 + 4 * i, true);
+        commands.push(new Uint8Array(view.buffer, view.byteOffset + data_offset, size));
+        data_offset += size;
+    }
+    return [commands, data_offset];
+};
+
+// Execute message from a webview socket, which is either JavaScript
+// source or binary commands.
+pura.execMessage = function(data, ctx) {
+    if (typeof data === "string") {
+        pura.eval(data, ctx);
+    } else if (data.view) {
+        // remainder of binary message deferred by an image load
+        pura.execBinary(data.view, data.ctx || ctx, data.offset);
+    } else if (data.ctx) {
+        // JavaScript of a layer deferred by an image load (see loadLayer())
+        pura.eval(data.data, data.ctx);
+    } else {
+        let view = new DataView(data);
+        let kind = view.getUint8(0);
+        let kinds = pura.messageKind;
+        if (kind === kinds.COMMANDS) {
+            pura.execBinary(view, ctx, 1);
+        } else if (kind === kinds.KEY_FRAME) {
+            pura.keyFrame(ctx, pura.readCommandList(view, 1)[0]);
+        } else if (kind === kinds.DIFF_FRAME) {
+            let n = view.getUint32(1, true);
+            let offset = 5;
+            let edits = [];
+            for (let i = 0; i < n; ++i) {
+                let start = view.getUint32(offset, true);
+                let end = view.getUint32(offset + 4, true);
+                let [commands, next_offset] = pura.readCommandList(view, offset + 8);
+                edits.push([start, end, commands]);
+                offset = next_offset;
+            }
+            pura.diffFrame(ctx, edits);
+        } else if (kind === kinds.REPEAT_FRAME) {
+            pura.repeatFrame(ctx);
+        } else {
+            window.console.error("unknown binary message kind", kind);
+        }
+    }
+};
+
+// Return decoder of compressed messages, as sent by a peer which negotiated
+// compression.  The deflate stream spans all messages of the connection.
+// Since decompression is asynchronous, messages are passed through decode()
+// in order, which resolves to the original message (string or ArrayBuffer).
+pura.makeInflater = function() {
+    let stream = new DecompressionStream("deflate-raw");
+    let writer = stream.writable.getWriter();
+    let reader = stream.readable.getReader();
+    let output = [];  // decompressed chunks not yet consumed
+    let outputLength = 0;
+    let chain = Promise.resolve();
+    // resolve once at least length bytes of output are available
+    let readAtLeast = function(length) {
+        if (outputLength >= length) {
+            return Promise.resolve();
+        }
+        return reader.read().then(function(result) {
+            output.push(result.value);
+            outputLength += result.value.length;
+            return readAtLeast(length);
+        });
+    };
+    let inflate = function(data) {
+        let view = new DataView(data);
+        let isText = view.getUint8(1);
+        let length = view.getUint32(2, true);
+        writer.write(new Uint8Array(data, 6));
+        return readAtLeast(length).then(function() {
+            let bytes = new Uint8Array(outputLength);
+            let offset = 0;
+            output.forEach(function(chunk) { bytes.set(chunk, offset); offset += chunk.length; });
+            output = outputLength > length ? [bytes.slice(length)] : [];
+            outputLength -= length;
+            return isText ? pura.textDecoder.decode(bytes.subarray(0, length))
+                          : bytes.buffer.slice(0, length);
+        });
+    };
+    let inflater = {pending: 0};
+    inflater.isCompressed = function(data) {
+        return typeof data !== "string" &&
+            new DataView(data).getUint8(0) === pura.messageKind.COMPRESSED;
+    };
+    inflater.decode = function(data) {
+        ++inflater.pending;
+        chain = chain.then(function() {
+            return inflater.isCompressed(data) ? inflate(data) : data;
+        }).finally(function() { --inflater.pending; });
+        return chain;
+    };
+    return inflater;
+};
+
 pura.isConnected = function () {
-    return pura.webviewSocket !== null && pura.webviewSocket.readyState === WebSocket.OPEN;
+    return pura.viewChannel !== null && pura.isChannelOpen(pura.viewChannel);
 };
 
 pura.add_webview = function(base_url, path, width, height, display_name, link_url) {
-    let url = base_url + path;
     let name = display_name || path;
-    window.console.log('add webview', url);
+    window.console.log('add webview', base_url + path);
+    let ws = pura.webviewServers.find(ws => ws.baseUrl === base_url);
     pura.webviewInfoByName[name] =
-        {url: url, width: width, height: height, link_url: link_url};
+        {ws: ws, path: path, width: width, height: height, link_url: link_url};
     let option = document.createElement("option");
     option.text = name;
     // add item to list in alphabetical order
@@ -168,17 +903,17 @@ let webview_onopen = function(e) {
     //}));
 };
 
-let webview_onmessage = function(e) {
+pura.handleMessage = function(data) {
     if (pura.isImageLoadPending) {
-        pura.pendingCommands.push(e.data);
+        pura.pendingCommands.push(data);
     } else {
-        pura.eval(e.data, pura.backContext);
+        pura.execMessage(data, pura.backContext);
     }
 };
 
 pura.resumeCommands = function() {
     while (pura.pendingCommands.length > 0 && !pura.isImageLoadPending) {
-        pura.eval(pura.pendingCommands.shift(), pura.backContext);
+        pura.execMessage(pura.pendingCommands.shift(), pura.backContext);
     }
 };
 
@@ -195,8 +930,12 @@ pura.webviewSelect.onchange = function() {
         return;
     }
 
-    if (pura.webviewSocket) {
-        pura.webviewSocket.close();
+    if (pura.viewChannel) {
+        pura.closeChannel(pura.viewChannel);
+        pura.viewChannel = null;
+    }
+    if (info.ws.readyState !== WebSocket.OPEN) {
+        return;
     }
     let pixelRatio = window.devicePixelRatio;
     canvas.width = pura.backCanvas.width = Math.trunc(info.width * pixelRatio);
@@ -204,11 +943,11 @@ pura.webviewSelect.onchange = function() {
     canvas.style.width = info.width + 'px';
     canvas.style.height = info.height + 'px';
     pura.backContext.scale(pixelRatio, pixelRatio);
-    // TODO: retry if webview socket is disconnected but main socket remains
-    let ws = new WebSocket(info.url);
-    ws.onopen = webview_onopen;
-    ws.onmessage = webview_onmessage;
-    pura.webviewSocket = ws;
+    // (no handshake, so the view's first frame follows right away)
+    pura.frame = {commands: [], batches: null};
+    pura.layersById = {};
+    pura.viewChannel = pura.openChannel(info.ws, info.path, pura.handleMessage);
+    webview_onopen();
     pura.webviewSelect.blur();
     pura.lastWebview = name;
     window.location.hash = '#' + name;
@@ -245,14 +984,16 @@ window.onhashchange = function() {
     document.title = [pura.baseTitle, pura.webviewSelect.value, window.location.hostname].join(" • ");
 };
 
-// disconnect webview if tab is hidden, reconnect when unhidden
-// This is to avoid filling memory, since the WebSocket API does not have backpressure.
+// unsubscribe from webview if tab is hidden, resubscribe when unhidden
+// Frames are already paced by acks, which a hidden tab stops sending (see
+// requestAck()).  But resource loads aren't paced, and unsubscribing lets the
+// server stop drawing the view if there are no other viewers.
 let handleVisibilityChange = function() {
-    if (document.hidden && pura.webviewSocket) {
-        window.console.log("disconnecting webview (window hidden)");
+    if (document.hidden && pura.viewChannel) {
+        window.console.log("unsubscribing webview (window hidden)");
         pura.connectionStatus.className = "status in-progress";
-        pura.webviewSocket.close();
-        pura.webviewSocket = null;
+        pura.closeChannel(pura.viewChannel);
+        pura.viewChannel = null;
     } else if (!document.hidden && pura.connectionStatus.className !== "status dead") {
         window.console.log("reconnecting webview (window unhidden)");
         pura.requestOpenWebview();
@@ -0,0 +1,25 @@
+import json
+
+import anyio
+import pytest
+
+from pura import bench
+
+
+@pytest.mark.parametrize("pattern", ['primitive.*', 'view.*', 'input.*', 'repl.*'])
+def test_bench(pattern):
+    async def main():
+        return bench.run(pattern, quick=True)
+
+    results = anyio.run(main)
+    assert results
+    assert all(result['seconds'] > 0 for result in results)
+
+
+def test_bench_main(tmp_path, capsys):
+    path = tmp_path / 'results.json'
+    bench.main(['-k', 'view.Hello.*', '--quick', '--json', str(path)])
+    results = json.loads(path.read_text())['results']
+    assert [result['name'] for result in results] == ['view.Hello.binary', 'view.Hello.js']
+    assert results[0]['bytes'] < results[1]['bytes']
+    assert 'view.Hello.binary' in capsys.readouterr().out
@@ -1,8 +1,9 @@
 from collections.abc import Hashable
 
+import numpy
 import pytest
 
-from pura._web_view import _canvas_color, Color
+from pura._web_view import _canvas_color, _color, Color
 
 
 @pytest.mark.parametrize("test_input,expected_rgba", [
@@ -17,6 +18,20 @@ def test_color(test_input, expected_rgba):
     assert (c.r, c.g, c.b, c.a) == expected_rgba
 
 
+def test_color_numpy():
+    channels = numpy.array([200, 100, 50], dtype='u1')
+    c = _color(*channels)
+    assert c == Color(200, 100, 50)
+    assert isinstance(c.r, int)
+    assert c.rgba_int() == 0xc86432ff
+
+
+@pytest.mark.parametrize("test_input", [(256,), (-1, 0, 0), (0, 0, 0, 300)])
+def test_color_out_of_range(test_input):
+    with pytest.raises(ValueError):
+        Color(*test_input)
+
+
 def test_color_hashable():
     assert isinstance(Color(255), Hashable)
     assert Color(128) == Color(128, 128, 128) == Color(128, 128, 128, 255)
@@ -45,3 +60,24 @@ def test_color_js_string(test_input, expected):
 ])
 def test_canvas_color(test_input, expected):
     assert _canvas_color(*test_input) == expected
+
+
+@pytest.mark.parametrize("value,expected", [
+    (0xAABBCCDD, Color(0xaa, 0xbb, 0xcc, 0xdd)),
+    (0x000000FF, Color(0)),
+    (0xFFFFFF00, Color(255, 0)),
+])
+def test_color_from_int(value, expected):
+    c = Color.from_int(value)
+    assert c == expected
+    assert c.rgba_int() == value
+
+
+def test_color_interned():
+    assert _color(1, 2, 3) is _color(1, 2, 3)
+    assert _color(Color(1, 2, 3)) is _color(Color(1, 2, 3))
+    c = _color(1, 2, 3, 4)
+    assert c.js_string() is c.js_string()
+    # cached encodings don't affect equality or hashing
+    assert c == Color(1, 2, 3, 4)
+    assert hash(c) == hash(Color(1, 2, 3, 4))
@@ -0,0 +1,35 @@
+import anyio
+
+from pura import OverheadView
+from pura._protocol import Op
+from pura._scheduler import FrameScheduler
+from pura._web_view import DrawContext, FrameStats
+
+
+class _Server:
+    def __init__(self):
+        self.webviews = []
+        self.scheduler = FrameScheduler(load_budget=.05)
+
+
+def test_overhead_view():
+    server = _Server()
+
+    async def main():
+        view = DrawContext(size=(10, 10), frame_rate=10, draw_fn=lambda ctx: None)
+        dashboard = OverheadView(server)
+        server.webviews += [('view', view), (dashboard.webview.name, dashboard.webview._ctx),
+                            ('repl', object())]
+        ctx = dashboard.webview._ctx
+        for _ in range(2):
+            view.metrics.record_frame(FrameStats(bytes_sent=100), .001, .001)
+            ctx._drawFrame()
+        return ctx._sendQueue
+
+    commands = anyio.run(main)
+    # (both frames are queued, and the first has no plot lines)
+    texts = [cmd[1] for cmd in commands if cmd[0] is Op.TEXT]
+    assert texts[:3] == ['pura loop time: 0.0%', texts[1], 'view']
+    assert texts[3].endswith('0 peers')
+    assert texts[4] == 'pura overhead'
+    assert sum(cmd[0] is Op.POLYLINE for cmd in commands) == 3
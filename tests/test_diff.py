@@ -0,0 +1,70 @@
+import random
+import time
+
+import pytest
+
+from pura._diff import apply_edits, edits_cost, frame_edits
+from pura._protocol import decode_binary, encode_diff_frame, MessageKind, Op, Protocol
+
+
+def test_frame_edits_identical():
+    frame = [(Op.SAVE,), (Op.LINE, 1, 2, 3, 4), (Op.RESTORE,)]
+    assert not frame_edits(frame, list(frame))
+
+
+@pytest.mark.parametrize("cur", [
+    [(Op.SAVE,), (Op.TEXT, 'b', 0, 0), (Op.RESTORE,)],  # change
+    [(Op.SAVE,), (Op.TEXT, 'a', 0, 0), (Op.LINE, 1, 2, 3, 4), (Op.RESTORE,)],  # insert
+    [(Op.SAVE,), (Op.RESTORE,)],  # delete
+    [],
+])
+def test_frame_edits(cur):
+    prev = [(Op.SAVE,), (Op.TEXT, 'a', 0, 0), (Op.RESTORE,)]
+    edits = frame_edits(prev, cur)
+    assert apply_edits(prev, edits) == cur
+    assert len(edits) == 1
+
+
+def test_frame_edits_random():
+    rng = random.Random(0)
+    prev = [(Op.LINE, rng.randrange(5), 0, 0, 0) for _ in range(500)]
+    for _ in range(20):
+        cur = list(prev)
+        for _ in range(rng.randrange(10)):
+            i = rng.randrange(len(cur))
+            cur[i:i + rng.randrange(3)] = [(Op.ROTATE, rng.random())] * rng.randrange(3)
+        assert apply_edits(prev, frame_edits(prev, cur)) == cur
+        prev = cur
+
+
+@pytest.mark.parametrize("changed", [.05, .33, 1])
+def test_frame_edits_large(changed):
+    rng = random.Random(0)
+    n = 2000
+    prev = [(Op.RECT, i, 0, 10, 10) for i in range(n)]
+    cur = list(prev)
+    for i in rng.sample(range(n), int(n * changed)):
+        cur[i] = (Op.RECT, i, 1, 10, 10)
+    t_start = time.perf_counter()
+    edits = frame_edits(prev, cur)
+    elapsed = time.perf_counter() - t_start
+    assert apply_edits(prev, edits) == cur
+    # (changed commands plus those trapped between changes)
+    assert edits_cost(edits) <= n * changed * 2
+    # (difflib took ~500 ms on this)
+    assert elapsed < .1
+
+    inserted = list(prev)
+    for i in sorted(rng.sample(range(n), 20), reverse=True):
+        inserted[i:i] = [(Op.SAVE,), (Op.RESTORE,)]
+    edits = frame_edits(prev, inserted)
+    assert apply_edits(prev, edits) == inserted
+    assert edits_cost(edits) == 60
+
+
+def test_encode_diff_frame_binary():
+    edits = [(1, 2, [(Op.ROTATE, 0.5)]), (5, 5, [(Op.SAVE,), (Op.RESTORE,)])]
+    assert decode_binary(encode_diff_frame(edits, Protocol.BINARY)) == \
+        (MessageKind.DIFF_FRAME, edits)
+    assert decode_binary(encode_diff_frame([], Protocol.BINARY)) == \
+        (MessageKind.REPEAT_FRAME, [])
@@ -0,0 +1,346 @@
+import json
+
+import anyio
+import pytest
+
+from pura._peer import Peer
+from pura._protocol import ControlKind, decode_binary, MessageKind, Op, Protocol
+from pura._web_view import Color, DrawContext, WebView
+
+
+def _draw_frame(draw_fn, **kwargs):
+    """Return (commands, stats) of a single frame drawn by draw_fn"""
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=draw_fn, **kwargs)
+        ctx._drawFrame()
+        ctx._finalizeFrame([])
+        return ctx._sendQueue, ctx._frameStats
+    return anyio.run(main)
+
+
+def _fills(ctx):
+    ctx.fill(255)  # default
+    ctx.fill(1)
+    ctx.fill(Color(1))
+    ctx.strokeWeight(2)
+    ctx.strokeWeight(2.0)
+    with ctx.pushContext():
+        ctx.fill(1)
+        ctx.fill(2)
+    ctx.fill(1)  # restored by pushContext()
+    ctx.fill(2)
+
+
+def test_state_elision():
+    commands, stats = _draw_frame(_fills)
+    assert commands == [
+        (Op.SAVE,),
+        (Op.FILL, Color(1)),
+        (Op.STROKE_WEIGHT, 2),
+        (Op.SAVE,),
+        (Op.FILL, Color(2)),
+        (Op.RESTORE,),
+        (Op.FILL, Color(2)),
+        (Op.SWAP,),
+        (Op.RESTORE,),
+    ]
+    assert (stats.commands, stats.elided) == (9, 5)
+
+
+def test_state_elision_disabled():
+    commands, stats = _draw_frame(_fills, elide=False)
+    assert len(commands) == 14
+    assert stats.elided == 0
+
+
+@pytest.mark.parametrize("draw_fn,n_commands", [
+    (lambda ctx: (ctx.textSize(12), ctx.textFont('Arial')), 0),
+    (lambda ctx: (ctx.textSize(13), ctx.textSize(13), ctx.textFont('Arial')), 1),
+    (lambda ctx: (ctx.noSmooth(), ctx.smooth(), ctx.smooth()), 2),
+    (lambda ctx: (ctx.noStroke(), ctx.stroke(0, 0), ctx.stroke(0)), 2),
+])
+def test_state_elision_ops(draw_fn, n_commands):
+    commands, _ = _draw_frame(draw_fn)
+    assert len(commands) - 3 == n_commands  # (excluding save, swap, restore)
+
+
+@pytest.mark.parametrize("protocol,diff,x", [
+    ('js', False, 0.3),
+    ('binary', True, 0.3),
+    ('binary', False, 1/3),  # (no benefit, so not quantized)
+])
+def test_precision(protocol, diff, x):
+    def draw(ctx):
+        ctx.translate(1/3, 2)
+        ctx.rotate(0.5)
+
+    async def main():
+        view = WebView('test', size=(10, 10), draw_fn=draw, diff=diff, precision=1)
+        return view.render_frame(protocol=protocol, diff=diff).commands
+
+    commands = anyio.run(main)
+    assert commands[1:3] == [(Op.TRANSLATE, x, 2), (Op.ROTATE, 0.5)]
+
+
+class _Websocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, msg):
+        self.sent.append(msg)
+
+
+@pytest.mark.parametrize("threaded", [False, True])
+def test_send_frame(threaded):
+    peer = Peer(_Websocket())
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=lambda ctx: ctx.rect(1, 2, 3, 4),
+                          threaded=threaded)
+        ctx._drawFrame()
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(peer.run_sender)
+            await ctx._sendFrame([peer])
+            await peer.aclose()
+        return ctx._frameStats
+
+    stats = anyio.run(main)
+    assert stats.bytes_raw == stats.bytes_sent == sum(map(len, peer.websocket.sent)) > 0
+    assert stats.finalize_time > 0
+    assert (stats.loop_time_saved == stats.finalize_time) == threaded
+
+
+def test_send_frame_backlog():
+    peer = Peer(_Websocket(), diff=True, max_queued_frames=1)
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=lambda ctx: None, diff=True)
+        stats = []
+        for _ in range(3):
+            ctx._drawFrame()
+            await ctx._sendFrame([peer])
+            stats.append(ctx._frameStats)
+            ctx._endFrame()
+        return stats
+
+    stats = anyio.run(main)
+    # peer sender isn't running, so the first frame is never sent
+    assert [s.dropped for s in stats] == [0, 1, 1]
+    assert peer.dropped_frames == 2
+    assert peer.needs_keyframe
+
+
+def test_send_frame_paced_diff():
+    peer = Peer(_Websocket(), protocol=Protocol.BINARY, diff=True, credits=1)
+
+    def draw(ctx):
+        for i in range(10):
+            ctx.rect(i, 0, 1, 1)
+        ctx.rect(0, ctx.frameCount, 5, 5)
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=draw, diff=True)
+        for i in range(3):
+            if i == 2:
+                peer.handle_control(bytes([ControlKind.ACK, 1]))
+            ctx._drawFrame()
+            await ctx._sendFrame([peer])
+            ctx._endFrame()
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(peer.run_sender)
+            await peer.aclose()
+
+    anyio.run(main)
+    # (the frame after the paced one is diffed against the first, not sent in full)
+    assert peer.paced_frames == 1
+    assert [decode_binary(msg)[0] for msg in peer.websocket.sent] == \
+        [MessageKind.KEY_FRAME, MessageKind.DIFF_FRAME]
+
+
+@pytest.mark.parametrize("delay,completed", [(0, True), (1, False)])
+def test_async_draw(delay, completed):
+    async def draw(ctx):
+        ctx.rect(1, 2, 3, 4)
+        ctx.loadImage(b'abc')
+        await anyio.sleep(delay)
+        ctx.rect(5, 6, 7, 8)
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=draw, draw_timeout=.01)
+        result = await ctx._drawFrameAsync()
+        return result, ctx
+
+    result, ctx = anyio.run(main)
+    assert result == completed
+    assert len(ctx._sendQueue) == (5 if completed else 0)
+    assert len(ctx._resourceQueue) == 1  # (kept either way)
+    assert ctx.discardedFrames == (0 if completed else 1)
+    assert not ctx._is_draw_context
+
+
+def test_render_frame():
+    async def main():
+        view = WebView('test', size=(10, 10), draw_fn=lambda ctx: ctx.rect(1, 2, 3, 4), diff=True)
+        return [view.render_frame(protocol=protocol, diff=True)
+                for protocol in ('js', 'binary', 'binary')]
+
+    js, binary, repeat = anyio.run(main)
+    assert js.commands == binary.commands == repeat.commands
+    assert len(js.messages) == 1 and isinstance(js.messages[0], str)
+    assert binary.stats.bytes_sent == len(binary.messages[0]) < js.stats.bytes_sent
+    assert decode_binary(repeat.messages[0]) == (MessageKind.REPEAT_FRAME, [])
+
+
+@pytest.mark.parametrize("changed,kind", [(10, MessageKind.DIFF_FRAME),
+                                          (90, MessageKind.KEY_FRAME)])
+def test_render_frame_diff_fallback(changed, kind):
+    def draw(ctx):
+        for i in range(100):
+            ctx.rect(i, ctx.frameCount if i < changed else 0, 1, 1)
+
+    async def main():
+        view = WebView('test', size=(10, 10), draw_fn=draw, diff=True)
+        return [view.render_frame(diff=True) for _ in range(2)]
+
+    key, frame = anyio.run(main)
+    assert decode_binary(key.messages[0])[0] is MessageKind.KEY_FRAME
+    assert decode_binary(frame.messages[0])[0] is kind
+
+
+def _input(msg_type, x=0, y=0):
+    return json.dumps({'type': msg_type, 'x': x, 'y': y, 'button': 0, 'alt_key': False,
+                       'ctrl_key': False, 'meta_key': False, 'shift_key': False, 'key_code': 'a'})
+
+
+def test_receive_queue():
+    messages = [_input('mousemove', 1, 1), _input('mousemove', 2, 2), _input('mousedown', 2, 2),
+                _input('mousemove', 3, 3), _input('mousemove', 4, 4), _input('keydown'),
+                _input('keyup'), _input('mousemove', 5, 5), _input('mouseup', 5, 5)]
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=lambda ctx: None,
+                          input_queue_size=5)
+        for msg in messages:
+            await ctx._handleMessage(None, msg)
+        return ctx
+
+    ctx = anyio.run(main)
+    # consecutive moves are coalesced, and discrete events kept in order
+    # until the queue is full
+    assert [json.loads(msg)['type'] for msg in ctx._receiveQueue] == \
+        ['mousemove', 'mousedown', 'mousemove', 'keydown', 'keyup']
+    assert json.loads(ctx._receiveQueue[2])['x'] == 4
+    assert ctx.droppedInputs == 2
+    for msg in ctx._receiveQueue:
+        ctx._handleDeferredMessage(msg)
+    assert (ctx.mouseX, ctx.mouseY, ctx.mousePressed) == (4, 4, True)
+    assert [event for event, _ in ctx.inputEvents] == ['mousedown', 'keydown', 'keyup']
+
+
+def test_layer():
+    keys = [1, 1, 2]
+    drawn = []
+
+    def draw(ctx):
+        ctx.fill(1)
+        with ctx.layer('static', key=keys[ctx.frameCount]) as changed:
+            drawn.append(changed)
+            ctx.fill(2)
+            ctx.rect(1, 2, 3, 4)
+        ctx.fill(1)  # (frame state is unaffected by the layer)
+        ctx.rect(5, 6, 7, 8)
+
+    async def main():
+        view = WebView('test', size=(10, 10), draw_fn=draw)
+        return [view.render_frame(protocol='binary') for _ in keys], view._ctx
+
+    frames, ctx = anyio.run(main)
+    assert drawn == [True, False, True]
+    (layer_id, _, load), = ctx._layers.values()
+    assert frames[0].commands[1:] == [(Op.FILL, Color(1)), (Op.LAYER, layer_id),
+                                      (Op.RECT, 5, 6, 7, 8), (Op.SWAP,), (Op.RESTORE,)]
+    assert frames[1].commands == frames[0].commands
+    loads = [[cmd for cmd in decode_binary(frame.messages[0])[1] if cmd[0] is Op.LOAD_LAYER]
+             for frame in frames]
+    assert [len(commands) for commands in loads] == [1, 0, 1]
+    assert loads[2] == [(Op.LOAD_LAYER, layer_id, [
+        (Op.STROKE_CAP, 'round'), (Op.FONT, 12, 'Arial'), (Op.FILL, (255, 255, 255, 255)),
+        (Op.FILL, (2, 2, 2, 255)), (Op.RECT, 1, 2, 3, 4)])]
+    # layers are loaded by clients connecting later, in a message of their own
+    assert ctx._resourceCommands()[-1] is load
+
+
+def test_layer_connect():
+    class _Peer:
+        protocol = Protocol.BINARY
+
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, msg):
+            self.sent.append(msg)
+
+    def draw(ctx):
+        with ctx.layer('a', key=0):
+            ctx.rect(1, 2, 3, 4)
+        with ctx.layer('b', key=0):
+            ctx.rect(1, 2, 3, 4)
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=draw)
+        ctx._drawFrame()
+        ctx._endFrame()
+        ctx.unloadLayer('b')  # (outside of draw, so only forgotten)
+        peer = _Peer()
+        await ctx._handleConnected(peer)
+        return peer.sent
+
+    sent = anyio.run(main)
+    # LOAD_LAYER ends its message, since its commands may be deferred
+    assert [[cmd[0] for cmd in decode_binary(msg)[1]][-1] for msg in sent] == [Op.LOAD_LAYER]
+
+
+def test_shape_outside_draw():
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=lambda ctx: ctx.shape(shape))
+        ctx._peers.add(Peer(_Websocket()))
+        shape = ctx.createShape()
+        shape.beginShape()
+        shape.vertices([1, 2, 3, 4])
+        shape.endShape()
+        ctx._drawFrame()
+        loads = list(ctx._resourceQueue)
+        ctx._endFrame()
+        ctx.unloadShape(shape)
+        assert not ctx._shapes
+        ctx._draw_fn = lambda ctx: None
+        ctx._drawFrame()
+        return shape, loads, ctx._releaseQueue
+
+    shape, loads, releases = anyio.run(main)
+    # (sent with the next frame, to clients already connected)
+    assert [cmd[:2] for cmd in loads] == [(Op.LOAD_SHAPE, shape._id)]
+    assert releases == [(Op.UNLOAD_SHAPE, shape._id)]
+
+
+def test_resources_outside_draw_no_peers():
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=lambda ctx: None)
+        for i in range(1000):
+            image = ctx.loadImage(b'image %d' % i)
+            shape = ctx.createShape()
+            shape.beginShape()
+            shape.vertices([1, 2, 3, 4])
+            shape.endShape()
+            ctx.unloadImage(image)
+            ctx.unloadShape(shape)
+        # (replayed by _handleConnected() instead)
+        assert not ctx._pendingResources and not ctx._pendingReleases
+        peer = Peer(_Websocket())
+        ctx._peers.add(peer)
+        ctx.unloadImage(ctx.loadImage(b'image'))
+        assert len(ctx._pendingResources) == len(ctx._pendingReleases) == 1
+        ctx._handleClose(peer)
+        assert not ctx._pendingResources and not ctx._pendingReleases
+
+    anyio.run(main)
@@ -0,0 +1,158 @@
+import struct
+import sys
+import zlib
+
+import anyio
+import numpy
+import pytest
+
+from pura._image_array import apply_colormap, ArrayImage, colormap_lut, encode_png
+from pura._peer import Peer
+from pura._protocol import decode_binary, ImageFormat, Op
+from pura._web_view import DrawContext, WebView
+
+
+def _decode_png(data):
+    """Return (h, w, channels) pixels of PNG from encode_png()"""
+    assert data.startswith(b'\x89PNG\r\n\x1a\n')
+    offset, chunks = 8, {}
+    while offset < len(data):
+        n, = struct.unpack_from('>I', data, offset)
+        tag = data[offset + 4:offset + 8]
+        chunks[tag] = data[offset + 8:offset + 8 + n]
+        offset += 12 + n
+    width, height, _, color_type = struct.unpack_from('>IIBB', chunks[b'IHDR'])
+    channels = {0: 1, 4: 2, 2: 3, 6: 4}[color_type]
+    rows = numpy.frombuffer(zlib.decompress(chunks[b'IDAT']), 'u1').reshape(height, -1)
+    assert (rows[:, 0] == 2).all()
+    # (undo up filter)
+    return numpy.cumsum(rows[:, 1:], axis=0, dtype='u1').reshape(height, width, channels)
+
+
+@pytest.mark.parametrize("channels", [1, 3, 4])
+def test_encode_png(channels):
+    pixels = numpy.random.default_rng(0).integers(0, 256, (5, 7, channels), dtype='u1')
+    assert (_decode_png(encode_png(pixels)) == pixels).all()
+
+
+def test_colormap():
+    lut = colormap_lut('viridis')
+    assert lut.shape == (256, 3) and tuple(lut[0]) == (68, 1, 84)
+    assert colormap_lut('viridis') is lut
+    with pytest.raises(ValueError):
+        colormap_lut('nope')
+    values = numpy.array([[0., 1., 2.], [3., 4., numpy.nan]])
+    pixels = apply_colormap(values, colormap_lut('gray'))
+    assert pixels.shape == (2, 3, 4)
+    assert list(pixels[0, :, 0]) == [0, 64, 128]
+    assert pixels[1, 1, 0] == 255 and pixels[1, 2, 3] == 0 and pixels[1, 1, 3] == 255
+    # clipped to vmin..vmax
+    pixels = apply_colormap(values[:1], colormap_lut('gray'), vmin=1, vmax=1.5)
+    assert pixels.shape == (1, 3, 3) and list(pixels[0, :, 0]) == [0, 0, 255]
+
+
+@pytest.mark.parametrize("array", [
+    numpy.zeros((2, 3, 2), 'u1'),
+    numpy.zeros((2, 3, 3), 'f4'),
+    numpy.zeros(3),
+    numpy.array([['a']]),
+])
+def test_invalid_array(array):
+    with pytest.raises(ValueError):
+        ArrayImage(array, 0, 0, None, None, colormap='gray', vmin=None, vmax=None,
+                   format_='auto', quality=80)
+
+
+@pytest.mark.parametrize("shape,format_,expected", [
+    ((4, 4, 3), 'auto', ImageFormat.RGBA),
+    ((100, 100, 4), 'auto', ImageFormat.PNG),
+    ((4, 4), 'png', ImageFormat.PNG),
+])
+def test_image_array(shape, format_, expected):
+    array = numpy.arange(numpy.prod(shape), dtype='u1').reshape(shape)
+
+    def draw(ctx):
+        ctx.imageArray(array, 1, 2, format=format_)
+        array[:] = 0  # (copied)
+
+    async def main():
+        view = WebView('test', size=(10, 10), draw_fn=draw)
+        return view.render_frame(protocol='binary')
+
+    frame = anyio.run(main)
+    (_, format_code, width, height, data, *position), = \
+        [cmd for cmd in frame.commands if cmd[0] is Op.IMAGE_DATA]
+    assert (format_code, width, height) == (expected, shape[1], shape[0])
+    assert position == [1, 2, shape[1], shape[0]]
+    if expected is ImageFormat.RGBA:
+        pixels = numpy.frombuffer(data, 'u1').reshape(height, width, 4)
+        assert (pixels[..., 3] == 255).all()
+    else:
+        pixels = _decode_png(data)
+    if len(shape) == 3:
+        assert (pixels[..., :3] == numpy.arange(numpy.prod(shape), dtype='u1')
+                .reshape(shape)[..., :3]).all()
+    assert (Op.IMAGE_DATA, format_code, width, height, data, *position) in \
+        [cmd for msg in frame.messages for cmd in decode_binary(msg)[1]]
+
+
+@pytest.mark.parametrize("kwargs,error", [
+    ({'format': 'gif'}, ValueError),
+    ({'format': 'jpeg', 'quality': 101}, ValueError),
+    ({'format': 'jpeg'}, ImportError),
+    ({'format': 'webp'}, ImportError),
+])
+def test_image_array_invalid_args(monkeypatch, kwargs, error):
+    monkeypatch.setitem(sys.modules, 'PIL', None)  # (as if Pillow isn't installed)
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=lambda ctx: None)
+        ctx._is_draw_context = True
+        # (raised by the call, rather than later when the frame is encoded)
+        with pytest.raises(error):
+            ctx.imageArray(numpy.zeros((2, 2)), 0, 0, **kwargs)
+        assert not ctx._arrayImages
+
+    anyio.run(main)
+
+
+class _Websocket:
+    async def send(self, msg):
+        pass
+
+
+def test_skipped_frame_not_encoded():
+    peer = Peer(_Websocket(), max_queued_frames=1)
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=lambda ctx: ctx.imageArray(
+            numpy.zeros((2, 2)), 0, 0))
+        queues = []
+        for _ in range(2):
+            ctx._drawFrame()
+            await ctx._sendFrame([peer])
+            queues.append(list(ctx._sendQueue))
+            ctx._endFrame()
+        return queues
+
+    sent, skipped = anyio.run(main)
+    # peer sender isn't running, so the second frame is skipped
+    assert any(cmd[0] is Op.IMAGE_DATA for cmd in sent if isinstance(cmd, tuple))
+    assert not skipped  # (draw commands discarded, including placeholders)
+
+
+def test_skipped_frame_precision():
+    # JS peer out of credit, whose skipped frame must not be quantized
+    peer = Peer(_Websocket(), credits=1)
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, precision=2, draw_fn=lambda ctx: (
+            ctx.imageArray(numpy.zeros((2, 2)), 0, 0), ctx.rect(1/3, 0, 1, 1)))
+        for _ in range(2):
+            ctx._drawFrame()
+            await ctx._sendFrame([peer])
+            ctx._endFrame()
+        return ctx.frameStats
+
+    stats = anyio.run(main)
+    assert stats.dropped == 1 and peer.paced_frames == 1
@@ -0,0 +1,112 @@
+import socket
+import urllib.error
+import urllib.request
+
+import anyio
+import pytest
+
+from pura import WebViewServer
+from pura._image_store import image_key, image_store, ImageStore, mime_type
+from pura._peer import Peer
+from pura._protocol import Op
+from pura._web_view import DrawContext
+
+
+@pytest.mark.parametrize("data,expected", [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff\xe0', 'image/jpeg'),
+    (b'RIFF\0\0\0\0WEBPVP8 ', 'image/webp'),
+    (b'\0\0\1\0\1\0', 'image/x-icon'),
+    (b'?', 'image/png'),
+])
+def test_mime_type(data, expected):
+    assert mime_type(data) == expected
+
+
+def test_image_store():
+    store = ImageStore(max_bytes=12)
+    a = store.add(b'aaaa')
+    assert a == image_key(b'aaaa')
+    assert store.add(b'aaaa') == a
+    b = store.add(b'bbbb')
+    c = store.add(b'cccc')
+    # referenced entries aren't evicted, even beyond the bound
+    store.add(b'dddd')
+    assert store.bytes == 16 and len(store) == 4
+    store.release(a)
+    assert a in store  # (still referenced)
+    store.release(a)
+    assert store.bytes == 12 and a not in store
+    store.release(b)
+    store.release(c)
+    assert b in store and c in store
+    # least recently used is evicted first
+    assert store.get(b) == b'bbbb'
+    store.add(b'eeee')
+    assert store.bytes == 12 and b in store and c not in store
+    assert store.evictions == 2
+    assert store.get(c) is None
+
+
+def test_unload_image():
+    data = b'unload image test'
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=lambda ctx: None)
+        ctx._peers.add(Peer(None))  # (a connected client)
+        image = ctx.loadImage(data)
+        # (outside of draw, so held until the next frame)
+        ctx.unloadImage(image)
+        assert not ctx._images and not ctx._releaseQueue
+        ctx._drawFrame()
+        return image, ctx._releaseQueue
+
+    image, release_queue = anyio.run(main)
+    assert release_queue == [(Op.UNLOAD_IMAGE, image._id)]
+    assert image_store._entries[image._key][1] == 0
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _http_get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, None
+
+
+def test_serve_image():
+    port = _free_port()
+    png = b'\x89PNG\r\n\x1a\nimage'
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=None)
+        image = ctx.loadImage(png)
+        async with anyio.create_task_group() as tg:
+            await tg.start(WebViewServer().serve, 'test', '127.0.0.1', port)
+            url = f'http://127.0.0.1:{port}/img/{image._key}'
+            with anyio.fail_after(5):
+                while True:
+                    try:
+                        result = await anyio.to_thread.run_sync(_http_get, url)
+                        break
+                    except OSError:
+                        await anyio.sleep(.05)
+            ctx.unloadImage(image)
+            missing = await anyio.to_thread.run_sync(_http_get, url[:-1])
+            await anyio.sleep(.3)  # (let the server see the disconnect)
+            tg.cancel_scope.cancel()
+        return image, result, missing
+
+    image, (status, headers, data), missing = anyio.run(main)
+    assert status == 200 and data == png
+    assert headers['Content-Type'] == 'image/png'
+    assert 'immutable' in headers['Cache-Control']
+    assert missing[0] == 404
+    # unreferenced, but kept while within the memory bound
+    assert image._key in image_store
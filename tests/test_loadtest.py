@@ -0,0 +1,77 @@
+import socket
+
+import anyio
+import pytest
+
+from pura import loadtest
+
+
+def test_percentile():
+    assert loadtest.percentile([], 50) is None
+    values = list(range(1, 101))
+    assert loadtest.percentile(values, 50) == 50
+    assert loadtest.percentile(values, 99) == 99
+    assert loadtest.percentile(values, 100) == 100
+    assert loadtest.percentile([3], 0) == 3
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.parametrize("protocol, compress", [('binary', False), ('binary', True),
+                                                 ('js', False)])
+def test_headless_client(protocol, compress):
+    port = _free_port()
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(lambda: loadtest.serve('127.0.0.1', port, 1, frame_rate=30,
+                                                 primitives=5))
+            client = loadtest.HeadlessClient('127.0.0.1', port, 'load0', protocol=protocol,
+                                             compress=compress, input_rate=20)
+            with anyio.fail_after(10):
+                while True:
+                    try:
+                        await client.run(1)
+                        break
+                    except OSError:  # (server not listening yet)
+                        await anyio.sleep(.05)
+            await anyio.sleep(.3)  # (let the server see the disconnect)
+            tg.cancel_scope.cancel()
+        return client
+
+    client = anyio.run(main)
+    assert client.frames > 5
+    assert client.bytes > 0
+    assert client.latencies
+    assert all(0 <= latency < 1 for latency in client.latencies)
+
+
+@pytest.mark.parametrize("mux", [True, False])
+def test_run_step(mux):
+    port = _free_port()
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(lambda: loadtest.serve('127.0.0.1', port, 2, frame_rate=30,
+                                                 primitives=5))
+            with anyio.fail_after(10):
+                while True:
+                    try:
+                        result = await loadtest.run_step('127.0.0.1', port, 2, ['load0', 'load1'],
+                                                         1, mux=mux, input_rate=20)
+                        break
+                    except OSError:  # (server not listening yet)
+                        await anyio.sleep(.05)
+            await anyio.sleep(.3)  # (let the server see the disconnect)
+            tg.cancel_scope.cancel()
+        return result
+
+    result = anyio.run(main)
+    assert (result['clients'], result['views'], result['mux']) == (2, 2, mux)
+    assert result['fps_min'] > 5
+    assert result['bytes_per_sec'] > 0
+    assert result['latency_p50'] is not None
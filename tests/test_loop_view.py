@@ -0,0 +1,62 @@
+import sys
+import threading
+import time
+
+import anyio
+
+from pura import LoopView
+from pura._loop_view import _coroutine_names, await_point, current_coroutines
+
+
+async def _inner(event):
+    await event.wait()
+
+
+async def _outer(event):
+    await _inner(event)
+
+
+def test_await_point():
+    async def main():
+        event = anyio.Event()
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(_outer, event)
+            await anyio.sleep(0)
+            coro = next(coro for coro in current_coroutines('asyncio')
+                        if coro.__qualname__ == '_outer')
+            result = await_point(coro)
+            event.set()
+        return result
+
+    assert anyio.run(main).startswith('Event.wait (')
+
+
+def test_coroutine_names():
+    async def main():
+        return _coroutine_names(sys._getframe())
+
+    assert anyio.run(main)[-1] == 'test_coroutine_names.<locals>.main'
+
+
+def test_loop_view():
+    async def main():
+        view = LoopView(slow_threshold=.05)
+        ctx = view.webview._ctx
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(view.run_sampler)
+            await anyio.sleep(.05)
+            assert not any(thread.name == 'pura loop watchdog' for thread in threading.enumerate())
+            ctx._hasPeers.set()
+            await anyio.sleep(.05)
+            time.sleep(.15)  # stall
+            await anyio.sleep(.05)
+            ctx._drawFrame()
+            tg.cancel_scope.cancel()
+        return view, ctx._sendQueue
+
+    view, commands = anyio.run(main)
+    assert sum(view.lag.counts) > 2 and view.maxLag > .1
+    assert len(view.slowLog) == 1
+    _, duration, names, _ = view.slowLog[0]
+    assert duration > .1 and names[-1] == 'test_loop_view.<locals>.main'
+    assert any('tasks' in str(command) for command in commands)
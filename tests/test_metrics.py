@@ -0,0 +1,36 @@
+import anyio
+
+from pura._metrics import format_metrics, Histogram
+from pura._scheduler import FrameScheduler
+from pura._web_view import DrawContext, FrameStats
+
+
+def test_histogram():
+    histogram = Histogram((1, 2))
+    for value in (.5, 1, 1.5, 3):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.sum == 6
+
+
+class _Server:
+    def __init__(self, webviews):
+        self.webviews = webviews
+        self._peers = []
+        self.scheduler = FrameScheduler()
+
+
+def test_format_metrics():
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=1, draw_fn=lambda ctx: None)
+        ctx.metrics.record_frame(FrameStats(commands=3, bytes_raw=20, bytes_sent=10), .002, .02)
+        return format_metrics(_Server([('a"b', ctx), ('repl', object())]))
+
+    lines = anyio.run(main).splitlines()
+    assert 'pura_views 2' in lines
+    assert 'pura_view_frames_total{view="a\\"b"} 1' in lines
+    assert 'pura_view_commands_total{view="a\\"b"} 3' in lines
+    assert 'pura_view_draw_seconds_bucket{view="a\\"b",le="0.0025"} 1' in lines
+    assert 'pura_view_send_seconds_bucket{view="a\\"b",le="0.01"} 0' in lines
+    assert 'pura_view_send_seconds_count{view="a\\"b"} 1' in lines
+    assert 'pura_view_dropped_inputs_total{view="a\\"b"} 0' in lines
@@ -0,0 +1,127 @@
+import json
+import re
+import socket
+
+import anyio
+
+from pura import DrawContext, WebViewMixin, WebViewServer
+from pura._protocol import ControlKind, decode_binary, Op, unwrap_channel_message
+from pura._ws_client import WebsocketClient
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def _connect(port, target):
+    with anyio.fail_after(5):
+        while True:
+            try:
+                return await WebsocketClient.connect('127.0.0.1', port, target)
+            except OSError:  # (server not listening yet)
+                await anyio.sleep(.02)
+
+
+class _View(WebViewMixin):
+    def __init__(self, name):
+        super().__init__(webview_name=name, webview_size=(100, 50), webview_frame_rate=30)
+        self.inputs = []
+
+    def draw(self, ctx: DrawContext):
+        self.inputs.extend(ctx.inputEvents)
+        ctx.text(self.webview.name, 0, 10)
+
+
+def test_multiplexed_views():
+    port = _free_port()
+
+    async def main():
+        views = [_View('a'), _View('b')]
+        async with anyio.create_task_group() as tg:
+            server = WebViewServer()
+            await tg.start(server.serve, 'mux', '127.0.0.1', port)
+            for view in views:
+                tg.start_soon(view.webview.serve, server)
+            async with await _connect(port, '/_mux?protocol=binary&credits=1') as client:
+
+                async def receive(channel_id):
+                    """Return next message of the channel, acknowledging frames"""
+                    while True:
+                        channel, msg = unwrap_channel_message(await client.receive())
+                        if isinstance(msg, bytes) and any(cmd[0] is Op.SWAP
+                                                          for cmd in decode_binary(msg)[1]):
+                            await client.send(bytes([ControlKind.ACK, 1, channel, 0]))
+                        if channel == channel_id:
+                            return msg
+
+                async def subscribe(channel_id, path):
+                    await client.send(json.dumps({'type': 'subscribe', 'channel': channel_id,
+                                                  'path': path}))
+
+                with anyio.fail_after(5):
+                    await subscribe(0, '_main')
+                    assert 'pura.add_webview(ws_url,"a"' in await receive(0)
+                    await subscribe(1, 'a')
+                    await subscribe(2, 'b')
+                    texts = set()
+                    # (both views are paced by acks of their own channel)
+                    for _ in range(10):
+                        for channel_id in (1, 2):
+                            _, commands = decode_binary(await receive(channel_id))
+                            texts.update(cmd[1] for cmd in commands if cmd[0] is Op.TEXT)
+                    assert texts == {'a', 'b'}
+                    await client.send('2 ' + json.dumps({'type': 'mousedown', 'x': 1, 'y': 2,
+                                                         'button': 0}))
+                    await client.send(json.dumps({'type': 'unsubscribe', 'channel': 1}))
+                    while views[1].inputs != [('mousedown', (1, 2))]:
+                        await receive(2)
+                    assert not views[0].webview._ctx._peers
+                    assert len(views[1].webview._ctx._peers) == 1
+                    assert len(server._peers) == 1
+            await anyio.sleep(.3)  # (let the server see the disconnect)
+            assert not views[1].webview._ctx._peers
+            assert not server._peers
+            tg.cancel_scope.cancel()
+
+    anyio.run(main)
+
+
+def test_relay_remote():
+    port, remote_port = _free_port(), _free_port()
+
+    async def main():
+        local_view, remote_view, shadowed_view = _View('a'), _View('b'), _View('a')
+        async with anyio.create_task_group() as tg:
+            remote = WebViewServer()
+            await tg.start(remote.serve, 'remote', '127.0.0.1', remote_port)
+            tg.start_soon(remote_view.webview.serve, remote)
+            tg.start_soon(shadowed_view.webview.serve, remote)
+            server = WebViewServer()
+            await tg.start(server.serve, 'local', '127.0.0.1', port)
+            tg.start_soon(local_view.webview.serve, server)
+            async with anyio.create_task_group() as relay_tg:
+                relay_tg.start_soon(lambda: server.relay_remote(
+                    f'http://127.0.0.1:{remote_port}', retry_interval=.1))
+                async with await _connect(port, '/_mux?protocol=binary') as client:
+                    await client.send(json.dumps({'type': 'subscribe', 'channel': 0,
+                                                  'path': '_main'}))
+                    names = []
+                    with anyio.fail_after(5):
+                        while 'b' not in names:
+                            _, msg = unwrap_channel_message(await client.receive())
+                            names += re.findall(r'add_webview\(ws_url,"([^"]*)"', msg)
+                        await client.send(json.dumps({'type': 'subscribe', 'channel': 1,
+                                                      'path': 'b'}))
+                        while True:
+                            channel, msg = unwrap_channel_message(await client.receive())
+                            if channel == 1 and (Op.TEXT, 'b', 0, 10) in decode_binary(msg)[1]:
+                                break
+                    assert names == ['a', 'b']
+                    assert len(remote_view.webview._ctx._peers) == 1
+                relay_tg.cancel_scope.cancel()
+            await anyio.sleep(.3)  # (let the servers see the disconnects)
+            tg.cancel_scope.cancel()
+
+    anyio.run(main)
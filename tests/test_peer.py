@@ -0,0 +1,117 @@
+import time
+
+import anyio
+import pytest
+
+from pura._peer import Peer
+from pura._protocol import ControlKind, MessageKind, Protocol
+
+
+class _Websocket:
+    def __init__(self, **args):
+        self.args = args
+        self.sent = []
+
+    async def send(self, msg):
+        self.sent.append(msg)
+
+
+@pytest.mark.parametrize("args,protocol,diff", [
+    ({}, Protocol.JS, False),
+    ({'protocol': 'binary', 'diff': '1'}, Protocol.BINARY, True),
+    ({'protocol': 'foo'}, Protocol.JS, False),
+])
+def test_from_websocket(args, protocol, diff):
+    peer = Peer.from_websocket(_Websocket(**args))
+    assert (peer.protocol, peer.diff) == (protocol, diff)
+
+
+@pytest.mark.parametrize("args,level,compressed", [
+    ({}, 6, False),  # not supported by client
+    ({'compress': 'deflate'}, None, False),  # not enabled by server
+    ({'compress': 'deflate'}, 6, True),
+])
+def test_compression(args, level, compressed):
+    websocket = _Websocket(**args)
+    peer = Peer.from_websocket(websocket, compression_level=level, compression_min_size=10)
+    msg = 'ctx.save();' * 10
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(peer.run_sender)
+            assert await peer.send('short') == 5
+            assert (await peer.send(msg) < len(msg)) == compressed
+            await peer.aclose()
+
+    anyio.run(main)
+    assert websocket.sent[0] == 'short'
+    assert (websocket.sent[1][0] == MessageKind.COMPRESSED) == compressed
+
+
+def test_backlog():
+    websocket = _Websocket()
+    peer = Peer(websocket, max_queued_frames=2)
+
+    async def main():
+        peer.send_prepared(['a', 'b'], is_frame=True)
+        assert not peer.is_backlogged
+        peer.send_prepared(['c'], is_frame=True)
+        assert peer.is_backlogged and peer.queued_frames == 2
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(peer.run_sender)
+            await peer.aclose()
+        assert not peer.is_backlogged
+
+    anyio.run(main)
+    assert websocket.sent == ['a', 'b', 'c']
+
+
+@pytest.mark.parametrize("args,credits,max_bps", [
+    ({'credits': '2', 'max_bps': '1e4'}, 2, 1e4),
+    ({'credits': 'x', 'max_bps': '-1'}, None, None),
+])
+def test_from_websocket_pacing(args, credits, max_bps):  # pylint: disable=redefined-builtin
+    peer = Peer.from_websocket(_Websocket(**args))
+    assert (peer._maxCredits, peer._maxBps) == (credits, max_bps)
+
+
+def test_credits():
+    peer = Peer(_Websocket(), credits=2, max_queued_frames=10)
+
+    async def main():
+        for _ in range(2):
+            assert peer.admit_frame()
+            peer.send_prepared(['a'], is_frame=True)
+        assert not peer.admit_frame()
+        assert peer.paced_frames == 1
+        peer.handle_control(bytes([ControlKind.ACK, 5]))  # (capped at 2)
+        assert peer.admit_frame() and peer.admit_frame()
+        assert not peer.admit_frame()
+
+    anyio.run(main)
+
+
+@pytest.mark.parametrize("msg", [b'', bytes([ControlKind.ACK]), b'\xff\x01'])
+def test_malformed_control(msg):
+    peer = Peer(_Websocket(), credits=2)
+    peer._credits = 0
+    peer.handle_control(msg)  # (ignored)
+    assert peer._credits == 0
+
+
+def test_max_bps(monkeypatch):
+    now = [0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    peer = Peer(_Websocket(), max_bps=100, max_queued_frames=10)
+
+    async def main():
+        assert peer.admit_frame()
+        peer.send_prepared(['x' * 50], is_frame=True)
+        assert not peer.admit_frame()
+        now[0] = .2
+        assert not peer.admit_frame()
+        now[0] = .3
+        assert peer.admit_frame()
+        assert peer.paced_frames == 2
+
+    anyio.run(main)
@@ -0,0 +1,153 @@
+import struct
+import zlib
+from array import array
+
+import pytest
+
+from pura._protocol import (channel_message, compress_message, compressor, control_channel,
+                            decode_binary, decompress_message, encode, encode_js, ImageFormat,
+                            MessageKind, Op, pack_colors, pack_floats, Protocol, quantize,
+                            unwrap_channel_message)
+from pura._web_view import Color
+
+
+@pytest.mark.parametrize("command,expected", [
+    ((Op.LINE, 1, 2, 3, 4.5),
+     'ctx.beginPath();ctx.moveTo(1, 2);ctx.lineTo(3, 4.5);ctx.stroke();'),
+    ((Op.FILL, Color(0xaa, 0xbb, 0xcc)), "ctx.fillStyle = '#AABBCC';"),
+    ((Op.TEXT, "it's", 1, 2), 'ctx.fillText("it\'s", 1, 2);'),
+    ((Op.END_SHAPE, True), 'ctx.closePath();ctx.fill();ctx.stroke();'),
+    ((Op.LOAD_IMAGE, 5, 'abc'), 'pura.imagesById[5]=pura.loadImage("abc");'),
+    ((Op.IMAGE_SIZED, 5, 1, 2, 3, 4),
+     'pura.isImageLoadPending = pura.drawImage(ctx,pura.imagesById[5],[1,2, 3, 4]);'),
+    ((Op.IMAGE_DATA, 0, 1, 1, b'\xff\0\0\xff', 1, 2, 3, 4),
+     'pura.isImageLoadPending = pura.drawImageData(ctx,0,1,1,pura.decodeBytes("/wAA/w=="),'
+     '[1,2,3,4]);'),
+    ((Op.LOAD_LAYER, 3, [(Op.IMAGE, 5, 1, 2), (Op.SAVE,)]),
+     'pura.loadLayer(3,["pura.isImageLoadPending = pura.drawImage(ctx,pura.imagesById[5],[1,2]);",'
+     ' "ctx.save();"]);'),
+    ((Op.LOAD_SHAPE, 7, True, pack_floats([1, 2])),
+     'pura.shapesById[7]=pura.makePath(pura.decodeFloats("AACAPwAAAEA="),true);'),
+])
+def test_encode_js(command, expected):
+    assert encode_js([command]) == expected
+
+
+def test_binary_round_trip():
+    commands = [
+        (Op.BACKGROUND, Color(1, 2, 3, 4), 320, 240),
+        (Op.STROKE_CAP, 'round'),
+        (Op.LINE, 1, 2, 3, 4.5),
+        (Op.TEXT, 'héllo', 1, 2),
+        (Op.END_SHAPE, True),
+        (Op.LOAD_IMAGE, 5, 'abc'),
+        (Op.LOAD_SHAPE, 6, False, pack_floats([1.5, 2, 3, 4])),
+        (Op.IMAGE_DATA, ImageFormat.PNG, 2, 1, b'\x89PNG', 1, 2, 4, 2),
+        (Op.LOAD_LAYER, 7, [(Op.FILL, Color(1, 2, 3)), (Op.RECT, 1, 2, 3, 4)]),
+        (Op.LAYER, 7),
+        (Op.SWAP,),
+    ]
+    kind, decoded = decode_binary(encode(commands, Protocol.BINARY))
+    assert kind is MessageKind.COMMANDS
+    assert decoded == [
+        (Op.BACKGROUND, (1, 2, 3, 4), 320, 240),
+        (Op.STROKE_CAP, 'round'),
+        (Op.LINE, 1, 2, 3, 4.5),
+        (Op.TEXT, 'héllo', 1, 2),
+        (Op.END_SHAPE, 1),
+        (Op.LOAD_IMAGE, 5, 'abc'),
+        (Op.LOAD_SHAPE, 6, 0, pack_floats([1.5, 2, 3, 4])),
+        (Op.IMAGE_DATA, ImageFormat.PNG, 2, 1, b'\x89PNG', 1, 2, 4, 2),
+        (Op.LOAD_LAYER, 7, [(Op.FILL, (1, 2, 3, 255)), (Op.RECT, 1, 2, 3, 4)]),
+        (Op.LAYER, 7),
+        (Op.SWAP,),
+    ]
+
+
+def test_binary_long_strings():
+    text = 'x' * 70000
+    assert decode_binary(encode([(Op.TEXT, text, 1, 2)], Protocol.BINARY))[1] == \
+        [(Op.TEXT, text, 1, 2)]
+    with pytest.raises(ValueError):
+        encode([(Op.TEXT_FONT, text)], Protocol.BINARY)
+
+
+def test_binary_is_compact():
+    commands = [(Op.LINE, 1.2345678901234567, 2.5, 3.25, 4.125)] * 10
+    assert len(encode(commands, Protocol.BINARY)) == 1 + 17 * 10
+    assert len(encode(commands, Protocol.JS)) > 3 * (1 + 17 * 10)
+
+
+@pytest.mark.parametrize("values", [
+    [1, 2.5, 3],
+    (1, 2.5, 3),
+    array('d', [1, 2.5, 3]),
+    memoryview(array('f', [1, 2.5, 3])),
+])
+def test_pack_floats(values):
+    assert pack_floats(values) == struct.pack('<3f', 1, 2.5, 3)
+
+
+def test_pack_floats_numpy():
+    numpy = pytest.importorskip('numpy')
+    values = numpy.arange(6, dtype=numpy.float64).reshape(3, 2)
+    assert pack_floats(values) == struct.pack('<6f', *range(6))
+    assert pack_floats(values.T) == struct.pack('<6f', 0, 2, 4, 1, 3, 5)
+
+
+@pytest.mark.parametrize("colors", [
+    [Color(1, 2, 3), Color(4, 5, 6, 7)],
+    bytes([1, 2, 3, 255, 4, 5, 6, 7]),
+])
+def test_pack_colors(colors):
+    assert pack_colors(colors) == bytes([1, 2, 3, 255, 4, 5, 6, 7])
+
+
+def test_batch_round_trip():
+    points = pack_floats([1, 2, 3, 4])
+    commands = [
+        (Op.LINES, points, pack_colors([Color(1, 2, 3)])),
+        (Op.POINTS, points, b''),
+        (Op.CIRCLES, points, pack_floats([5]), b''),
+        (Op.VERTICES, 1, points),
+    ]
+    assert decode_binary(encode(commands, Protocol.BINARY)) == (MessageKind.COMMANDS, commands)
+    assert encode_js(commands[1:2]) == \
+        'pura.points(ctx,pura.decodeFloats("AACAPwAAAEAAAEBAAACAQA=="),pura.decodeColors(""));'
+
+
+@pytest.mark.parametrize("precision,expected", [
+    (0, [(Op.LINE, 1, 2, 3, 5), (Op.TEXT, 'a', 2, 2), (Op.CIRCLE, 1, 2, 4, 0, 6.283185307179586)]),
+    (2, [(Op.LINE, 1, 2.0, 3.33, 4.67), (Op.TEXT, 'a', 1.56, 2),
+         (Op.CIRCLE, 1.23, 2, 3.5, 0, 6.283185307179586)]),
+])
+def test_quantize(precision, expected):
+    commands = [
+        (Op.LINE, 1, 2.0, 10/3, 14/3),
+        (Op.TEXT, 'a', 1.5555, 2),
+        (Op.CIRCLE, 1.234, 2, 3.5, 0, 6.283185307179586),  # (angles not rounded)
+    ]
+    assert quantize(commands, precision) == expected
+    assert encode_js(quantize(commands, precision)) == encode_js(expected)
+
+
+def test_compress_message():
+    compressor_ = compressor(6)
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    sizes = []
+    for msg in ['ctx.beginPath();' * 20, b'\x00' + bytes(range(50)), 'ctx.beginPath();' * 20]:
+        data = compress_message(compressor_, msg)
+        assert data[0] == MessageKind.COMPRESSED
+        assert decompress_message(decompressor, data) == msg
+        sizes.append(len(data))
+    # context persists across messages
+    assert sizes[2] < sizes[0]
+
+
+@pytest.mark.parametrize("msg", ['pura.swap();', b'\x00\x01\x02'])
+def test_channel_message(msg):
+    data = channel_message(258, msg)
+    assert data[0] == MessageKind.CHANNEL
+    assert unwrap_channel_message(data) == (258, msg)
+    assert control_channel(bytes([0, 1, 2, 1])) == 258
+    assert control_channel(bytes([0, 1])) is None
@@ -0,0 +1,133 @@
+import socket
+import time
+import urllib.request
+from functools import partial
+
+import anyio
+import pytest
+
+from pura import DrawContext, WebViewMixin, WebViewServer
+from pura._peer import Peer
+from pura._protocol import decode_binary, MessageKind, Op
+from pura._relay import RelayContext
+from pura._ws_client import WebsocketClient
+from pura.loadtest import HeadlessClient
+from pura.relay import Relay
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class _Upstream(WebViewMixin):
+    def __init__(self, diff):
+        super().__init__(webview_name='up', webview_size=(100, 50), webview_frame_rate=30,
+                         webview_diff=diff)
+        self.image = None
+
+    def draw(self, ctx: DrawContext):
+        if self.image is None:
+            self.image = ctx.loadImage('AAAA')
+        ctx.fill(255, 0, 0)
+        ctx.rect(1, 2, 3, 4)
+        ctx.image(self.image, 0, 0)
+        ctx.text(str(ctx.frameCount), 0, 10)
+
+
+def _http_get(url):
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+async def _wait_for(predicate):
+    with anyio.fail_after(5):
+        while not predicate():
+            await anyio.sleep(.02)
+
+
+@pytest.mark.parametrize("diff", [False, True])
+def test_relay(diff):
+    port, relay_port = _free_port(), _free_port()
+
+    async def main():
+        view = _Upstream(diff)
+        upstream_ctx = view.webview._ctx
+        upstream_shutdown, relay_shutdown = anyio.Event(), anyio.Event()
+        async with anyio.create_task_group() as tg:
+            async with anyio.create_task_group() as upstream_tg:
+                upstream = WebViewServer()
+                await upstream_tg.start(partial(upstream.serve, 'upstream', '127.0.0.1', port,
+                                                shutdown_trigger=upstream_shutdown.wait))
+                tg.start_soon(view.webview.serve, upstream)
+                relay = Relay(f'http://127.0.0.1:{port}', server=WebViewServer(), linger=.1,
+                              retry_interval=.1)
+                async with anyio.create_task_group() as relay_tg:
+                    await relay_tg.start(partial(relay.serve, 'relay', '127.0.0.1', relay_port,
+                                                 shutdown_trigger=relay_shutdown.wait))
+                    await _wait_for(lambda: 'up' in relay.contexts)
+                    clients = [HeadlessClient('127.0.0.1', relay_port, 'up') for _ in range(3)]
+                    async with anyio.create_task_group() as clients_tg:
+                        for client in clients:
+                            clients_tg.start_soon(client.run, 1)
+                        await _wait_for(lambda: len(relay.contexts['up']._peers) == 3)
+                        # (frames are relayed once the upstream connection is made)
+                        await _wait_for(lambda: all(client.frames for client in clients))
+                        # a single upstream connection
+                        assert len(upstream_ctx._peers) == 1
+
+                        # image loaded before joining is replayed
+                        async with await WebsocketClient.connect(
+                                '127.0.0.1', relay_port, '/up?protocol=binary') as late:
+                            _, commands = decode_binary(await late.receive())
+                            assert (Op.LOAD_IMAGE, view.image._id, view.image._key) in commands
+                            frame = []
+                            while not any(cmd[0] is Op.SWAP for cmd in frame):
+                                kind, commands = decode_binary(await late.receive())
+                                assert kind is MessageKind.COMMANDS
+                                frame.extend(commands)
+                        assert (Op.FILL, (255, 0, 0, 255)) in frame
+                        assert (Op.RECT, 1, 2, 3, 4) in frame
+                        assert (Op.IMAGE, view.image._id, 0, 0) in frame
+                        # image is served by the relay
+                        data = await anyio.to_thread.run_sync(
+                            _http_get, f'http://127.0.0.1:{relay_port}/img/{view.image._key}')
+                        assert data == b'\0\0\0'
+                    assert all(client.frames > 5 for client in clients)
+                    # upstream connection is closed once there are no clients
+                    await _wait_for(lambda: not upstream_ctx._peers)
+                    # (graceful shutdown of both servers, returning once complete)
+                    relay_shutdown.set()
+                upstream_shutdown.set()
+            tg.cancel_scope.cancel()  # (view)
+
+    anyio.run(main)
+
+
+class _Websocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, msg):
+        self.sent.append(msg)
+
+
+def test_relay_batch_boundaries():
+    # JS peers in batched mode must get the frame split after image draws
+    peer = Peer(_Websocket())
+
+    async def main():
+        ctx = RelayContext('localhost', _free_port(), 'up', size=(10, 10))
+        ctx._peers.add(peer)
+        await ctx._relayFrame([(Op.SAVE,), (Op.IMAGE, 1, 0., 0.),
+                               *[(Op.RECT, 1., 2., 3., 4.)] * 6, (Op.SWAP,), (Op.RESTORE,)],
+                              time.perf_counter())
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(peer.run_sender)
+            await peer.aclose()
+
+    anyio.run(main)
+    # (plus the split mid-frame)
+    assert [msg.endswith('pura.imagesById[1],[0.0,0.0]);') for msg in peer.websocket.sent] == \
+        [True, False, False]
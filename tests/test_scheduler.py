@@ -0,0 +1,96 @@
+import anyio
+import pytest
+
+from pura._scheduler import FrameScheduler, grid_deadline
+from pura._web_view import DrawContext
+
+
+@pytest.mark.parametrize("t,period,expected", [
+    (10.01, .1, 10.0),
+    (10.25, .2, 10.2),
+    (3, 1, 3),
+])
+def test_grid_deadline(t, period, expected):
+    assert grid_deadline(t, period) == pytest.approx(expected)
+
+
+def test_coalesce():
+    scheduler = FrameScheduler(coalesce=.02)
+    woken = []
+
+    async def view(i, deadline):
+        await scheduler.wait_until(deadline)
+        woken.append(i)
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(scheduler.run)
+            await anyio.sleep(0)
+            t = anyio.current_time()
+            async with anyio.create_task_group() as views:
+                views.start_soon(view, 0, t + .05)
+                views.start_soon(view, 1, t + .06)
+                views.start_soon(view, 2, t + .04)
+                views.start_soon(view, 3, t + .2)
+            assert anyio.current_time() - t >= .2 - .02
+            tg.cancel_scope.cancel()
+
+    anyio.run(main)
+    assert woken == [2, 0, 1, 3]
+    assert scheduler.wakeups == 2
+
+
+def test_missed_deadlines():
+    scheduler = FrameScheduler()
+
+    def draw_fn(ctx):
+        if ctx.frameCount == 1:
+            busy_until = anyio.current_time() + .25
+            while anyio.current_time() < busy_until:
+                pass
+
+    async def main():
+        ctx = DrawContext(size=(10, 10), frame_rate=10, draw_fn=draw_fn)
+        ctx._hasPeers.set()
+        with anyio.move_on_after(.5):
+            await ctx._run_draw_loop(scheduler)
+        return ctx
+
+    ctx = anyio.run(main)
+    assert ctx.missedDeadlines == scheduler.missed_deadlines >= 2
+    assert 3 <= ctx.frameCount <= 6
+
+
+class _View:
+    def __init__(self, priority):
+        self.priority = priority
+        self.throttle = 1
+
+
+def test_render_budget():
+    scheduler = FrameScheduler(load_budget=.1, lag_threshold=.05)
+    low, high = _View(0), _View(1)
+    scheduler.add_view(low)
+    scheduler.add_view(high)
+    now = 0
+    scheduler._intervalStart = now
+
+    def update(load, lag=0):
+        nonlocal now
+        scheduler.charge(low, .001)
+        scheduler.charge(high, load)
+        scheduler._maxLag = lag
+        now += 1
+        scheduler._updateBudget(now)
+        return low.throttle, high.throttle
+
+    assert update(.05) == (1, 1)
+    assert update(.2) == (2, 1)
+    assert update(.01, lag=.1) == (4, 1)
+    assert update(.08) == (4, 1)  # (hysteresis)
+    assert update(.01) == (2, 1)
+    for _ in range(10):
+        update(1)
+    assert low.throttle == high.throttle == FrameScheduler.MAX_THROTTLE
+    scheduler.remove_view(low)
+    assert low.throttle == 1